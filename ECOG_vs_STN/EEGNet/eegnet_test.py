@@ -1,5 +1,6 @@
 import IO
 import os
+import window_dataset
 import numpy as np
 from matplotlib import pyplot as plt
 from sklearn import metrics
@@ -43,15 +44,6 @@ def r2_keras(y_true, y_pred):
     SS_tot = K.sum(K.square(y_true - K.mean(y_true)))
     return ( 1 - SS_res/(SS_tot + K.epsilon()) )
 
-def get_label_from_gen(gen_, X_, batch_size):
-    for i in range(int(X_.shape[0]/batch_size)):
-        if i == 0:
-            arr = np.array(next(gen_)[1])
-        else:
-            arr = np.concatenate((arr, next(gen_)[1]), axis=0)
-    return arr
-
-
 def EEGNet(Chans = 6, Samples = 1000,
              dropoutRate = 0.5, kernLength = 400, F1 = 8,
              D = 2, F2 = 16, norm_rate = 0.25, dropoutType = 'Dropout'):
@@ -258,124 +250,115 @@ def get_data_raw_combined(sub, sess, loc ,f_):
             y_ips = dat_[-1,:]
     return dat_[:-4, :], y_con, y_ips
 
-  def generator_new(features, labels, batch_size, chans, samples):
-
-      # Create empty arrays to contain batch of features and labels#
-      batch_features = np.zeros([batch_size, 1, chans, samples])
-      batch_labels = np.zeros([batch_size])
-
-      while True:
-          for idx_label in np.arange(1000, features.shape[0]-batch_size, batch_size):
-              for i in range(batch_size):
-
-                  for ch in range(chans):
-                      batch_features[i,0,ch,:] = features[(idx_label+i-samples):i+idx_label,ch]
-                  batch_labels[i] = labels[idx_label+i]
-
-              yield batch_features, batch_labels, [None]
-
-  cv = KFold(n_splits=3, shuffle=False)
-  kernLength = 64 # half of fs
-  batch_size = 300
-  fs_new = 128
-  samples = 128
-  fs = 1000
-
-  for sub in subjects:
-      for loc in ["ECOG", "STN"]:
-          for sess in ["right", "left"]:
-              f_ = [file for file in vhdr_files if sub in file and sess in file]
-              if len(f_) == 0:
-                  continue
-
-              X, y_con, y_ips = get_data_raw_combined(sub, sess, loc, f_)
-
-              # resample data
-              y_con = signal.resample(y_con, int(y_con.shape[0]*fs_new / fs), axis=0)
-              y_ips = signal.resample(y_ips, int(y_ips.shape[0]*fs_new / fs), axis=0)
-              X = signal.resample(X, int(X.shape[1]*fs_new / fs), axis=1).T
-
-              chans=X.shape[1]
-              Yp_tr= OrderedDict() # Y_predict_train
-              sc_tr= OrderedDict() # score_train
-              Yp_te= OrderedDict()
-              sc_te= OrderedDict()
-              Yt_tr= OrderedDict()
-              Yt_te= OrderedDict()
-              hist_ = OrderedDict()
-
-              for lat in ["CON", "IPS"]:
-                  if lat == "CON":
-                      y_ = y_con
-                  else:
-                      y_ = y_ips
-
-                  print("RUNNING subject "+str(sub)+" sess: "+str(sess)+" lat: "+ str(lat)+ "loc: "+str(loc))
-                  score_te = []; score_tr = []
-                  pr_te = []; te = []; pr_tr = []; tr = []
-                  for train_index, test_index in cv.split(X):
-                      X_train, X_test=X[train_index, :], X[test_index, :]
-                      y_train, y_test=y_[train_index], y_[test_index]
-
-                      #X_train, X_test, y_train, y_test = train_test_split(X, y_, train_size=0.7,shuffle=False)
-                      X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, train_size=0.8,shuffle=False)
-
-
-                      model  = EEGNet(Chans = chans, Samples = samples, kernLength=kernLength)
-                      model.compile(loss = 'mse', optimizer = 'adam', metrics=["mean_squared_error"])
-
-                      es = EarlyStopping(monitor='val_mean_squared_error', mode='min', verbose=1, patience=10)
-                      mc = ModelCheckpoint('best_model.h5', monitor='val_mean_squared_error', mode='min', verbose=1, save_best_only=True)
-
-                      with tf.device('/gpu:0'):
-                          gen_tr = generator_new(X_train, y_train, batch_size, chans, samples)
-                          gen_val = generator_new(X_val, y_val, batch_size, chans, samples)
-                          hist = model.fit(gen_tr, validation_data=gen_val, steps_per_epoch=int(X_train.shape[0]/batch_size), \
-                                           epochs=100, validation_steps=int(X_val.shape[0]/batch_size), callbacks=[es,mc])
-                      model = load_model('best_model.h5', custom_objects={'r2_keras': r2_keras})
-
-                      gen_ = generator_new(X_train, y_train, batch_size, chans, samples)
-                      pr_train = model.predict(gen_, steps=int(X_train.shape[0]/batch_size))[:,0]
-                      gen_ = generator_new(X_train, y_train, batch_size, chans, samples)
-                      y_train_ = get_label_from_gen(gen_, X_train, batch_size)
-
-                      gen_ = generator_new(X_test, y_test, batch_size, chans, samples)
-                      pr_test = model.predict(gen_, steps=int(X_test.shape[0]/batch_size))[:,0]
-                      gen_ = generator_new(X_test, y_test, batch_size, chans, samples)
-                      y_test_ = get_label_from_gen(gen_, X_test, batch_size)
-
-                      sc = metrics.r2_score(pr_test, y_test_)
-                      if sc < 0: sc = 0
-                      print(sc)
-                      print("score test: "+str(sc))
-                      score_te.append(sc)
-
-                      sc = metrics.r2_score(pr_train, y_train_)
-                      if sc < 0: sc = 0
-                      print("score train: "+str(sc))
-                      score_tr.append(sc)
-
-                      pr_tr.append(pr_train)
-                      tr.append(y_train_)
-                      pr_te.append(pr_test)
-                      te.append(y_test_)
-
-                  Yp_te[lat] = pr_te
-                  Yp_tr[lat] = pr_tr
-                  Yt_te[lat] = te
-                  Yt_tr[lat] = tr
-                  sc_te[lat] = np.mean(score_te)
-                  sc_tr[lat] = np.mean(score_tr)
-                  hist_[lat] = hist.history
-
-              predict_ = {
-                  "y_pred_test": Yp_te,
-                  "y_test": Yt_te,
-                  "y_pred_train": Yp_tr,
-                  "y_train": Yt_tr,
-                  "score_tr": sc_tr,
-                  "score_te": sc_te,
-                  "hist": hist_
-              }
-
-              np.save(sub + "BestChpredictions_"+str(loc)+"-ses-"+str(sess)+".npy", predict_)
+cv = KFold(n_splits=3, shuffle=False)
+kernLength = 64 # half of fs
+batch_size = 300
+fs_new = 128
+samples = 128
+fs = 1000
+PREFETCH = 2 # number of batches prepared in a background thread during training
+
+for sub in subjects:
+    for loc in ["ECOG", "STN"]:
+        for sess in ["right", "left"]:
+            f_ = [file for file in vhdr_files if sub in file and sess in file]
+            if len(f_) == 0:
+                continue
+
+            X, y_con, y_ips = get_data_raw_combined(sub, sess, loc, f_)
+
+            # resample data
+            y_con = signal.resample(y_con, int(y_con.shape[0]*fs_new / fs), axis=0)
+            y_ips = signal.resample(y_ips, int(y_ips.shape[0]*fs_new / fs), axis=0)
+            X = signal.resample(X, int(X.shape[1]*fs_new / fs), axis=1).T
+
+            chans=X.shape[1]
+            Yp_tr= OrderedDict() # Y_predict_train
+            sc_tr= OrderedDict() # score_train
+            Yp_te= OrderedDict()
+            sc_te= OrderedDict()
+            Yt_tr= OrderedDict()
+            Yt_te= OrderedDict()
+            hist_ = OrderedDict()
+
+            for lat in ["CON", "IPS"]:
+                if lat == "CON":
+                    y_ = y_con
+                else:
+                    y_ = y_ips
+
+                print("RUNNING subject "+str(sub)+" sess: "+str(sess)+" lat: "+ str(lat)+ "loc: "+str(loc))
+                score_te = []; score_tr = []
+                pr_te = []; te = []; pr_tr = []; tr = []
+                for train_index, test_index in cv.split(X):
+                    X_train, X_test=X[train_index, :], X[test_index, :]
+                    y_train, y_test=y_[train_index], y_[test_index]
+
+                    #X_train, X_test, y_train, y_test = train_test_split(X, y_, train_size=0.7,shuffle=False)
+                    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, train_size=0.8,shuffle=False)
+
+
+                    model  = EEGNet(Chans = chans, Samples = samples, kernLength=kernLength)
+                    model.compile(loss = 'mse', optimizer = 'adam', metrics=["mean_squared_error"])
+
+                    es = EarlyStopping(monitor='val_mean_squared_error', mode='min', verbose=1, patience=10)
+                    mc = ModelCheckpoint('best_model.h5', monitor='val_mean_squared_error', mode='min', verbose=1, save_best_only=True)
+
+                    ds_tr = window_dataset.WindowDataset(X_train, y_train, batch_size, samples)
+                    ds_val = window_dataset.WindowDataset(X_val, y_val, batch_size, samples)
+                    ds_te = window_dataset.WindowDataset(X_test, y_test, batch_size, samples)
+                    with tf.device('/gpu:0'):
+                        gen_tr = ds_tr.generator(prefetch=PREFETCH)
+                        gen_val = ds_val.generator(prefetch=PREFETCH)
+                        hist = model.fit(gen_tr, validation_data=gen_val, steps_per_epoch=int(X_train.shape[0]/batch_size), \
+                                         epochs=100, validation_steps=int(X_val.shape[0]/batch_size), callbacks=[es,mc])
+                    # stop the prefetch threads of the generators
+                    gen_tr.close()
+                    gen_val.close()
+                    model = load_model('best_model.h5', custom_objects={'r2_keras': r2_keras})
+
+                    gen_tr = ds_tr.generator(prefetch=PREFETCH)
+                    pr_train = model.predict(gen_tr, steps=int(X_train.shape[0]/batch_size))[:,0]
+                    gen_tr.close()
+                    y_train_ = ds_tr.get_labels(int(X_train.shape[0]/batch_size))
+
+                    gen_te = ds_te.generator(prefetch=PREFETCH)
+                    pr_test = model.predict(gen_te, steps=int(X_test.shape[0]/batch_size))[:,0]
+                    gen_te.close()
+                    y_test_ = ds_te.get_labels(int(X_test.shape[0]/batch_size))
+
+                    sc = metrics.r2_score(pr_test, y_test_)
+                    if sc < 0: sc = 0
+                    print(sc)
+                    print("score test: "+str(sc))
+                    score_te.append(sc)
+
+                    sc = metrics.r2_score(pr_train, y_train_)
+                    if sc < 0: sc = 0
+                    print("score train: "+str(sc))
+                    score_tr.append(sc)
+
+                    pr_tr.append(pr_train)
+                    tr.append(y_train_)
+                    pr_te.append(pr_test)
+                    te.append(y_test_)
+
+                Yp_te[lat] = pr_te
+                Yp_tr[lat] = pr_tr
+                Yt_te[lat] = te
+                Yt_tr[lat] = tr
+                sc_te[lat] = np.mean(score_te)
+                sc_tr[lat] = np.mean(score_tr)
+                hist_[lat] = hist.history
+
+            predict_ = {
+                "y_pred_test": Yp_te,
+                "y_test": Yt_te,
+                "y_pred_train": Yp_tr,
+                "y_train": Yt_tr,
+                "score_tr": sc_tr,
+                "score_te": sc_te,
+                "hist": hist_
+            }
+
+            np.save(sub + "BestChpredictions_"+str(loc)+"-ses-"+str(sess)+".npy", predict_)
@@ -0,0 +1,112 @@
+"""
+Batches of raw signal windows for the EEGNet / DeepConvNet decoders.
+
+The windows are a strided view of the continuous data (numpy sliding_window_view), no window is
+stored. A batch is built with one fancy index gather of all its windows, and an optional background
+thread prepares the next batches while the model trains on the current one. The labels of any
+number of batches are a single index operation, without building the windows.
+
+Batch b contains the label indices starts[b] + [0, ..., batch_size-1] with
+starts = np.arange(start, time-batch_size, batch_size), as in the former generator_new; the window of
+label index t is features[t-samples:t], in shape(1, chans, samples) (channels_first). After the last
+batch the generator starts again with the first one. The background thread runs until the generator
+is closed, hence generators should be closed after model.fit / model.predict.
+
+Example:
+    ds = window_dataset.WindowDataset(X_train, y_train, batch_size, samples)
+    gen = ds.generator()
+    model.fit(gen, steps_per_epoch=int(X_train.shape[0]/batch_size), ...)
+    gen.close()
+    y_train_ = ds.get_labels(int(X_train.shape[0]/batch_size))
+"""
+import queue
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class WindowDataset:
+    """
+    Args:
+        features (np array): shape(time, chans)
+        labels (np array): shape(time)
+        batch_size (int)
+        samples (int): window length
+        start (int): label index of the first batch
+        dtype: dtype of the feature batches
+    """
+
+    def __init__(self, features, labels, batch_size, samples, start=1000, dtype=np.float32):
+        self.features = np.ascontiguousarray(features, dtype=dtype)
+        self.labels = np.asarray(labels)
+        self.batch_size = batch_size
+        self.samples = samples
+        # windows[t] = features[t:t+samples].T, shape(time-samples+1, chans, samples)
+        self.windows = sliding_window_view(self.features, samples, axis=0)
+        self.starts = np.arange(start, self.features.shape[0]-batch_size, batch_size)
+        if start < samples or self.starts.shape[0] == 0:
+            raise ValueError("start has to be at least samples and the data has to contain one batch")
+        self.num_batches = self.starts.shape[0]
+
+    def get_index(self, batch_idx):
+        """
+        Returns:
+            np array: label indices of the batches batch_idx (int or array), shape(..., batch_size)
+        """
+        return self.starts[np.asarray(batch_idx) % self.num_batches][..., None] + np.arange(self.batch_size)
+
+    def get_batch(self, batch_idx):
+        """
+        Returns:
+            batch_features (np array): shape(batch_size, 1, chans, samples)
+            batch_labels (np array): shape(batch_size)
+        """
+        idx = self.get_index(batch_idx)
+        return self.windows[idx - self.samples][:, None], self.labels[idx]
+
+    def get_labels(self, steps):
+        """
+        labels of the first steps batches of generator(), e.g. for the scores of model.predict(gen, steps)
+
+        Returns:
+            np array: shape(steps*batch_size)
+        """
+        return self.labels[self.get_index(np.arange(steps))].ravel()
+
+    def generator(self, prefetch=2):
+        """
+        endless generator of (batch_features, batch_labels) for model.fit / model.predict;
+        close() stops the background thread
+
+        Args:
+            prefetch (int): number of batches prepared in a background thread, 0 to build them on demand
+        """
+        if prefetch == 0:
+            batch_idx = 0
+            while True:
+                yield self.get_batch(batch_idx)
+                batch_idx = (batch_idx + 1) % self.num_batches
+
+        batches = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def fill():
+            batch_idx = 0
+            while not stop.is_set():
+                batch = self.get_batch(batch_idx)
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                batch_idx = (batch_idx + 1) % self.num_batches
+
+        thread = threading.Thread(target=fill, daemon=True)
+        thread.start()
+        try:
+            while True:
+                yield batches.get()
+        finally:  # the generator is closed or garbage collected
+            stop.set()
+            thread.join()
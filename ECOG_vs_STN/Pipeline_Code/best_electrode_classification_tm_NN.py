@@ -21,6 +21,10 @@ import pickle
 import sys
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import feature_store
+import keras_batch
+import time_dim
 import multiprocessing
 from threading import Thread
 from queue import Queue
@@ -157,23 +161,13 @@ def get_int_runs(subject_id, subfolder):
     os.listdir(settings['out_path'])
 
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
 
     return list_subject
 
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 cv = KFold(n_splits=3, shuffle=False)
 laterality=[("CON"), ("IPS")]
 signal=["ECOG", "STN"]
@@ -204,8 +198,7 @@ def get_patient_data():
 
                 print('RUNNIN SUBJECT_'+ settings['num_patients'][sub_idx]+ '_SESS_'+ str(subfolder[sess_idx]) + '_SIGNAL_' + signal_)
                 for run_idx in range(len(list_subject)):
-                    with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                        run_ = pickle.load(handle)
+                    run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
 
                     #concatenate features
                     #get cortex data only
@@ -276,16 +269,9 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
             with tf.device(tf.DeviceSpec(device_type="CPU")):
                 X_train, X_test, y_train, y_test = train_test_split(x, y, train_size=0.9,shuffle=False)
                 X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, train_size=0.8,shuffle=False)
-                es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-                mc = ModelCheckpoint('best_model_'+str(ch_idx)+str(laterality_)+'.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
                 model = create_model_NN(learning_rate, num_dense_layers, num_input_nodes, num_dense_nodes, activation)
-                try:
-                    model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[mc,es])
-                    model = load_model('best_model_'+str(ch_idx)+str(laterality_)+'.h5', compile = False)
-                except Exception as e:
-                    # error
-                    print(e)
-                    model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[es])
+                model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                                     epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
                 try:
                     sc = metrics.r2_score(model.predict(X_test), y_test)
                 except:
@@ -312,8 +298,8 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
     Xtr, Xte, Ytr, Yte = train_test_split(X, label, train_size=0.9,shuffle=False)
     label_test.append(Yte)
     label_train.append(Ytr)
-    dat_tr,label_tr = append_time_dim(Xtr, Ytr, time_stamps=5)
-    dat_te,label_te = append_time_dim(Xte, Yte, time_stamps=5)
+    dat_tr,label_tr = time_dim.append_time_dim(Xtr, Ytr, time_stamps=5, materialize=True)
+    dat_te,label_te = time_dim.append_time_dim(Xte, Yte, time_stamps=5, materialize=True)
 
 
     try:
@@ -328,16 +314,9 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
     num_dense_nodes=optimizer['x'][3]
     activation=optimizer['x'][4]
     model = create_model_NN(learning_rate, num_dense_layers, num_input_nodes, num_dense_nodes, activation)
-    es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-    mc = ModelCheckpoint('best_model_'+str(ch_idx)+str(laterality_)+'.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
     X_train, X_val, y_train, y_val = train_test_split(dat_tr, label_tr, train_size=0.8,shuffle=True)
-    try:
-        model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[mc,es])
-        model = load_model('best_model_'+str(ch_idx)+str(laterality_)+'.h5', compile = False)
-    except Exception as e:
-        # error
-        print(e)
-        model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[es])
+    model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                         epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
     try:
         r2_tr = metrics.r2_score(model.predict(X_train), y_train)
     except:
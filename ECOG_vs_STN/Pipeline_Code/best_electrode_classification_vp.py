@@ -21,6 +21,12 @@ import pickle
 import sys
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import enet_path
+import feature_store
+import keras_batch
+import time_dim
+import xgb_halving
 import multiprocessing
 
 #import tensorflow
@@ -83,6 +89,8 @@ from xgboost import XGBRegressor
 VICTORIA = False
 WRITE_OUT_CH_IND = False
 USED_MODEL = 2 # 0 - Enet, 1 - XGB, 2 - NN
+ENET_PATH = False # select the Enet hyperparameters on a warm started alpha/l1_ratio path grid instead of a GP search
+XGB_HALVING = False # select the XGB hyperparameters by successive halving over boosting rounds instead of a GP search
 settings = {}
 VERBOSE_ALL = 0
 
@@ -124,6 +132,9 @@ space_NN = [Real(low=1e-4, high=1e-2, prior='log-uniform', name='learning_rate')
 
 def optimize_enet(x,y):
 
+    if ENET_PATH is True:
+        return enet_path.optimize_enet_path(x, y)
+
     @use_named_args(space_LM)
     def objective(**params):
         reg=ElasticNet(max_iter=1000, normalize=False)
@@ -191,11 +202,9 @@ def optimize_nn(x,y):
                 y_train, y_test=y[train_index], y[test_index]
                 X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, train_size=0.8,shuffle=False)
                 #model = KerasRegressor(build_fn=create_model_NN, epochs=1000, batch_size=500, verbose=2)
-                es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-                mc = ModelCheckpoint('best_model.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
                 model = create_model_NN()
-                model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=500, verbose=VERBOSE_ALL, callbacks=[mc,es])
-                model = load_model('best_model.h5')
+                model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                                     epochs=1000, batch_size=500, verbose=VERBOSE_ALL)
                 sc = metrics.r2_score(model.predict(X_test), y_test)
                 if sc < 0: sc = 0
                 cv_res.append(sc)
@@ -209,6 +218,9 @@ def optimize_nn(x,y):
 
 def optimize_xgb(x,y):
 
+    if XGB_HALVING is True:
+        return xgb_halving.optimize_xgb_halving(x, y, space_XGB)
+
     def evalerror(preds, dtrain):
         """
         Custom defined r^2 evaluation function
@@ -257,22 +269,13 @@ def get_int_runs(subject_id, subfolder):
     os.listdir(settings['out_path'])
 
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
 
     return list_subject
 
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
 #%%
 cv = KFold(n_splits=3, shuffle=False)
 laterality=[("CON"), ("IPS")]
@@ -307,8 +310,7 @@ def run_patient(sub_idx):
             print('RUNNIN SUBJECT_'+ settings['num_patients'][sub_idx]+ '_SESS_'+ str(subfolder[sess_idx]) + '_SIGNAL_' + signal_)
 
             for run_idx in range(len(list_subject)):
-                with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                    run_ = pickle.load(handle)
+                run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
 
                 #concatenate features
                 #get cortex data only
@@ -401,8 +403,8 @@ def run_patient(sub_idx):
                         Ytr, Yte=label[train_index], label[test_index]
                         label_test.append(Yte)
                         label_train.append(Ytr)
-                        dat_tr,label_tr = append_time_dim(Xtr, Ytr, time_stamps=5)
-                        dat_te,label_te = append_time_dim(Xte, Yte, time_stamps=5)
+                        dat_tr,label_tr = time_dim.append_time_dim(Xtr, Ytr, time_stamps=5, materialize=True)
+                        dat_te,label_te = time_dim.append_time_dim(Xte, Yte, time_stamps=5, materialize=True)
 
                         if USED_MODEL == 0: # Enet
                             optimizer=optimize_enet(x=dat_tr,y=label_tr)
@@ -438,10 +440,9 @@ def run_patient(sub_idx):
 
                         if USED_MODEL == 2:
 
-                            es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-                            mc = ModelCheckpoint('best_model.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
                             X_train, X_val, y_train, y_val = train_test_split(dat_tr, label_tr, train_size=0.8,shuffle=True)
-                            model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=500, verbose=VERBOSE_ALL, callbacks=[mc,es])
+                            model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                                                 epochs=1000, batch_size=500, verbose=VERBOSE_ALL)
                             r2_tr = metrics.r2_score(model.predict(X_train), y_train)
                             if r2_tr < 0: r2_tr = 0
                             r2_te = metrics.r2_score(model.predict(dat_te), label_te)
@@ -22,6 +22,9 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import feature_store
+import time_dim
 
 from sklearn.linear_model import Ridge
 from sklearn.linear_model import LinearRegression
@@ -88,9 +91,9 @@ def get_int_runs(subject_id, subfolder):
     # else:
     #     subject_id = str('0') + str(patient_idx)
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
 
     return list_subject
 
@@ -126,15 +129,6 @@ def get_int_runs(subject_id, subfolder):
 
 #     return optimizer.max
     # print("Final result:", optimizer.max)
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
 #%%
 cv = KFold(n_splits=3, shuffle=False)
 laterality=[("CON"), ("IPS")]
@@ -166,8 +160,7 @@ for m, eeg in enumerate(signal):
             print('RUNNIN SUBJECT_'+ settings['num_patients'][s]+ '_SESS_'+ str(subfolder[ss]) + '_SIGNAL_' + eeg)
 
             for run_idx in range(len(list_subject)):
-                with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                    run_ = pickle.load(handle)
+                run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
                 #concatenate features
                 #get cortex data only
                 if eeg=="ECOG":
@@ -267,8 +260,8 @@ for m, eeg in enumerate(signal):
                         label_train.append(Ytr)
 
 
-                        dat_tr,label_tr = append_time_dim(Xtr, Ytr,time_stamps=5)
-                        dat_te,label_te = append_time_dim(Xte, Yte,time_stamps=5)
+                        dat_tr,label_tr = time_dim.append_time_dim(Xtr, Ytr,time_stamps=5, materialize=True)
+                        dat_te,label_te = time_dim.append_time_dim(Xte, Yte,time_stamps=5, materialize=True)
 
                         scaler = StandardScaler()
                         scaler.fit(dat_tr)
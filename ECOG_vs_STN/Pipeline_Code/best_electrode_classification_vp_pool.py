@@ -21,6 +21,14 @@ import pickle
 import sys
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import enet_path
+import feature_store
+import keras_batch
+import results_store
+import task_queue
+import time_dim
+import xgb_halving
 import multiprocessing
 from threading import Thread
 from queue import Queue
@@ -86,6 +94,11 @@ from xgboost import XGBRegressor
 VICTORIA = False
 WRITE_OUT_CH_IND = False
 USED_MODEL = 2 # 0 - Enet, 1 - XGB, 2 - NN
+ENET_PATH = False # select the Enet hyperparameters on a warm started alpha/l1_ratio path grid instead of a GP search
+XGB_HALVING = False # select the XGB hyperparameters by successive halving over boosting rounds instead of a GP search
+RESULTS_STORE = False # write all outputs into one SQLite results store of the sweep instead of one npy file per channel
+NN_GROUPED = False # train the NN of all channels and lateralities of a session as one batched model
+MULTI_TARGET = False # train the Enet/XGB of all channels of a session in one task with CON and IPS as two targets, requires ENET_PATH/XGB_HALVING
 settings = {}
 VERBOSE_ALL = 0
 
@@ -124,6 +137,9 @@ space_NN = [Real(low=1e-4, high=1e-2, prior='log-uniform', name='learning_rate')
 
 def optimize_enet(x,y):
 
+    if ENET_PATH is True:
+        return enet_path.optimize_enet_path(x, y)
+
     @use_named_args(space_LM)
     def objective(**params):
         reg=ElasticNet(max_iter=1000, normalize=False)
@@ -186,16 +202,9 @@ def optimize_nn(x,y, ch_idx, laterality_):
                 y_train, y_test=y[train_index], y[test_index]
                 X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, train_size=0.8,shuffle=False)
                 #model = KerasRegressor(build_fn=create_model_NN, epochs=1000, batch_size=500, verbose=2)
-                es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-                mc = ModelCheckpoint('best_model_'+str(ch_idx)+str(laterality_)+'.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
                 model = create_model_NN(learning_rate, num_dense_layers, num_input_nodes, num_dense_nodes, activation)
-                try:
-                    model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[mc,es])
-                    model = load_model('best_model_'+str(ch_idx)+str(laterality_)+'.h5', compile = False)
-                except Exception as e:
-                    # error
-                    print(e)
-                    model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
+                model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                                     epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
                 sc = metrics.r2_score(model.predict(X_test), y_test)
                 if sc < 0: sc = 0
                 cv_res.append(sc)
@@ -206,6 +215,9 @@ def optimize_nn(x,y, ch_idx, laterality_):
 
 def optimize_xgb(x,y):
 
+    if XGB_HALVING is True:
+        return xgb_halving.optimize_xgb_halving(x, y, space_XGB)
+
     def evalerror(preds, dtrain):
         """
         Custom defined r^2 evaluation function
@@ -250,28 +262,61 @@ def get_int_runs(subject_id, subfolder):
     os.listdir(settings['out_path'])
 
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
 
     return list_subject
 
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 cv = KFold(n_splits=3, shuffle=False)
 laterality=[("CON"), ("IPS")]
 signal=["ECOG", "STN"]
 
-def get_patient_data():
+def get_out_file(sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx):
+    return os.path.join(settings['out_path_process']+ \
+        settings['num_patients'][sub_idx]+'BestChpredictions_'+\
+        signal_+'-ch-'+str(ch_idx)+'-lat-'+str(laterality_)+'-'+str(subfolder[sess_idx])+'.npy')
+
+_results_store = {"pid": None, "store": None}
+
+def get_results_store():
+    """
+    ResultsStore of the sweep, opened once per process; connections can not be shared with forked pool workers
+    """
+    if _results_store["store"] is None or _results_store["pid"] != os.getpid():
+        _results_store["store"] = results_store.ResultsStore(os.path.join(settings['out_path_process'], 'results.sqlite'))
+        _results_store["pid"] = os.getpid()
+    return _results_store["store"]
+
+def save_predictions(predict_, sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx):
+    out_path_file = get_out_file(sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx)
+    if RESULTS_STORE is True:
+        print("saving dict to results store: "+os.path.basename(out_path_file))
+        get_results_store().write(os.path.basename(out_path_file), predict_, settings['num_patients'][sub_idx],
+                                  signal_, ch_idx, laterality_, subfolder[sess_idx])
+    else:
+        print("saving dict of path: "+str(out_path_file))
+        task_queue.save_atomic(out_path_file, predict_)
+
+def get_session_function():
+    """
+    pool function of the session level tasks of USED_MODEL, None for one task per channel and laterality
+
+    The Enet/XGB multi target training only exists for the ENET_PATH and XGB_HALVING searches, with the
+    GP searches every channel and laterality is a task of pool_function_la.
+    """
+    if USED_MODEL == 2 and NN_GROUPED is True:
+        return pool_function_grouped
+    if MULTI_TARGET is True and ((USED_MODEL == 0 and ENET_PATH is True) or (USED_MODEL == 1 and XGB_HALVING is True)):
+        return pool_function_multi
+    return None
+
+def get_patient_data(ledger):
+    """
+    yield (key, args of pool_function_la) for every channel and laterality which is not done in the ledger,
+    the key is the name of the output file
+    """
     for sub_idx in np.arange(0, len(settings['num_patients']), 1):
         list_param = [] # list for pool
         for signal_idx, signal_ in enumerate(signal):
@@ -296,8 +341,7 @@ def get_patient_data():
 
                 print('RUNNIN SUBJECT_'+ settings['num_patients'][sub_idx]+ '_SESS_'+ str(subfolder[sess_idx]) + '_SIGNAL_' + signal_)
                 for run_idx in range(len(list_subject)):
-                    with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                        run_ = pickle.load(handle)
+                    run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
 
                     #concatenate features
                     #get cortex data only
@@ -335,23 +379,133 @@ def get_patient_data():
                 Y_con=np.concatenate(Y_con, axis=0)
                 Y_ips=np.concatenate(Y_ips, axis=0)
 
+                if get_session_function() is not None:
+                    task_type = 'grouped' if USED_MODEL == 2 else 'multi'
+                    key = settings['num_patients'][sub_idx]+'BestChpredictions_'+signal_+'-'+task_type+'-'+str(subfolder[sess_idx])
+                    if ledger.is_done(key) is True:
+                        print("task already done: "+key)
+                        continue
+                    yield key, (X, Y_con, Y_ips, signal_, subfolder, sess_idx, sub_idx)
+                    continue
+
                 for laterality_idx, laterality_ in enumerate(laterality):
                     for ch_idx in range(X.shape[1]):
                         if laterality_ == "CON":
                             label_here = Y_con
                         else:
                             label_here = Y_ips
-                        out_path_file = os.path.join(settings['out_path_process']+ \
-                            settings['num_patients'][sub_idx]+'BestChpredictions_'+\
-                            signal_+'-ch-'+str(ch_idx)+'-lat-'+str(laterality_)+'-'+str(subfolder[sess_idx])+'.npy')
-                        if os.path.exists(out_path_file) is True:
-                            print("file already exists: "+str(out_path_file))
+                        key = os.path.basename(get_out_file(sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx))
+                        if ledger.is_done(key) is True:
+                            print("task already done: "+key)
                             continue
-                        yield X[:,ch_idx,:], label_here, ch_idx, laterality_, signal_, subfolder, sess_idx, sub_idx
+                        yield key, (X[:,ch_idx,:], label_here, ch_idx, laterality_, signal_, subfolder, sess_idx, sub_idx)
                         #list_param.append((X[:,ch_idx,:], label_here, ch_idx, laterality_, signal_, subfolder, sess_idx, sub_idx))
         #pool = multiprocessing.Pool(len(list_param))
         #pool.starmap(pool_function_la, list_param)
 
+def pool_function_grouped(X, Y_con, Y_ips, signal_, subfolder, sess_idx, sub_idx):
+    """
+    NN decoding of all channels and both lateralities of a session with keras_batch grouped models,
+    writes the same BestChpredictions files as pool_function_la for every channel and laterality
+
+    Every model is one group, group index = laterality_idx*num_channels + ch_idx. All groups share the
+    sampled hyperparameter configurations, every group selects its best configuration by its own CV score.
+    """
+    num_ch = X.shape[1]
+    groups = [(laterality_, ch_idx) for laterality_ in laterality for ch_idx in range(num_ch)]
+    out = [{"y_pred_test": [], "y_test": [], "y_pred_train": [], "y_train": [], "score_tr": [], "score_te": [],
+            "coef": [], "model_hyperparams": []} for _ in groups]
+    for train_index, test_index in cv.split(X):
+        dat_tr, dat_te = [], []
+        label_tr, label_te = [], []
+        for laterality_, Y in zip(laterality, [Y_con, Y_ips]):
+            dat_, label_ = time_dim.append_time_dim(X[train_index], Y[train_index], time_stamps=5, materialize=True)
+            dat_tr.append(dat_)
+            label_tr.append(np.repeat(label_[:, None], num_ch, axis=1))
+            dat_, label_ = time_dim.append_time_dim(X[test_index], Y[test_index], time_stamps=5, materialize=True)
+            dat_te.append(dat_)
+            label_te.append(np.repeat(label_[:, None], num_ch, axis=1))
+            for group_idx, (laterality_group, _) in enumerate(groups):
+                if laterality_group == laterality_:
+                    out[group_idx]["y_test"].append(Y[test_index])
+                    out[group_idx]["y_train"].append(Y[train_index])
+        dat_tr, dat_te = np.concatenate(dat_tr, axis=1), np.concatenate(dat_te, axis=1)
+        label_tr, label_te = np.concatenate(label_tr, axis=1), np.concatenate(label_te, axis=1)
+
+        configs, scores = keras_batch.search_grouped(dat_tr, label_tr, space_NN, n_configs=10, verbose=VERBOSE_ALL)
+        best_config = np.argmax(scores, axis=0)
+        X_train, X_val, y_train, y_val = train_test_split(dat_tr, label_tr, train_size=0.8,shuffle=True)
+        for config_idx in np.unique(best_config):
+            group_idx = np.where(best_config == config_idx)[0]
+            model = keras_batch.create_grouped_model(len(group_idx), dat_tr.shape[2], *configs[config_idx])
+            keras_batch.fit_grouped(model, X_train[:, group_idx], y_train[:, group_idx], X_val[:, group_idx],
+                                    y_val[:, group_idx], batch_size=100, verbose=VERBOSE_ALL)
+            pred_tr = keras_batch.predict_grouped(model, X_train[:, group_idx])
+            pred_dat_tr = keras_batch.predict_grouped(model, dat_tr[:, group_idx])
+            pred_te = keras_batch.predict_grouped(model, dat_te[:, group_idx])
+            for idx, group in enumerate(group_idx):
+                r2_tr = metrics.r2_score(pred_tr[:, idx], y_train[:, group])
+                r2_te = metrics.r2_score(pred_te[:, idx], label_te[:, group])
+                out[group]["score_tr"].append(r2_tr if r2_tr > 0 else 0)
+                out[group]["score_te"].append(r2_te if r2_te > 0 else 0)
+                out[group]["y_pred_test"].append(pred_te[:, idx])
+                out[group]["y_pred_train"].append(pred_dat_tr[:, idx])
+                out[group]["model_hyperparams"].append(configs[config_idx])
+            tf.keras.backend.clear_session()
+
+    for (laterality_, ch_idx), predict_ in zip(groups, out):
+        predict_["score_tr"] = np.mean(predict_["score_tr"])
+        predict_["score_te"] = np.mean(predict_["score_te"])
+        save_predictions(predict_, sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx)
+
+def pool_function_multi(X, Y_con, Y_ips, signal_, subfolder, sess_idx, sub_idx):
+    """
+    Enet / XGB decoding of all channels of a session, writes the same BestChpredictions files as
+    pool_function_la for every channel and laterality
+
+    The time dimension is appended once per fold for all channels. Per channel the CON and IPS labels are
+    two targets with the same features: the Enet search shares centering, Gram matrices and the Ridge
+    eigendecomposition of every fold (enet_path), the XGB search shares the quantized fold matrices
+    (xgb_halving). Every laterality still gets its own hyperparameters and model.
+    """
+    num_ch = X.shape[1]
+    Y = np.stack([Y_con, Y_ips], axis=1)
+    out = {(laterality_, ch_idx): {"y_pred_test": [], "y_test": [], "y_pred_train": [], "y_train": [], "score_tr": [],
+                                   "score_te": [], "coef": [], "model_hyperparams": []}
+           for laterality_ in laterality for ch_idx in range(num_ch)}
+    for train_index, test_index in cv.split(X):
+        dat_tr, label_tr = time_dim.append_time_dim(X[train_index], Y[train_index], time_stamps=5, materialize=True)
+        dat_te, label_te = time_dim.append_time_dim(X[test_index], Y[test_index], time_stamps=5, materialize=True)
+        for ch_idx in range(num_ch):
+            x_tr, x_te = np.ascontiguousarray(dat_tr[:, ch_idx]), np.ascontiguousarray(dat_te[:, ch_idx])
+            if USED_MODEL == 0: # Enet
+                optimizer = enet_path.optimize_enet_path(x_tr, label_tr)
+                coef, intercept = enet_path.fit_multi(x_tr, label_tr, [res['x'] for res in optimizer])
+                pred_tr, pred_te = x_tr @ coef + intercept, x_te @ coef + intercept
+            else: # XGB
+                optimizer = xgb_halving.optimize_xgb_halving(x_tr, label_tr, space_XGB)
+                dtrain, boosters = xgb_halving.fit_multi(x_tr, label_tr, [res['x'] for res in optimizer], space_XGB)
+                dtest = xgb_halving.get_dmatrix(x_te, ref=dtrain)
+                pred_tr = np.stack([booster.predict(dtrain) for booster in boosters], axis=1)
+                pred_te = np.stack([booster.predict(dtest) for booster in boosters], axis=1)
+            for target, laterality_ in enumerate(laterality):
+                predict_ = out[(laterality_, ch_idx)]
+                r2_tr = metrics.r2_score(label_tr[:, target], pred_tr[:, target])
+                r2_te = metrics.r2_score(label_te[:, target], pred_te[:, target])
+                predict_["score_tr"].append(r2_tr if r2_tr > 0 else 0)
+                predict_["score_te"].append(r2_te if r2_te > 0 else 0)
+                predict_["y_test"].append(Y[test_index, target])
+                predict_["y_train"].append(Y[train_index, target])
+                predict_["y_pred_test"].append(pred_te[:, target])
+                predict_["y_pred_train"].append(pred_tr[:, target])
+                if USED_MODEL == 0: predict_["coef"].append(coef[:, target])
+                predict_["model_hyperparams"].append(optimizer[target]['x'])
+
+    for (laterality_, ch_idx), predict_ in out.items():
+        predict_["score_tr"] = np.mean(predict_["score_tr"])
+        predict_["score_te"] = np.mean(predict_["score_te"])
+        save_predictions(predict_, sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx)
+
 def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx, sub_idx):
 
     Ypre_te= []
@@ -369,8 +523,8 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
         Ytr, Yte=label[train_index], label[test_index]
         label_test.append(Yte)
         label_train.append(Ytr)
-        dat_tr,label_tr = append_time_dim(Xtr, Ytr, time_stamps=5)
-        dat_te,label_te = append_time_dim(Xte, Yte, time_stamps=5)
+        dat_tr,label_tr = time_dim.append_time_dim(Xtr, Ytr, time_stamps=5, materialize=True)
+        dat_te,label_te = time_dim.append_time_dim(Xte, Yte, time_stamps=5, materialize=True)
 
         if USED_MODEL == 0: # Enet
             optimizer=optimize_enet(x=dat_tr,y=label_tr)
@@ -405,16 +559,9 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
 
         if USED_MODEL == 2:
 
-            es = EarlyStopping(monitor='val_mse', mode='min', verbose=VERBOSE_ALL, patience=10)
-            mc = ModelCheckpoint('best_model_'+str(ch_idx)+str(laterality_)+'.h5', monitor='val_mse', mode='min', verbose=VERBOSE_ALL, save_best_only=True)
             X_train, X_val, y_train, y_val = train_test_split(dat_tr, label_tr, train_size=0.8,shuffle=True)
-            try:
-                model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL, callbacks=[mc,es])
-                model = load_model('best_model_'+str(ch_idx)+str(laterality_)+'.h5', compile = False)
-            except Exception as e:
-                # error
-                print(e)
-                model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
+            model = keras_batch.fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10,
+                                                 epochs=1000, batch_size=100, verbose=VERBOSE_ALL)
 
             r2_tr = metrics.r2_score(model.predict(X_train), y_train)
             if r2_tr < 0: r2_tr = 0
@@ -460,11 +607,7 @@ def pool_function_la(X, label, ch_idx, laterality_, signal_, subfolder, sess_idx
 
 
 
-    out_path_file = os.path.join(settings['out_path_process']+ \
-        settings['num_patients'][sub_idx]+'BestChpredictions_'+\
-        signal_+'-ch-'+str(ch_idx)+'-lat-'+str(laterality_)+'-'+str(subfolder[sess_idx])+'.npy')
-    print("saving dict of path: "+str(out_path_file))
-    np.save(out_path_file, predict_)
+    save_predictions(predict_, sub_idx, signal_, ch_idx, laterality_, subfolder, sess_idx)
 
 if __name__ == '__main__':
     #for sub_idx in np.arange(0, len(settings['num_patients']), 1):
@@ -475,18 +618,11 @@ if __name__ == '__main__':
 
     #NUM_PROCESSES = multiprocessing.cpu_count()-1
     NUM_PROCESSES = 50
-    patient_dat_generator = get_patient_data()
-    gen_counter = 0
-    l_dat_gen = []
-    while True:
-        dat_ = next(patient_dat_generator, None)
-        if dat_ is None:
-            print("Final subject iteration reached, None received from generator")
-            break
-        l_dat_gen.append(dat_)
-        gen_counter +=1
-        if (gen_counter % NUM_PROCESSES) == 0:
-            print("starting pool with "+str(NUM_PROCESSES)+ " iterations")
-            pool = multiprocessing.Pool(NUM_PROCESSES)
-            pool.starmap(pool_function_la, l_dat_gen) # https://stackoverflow.com/questions/8533318/multiprocessing-pool-when-to-use-apply-apply-async-or-map
-            l_dat_gen = []
+    TASK_TIMEOUT = 6*3600  # s
+    # the ledger keeps the state of every channel task, a stopped sweep continues where it stopped
+    ledger = task_queue.TaskLedger(os.path.join(settings['out_path_process'], 'task_ledger.sqlite'))
+    pool_function = get_session_function() or pool_function_la
+    task_queue.run_tasks(ledger, get_patient_data(ledger), pool_function, n_jobs=NUM_PROCESSES,
+                         max_retries=2, timeout=TASK_TIMEOUT)
+    for key, error in ledger.get_errors().items():
+        print("failed: "+key+"\n"+error)
@@ -23,6 +23,10 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import enet_path
+import feature_store
+import time_dim
 
 from sklearn.linear_model import ElasticNet
 
@@ -36,6 +40,7 @@ from skopt import gp_minimize
 import gc
 from sklearn.preprocessing import StandardScaler
 #%%
+ENET_PATH = False # select the Enet hyperparameters on a warm started alpha/l1_ratio path grid instead of a GP search
 settings = {}
 
 settings['BIDS_path'] = "//mnt/Datos/BML_CNCRS/Data_BIDS_new/"
@@ -59,6 +64,9 @@ space_LM = [Real(0, 1, "uniform", name='alpha'),
          
 def optimize_enet(x,y):
 
+    if ENET_PATH is True:
+        return enet_path.optimize_enet_path(x, y, standardize=True)
+
     reg=ElasticNet(max_iter=1000)  
     scaler = StandardScaler()
     clf = make_pipeline(scaler, reg)
@@ -88,9 +96,9 @@ def get_int_runs(subject_id, subfolder):
     # else:
     #     subject_id = str('0') + str(patient_idx)
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
                                                                                         
     return list_subject
 
@@ -126,15 +134,6 @@ def get_int_runs(subject_id, subfolder):
     
 #     return optimizer.max
     # print("Final result:", optimizer.max)        
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
 #%%
 cv = KFold(n_splits=3, shuffle=False)  
 laterality=["CON", "IPS"]
@@ -166,8 +165,7 @@ for m, eeg in enumerate(signal):
             print('RUNNIN SUBJECT_'+ settings['num_patients'][s]+ '_SESS_'+ str(subfolder[ss]) + '_SIGNAL_' + eeg)
     
             for run_idx in range(len(list_subject)):
-                with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                    run_ = pickle.load(handle)
+                run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
                 #concatenate features
                 #get cortex data only
                 if eeg=="ECOG":    
@@ -250,7 +248,7 @@ for m, eeg in enumerate(signal):
                 for e in range(X.shape[1]):
                     
                     
-                    dat_,label_ = append_time_dim(X[:,e,:], label,time_stamps=5) 
+                    dat_,label_ = time_dim.append_time_dim(X[:,e,:], label,time_stamps=5, materialize=True) 
                     # #z-score with no cv
                     # scaler = StandardScaler()
                     # scaler.fit(dat_)
@@ -1,3 +1,8 @@
+import sys
+import os
+# icn_m1 needs to precede this folder, since it contains an older IO.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import IO
 import numpy as np
 from matplotlib import pyplot as plt
 import seaborn as sn
@@ -32,9 +37,9 @@ def get_all_files_of_type(BIDS_PATH, type_='.vhdr'):
 def get_mov_dict(raw, sess):
 
     """
-    Given a brainvision raw object, and the respective session (left / right),
+    Given a brainvision raw object (IO.BrainVisionMemmap), and the respective session (left / right),
     return the contra and or ipsilateral label
-    return None, if label does not exist
+    return None, if label does not exist; only the label channels are read
     """
 
     ind_RIGHT = [ch_idx for ch_idx, ch in enumerate(raw.ch_names) if 'RIGHT_CLEAN' in ch]
@@ -43,13 +48,13 @@ def get_mov_dict(raw, sess):
     dict_mov = {"mov_con":None, "mov_ips":None}
 
     if (len(ind_LEFT) == 1 and "right" in sess):
-        dict_mov["mov_con"] = raw.get_data()[ind_LEFT, :][0,:]
+        dict_mov["mov_con"] = raw[ind_LEFT[0], :]
     if (len(ind_RIGHT) == 1 and "left" in sess):
-        dict_mov["mov_con"] = raw.get_data()[ind_RIGHT, :][0,:]
+        dict_mov["mov_con"] = raw[ind_RIGHT[0], :]
     if (len(ind_RIGHT) == 1 and "right" in sess):
-        dict_mov["mov_ips"] = raw.get_data()[ind_RIGHT, :][0,:]
+        dict_mov["mov_ips"] = raw[ind_RIGHT[0], :]
     if (len(ind_LEFT) == 1 and "left" in sess):
-        dict_mov["mov_ips"] = raw.get_data()[ind_lEFT, :][0,:]
+        dict_mov["mov_ips"] = raw[ind_LEFT[0], :]
     return dict_mov
 
 # get subject
@@ -85,17 +90,17 @@ def get_combined_runs(tsv_files, ses_):
                 if ch in list(df_run['name']):
                     ind_data = np.where(df_run['name'] == ch)[0][0]
                     run_number = run[run.find('run-')+4:run.find('_channels')] # is a string
-                    raw = mne.io.read_raw_brainvision(run[:-12]+"ieeg.vhdr")
+                    raw = IO.BrainVisionMemmap(run[:-12]+"ieeg.vhdr")
                     if start == 0:
                         start = 1
-                        ch_dat = raw.get_data()[ind_data, :]
+                        ch_dat = raw[ind_data, :]
                         mov_dict = get_mov_dict(raw, "right")
                         if mov_dict["mov_con"] is not None:
                             mov_con = mov_dict["mov_con"]
                         if mov_dict["mov_ips"] is not None:
                             mov_ips = mov_dict["mov_ips"]
                     else:
-                        ch_dat = np.concatenate((ch_dat, raw.get_data()[ind_data, :]), axis=0)
+                        ch_dat = np.concatenate((ch_dat, raw[ind_data, :]), axis=0)
                         mov_dict = get_mov_dict(raw, "right")
                         if mov_dict["mov_con"] is not None:
                             mov_con = np.concatenate((mov_con, mov_dict["mov_con"]), axis=0)
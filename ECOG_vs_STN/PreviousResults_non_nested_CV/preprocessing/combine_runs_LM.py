@@ -1,4 +1,7 @@
 import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'icn_m1'))
+import time_dim
 import numpy as np
 from functools import partial
 from itertools import repeat
@@ -92,16 +95,6 @@ def write_all_rawcombined():
     pool = multiprocessing.Pool()
     pool.map(write_patient_concat_ch, subject_id)
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 def get_movement_idx(ch, mov_channels, Con=True):
     """returns index of mov_channels given boolean Con and ch
 
@@ -158,7 +151,7 @@ def run_CV_est(subject_id, model_=linear_model.LinearRegression(),out_path = PAT
                     y = y[:,:-time_shift]
                     X = X[:,time_shift:]
 
-                X_,y_ = append_time_dim(X.T, y[mov_idx, :],time_stamps)
+                X_,y_ = time_dim.append_time_dim(X.T, y[mov_idx, :],time_stamps, materialize=True)
                 res = np.mean(cross_val_score(model, X_, y_, scoring='r2', cv=5, n_jobs=-1))
 
                 if classification is True:
@@ -24,6 +24,10 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import epoch_store
+import time_dim
+import xgb_halving
 
 from sklearn.linear_model import Ridge
 from sklearn.linear_model import LinearRegression
@@ -53,6 +57,7 @@ plt.close('all')
 
 #%%
 USED_MODEL = 1 # 0 - Enet, 1 - XGB, 2 - NN
+XGB_HALVING = False # select the XGB hyperparameters by successive halving over boosting rounds instead of a GP search
 
 settings = {}
 
@@ -98,6 +103,9 @@ def optimize_enet(x,y):
 
 def optimize_xgb(x,y):
 
+    if XGB_HALVING is True:
+        return xgb_halving.optimize_xgb_halving(x, y, space_XGB)
+
     def evalerror(preds, dtrain):
         """
         Custom defined r^2 evaluation function
@@ -167,16 +175,6 @@ def optimize_xgb(x,y):
 #     #train enet
     
 #     return optimizer.max
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 #%%
 spoc= SPoC(n_components=1, log=True, reg='oas', transform_into ='average_power', rank='full')
 laterality=["CON", "IPS"]
@@ -208,8 +206,8 @@ for m, eeg in enumerate(signal):
                 
                 if each_file.startswith(file_name):  #since its all type str you can simply use startswith
                            
-                    with open(settings['out_path'] + each_file, 'rb') as handle:
-                        sub_ = pickle.load(handle)    
+                    if each_file.endswith('.p'):  #the epochs can be stored in npy files next to the pickle, see epoch_store
+                        sub_ = epoch_store.load_epochs(settings['out_path'] + each_file)
            
                         data=sub_['epochs']
                         label_ips=sub_['label_ips']
@@ -287,8 +285,8 @@ for m, eeg in enumerate(signal):
                     gtr=np.clip(gtr,-2,2)   
                     gte=np.clip(gte,-2,2)
                             
-                    dat_tr,label_tr = append_time_dim(gtr, Ztr,time_stamps=5)
-                    dat_te,label_te = append_time_dim(gte, Zte,time_stamps=5)
+                    dat_tr,label_tr = time_dim.append_time_dim(gtr, Ztr,time_stamps=5, materialize=True)
+                    dat_te,label_te = time_dim.append_time_dim(gte, Zte,time_stamps=5, materialize=True)
                     
                     
     
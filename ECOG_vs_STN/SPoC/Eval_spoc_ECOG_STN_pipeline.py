@@ -24,6 +24,8 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import epoch_store
 
 from sklearn.linear_model import Ridge
 from sklearn.linear_model import LinearRegression
@@ -46,6 +48,7 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.compose import TransformedTargetRegressor
 
 from TimeLagFilterBank import *
+import fold_cache
 # plt.close('all')
 
 #%%
@@ -92,14 +95,16 @@ clf = make_pipeline(features,scaler, reg)
 regr_trans = TransformedTargetRegressor(regressor=clf,
                                         func=func,
                                         inverse_func=inverse_func, check_inverse=False)
+# SPoC filters of every fold are fit once and reused for all ElasticNet parameters
+cache = fold_cache.TransformerCache(max_bytes=2*1024**3)
 def optimize_enet(x,y):
 
-         
+    fingerprint = fold_cache.get_fingerprint(x, y)
 
     @use_named_args(space_LM)
     def objective(**params):
         reg.set_params(**params)
-        cval = cross_val_score(regr_trans, x, y, scoring='r2', cv=3)
+        cval = fold_cache.cross_val_score_cached(regr_trans, x, y, cv=3, cache=cache, fingerprint=fingerprint)
         cval[np.where(cval < 0)[0]] = 0
     
         return -cval.mean()
@@ -170,8 +175,8 @@ for m, eeg in enumerate(signal):
                 
                 if each_file.startswith(file_name):  #since its all type str you can simply use startswith
                            
-                    with open(settings['out_path'] + each_file, 'rb') as handle:
-                        sub_ = pickle.load(handle)    
+                    if each_file.endswith('.p'):  #the epochs can be stored in npy files next to the pickle, see epoch_store
+                        sub_ = epoch_store.load_epochs(settings['out_path'] + each_file)
            
                         data=sub_['epochs']
                         label_ips=sub_['label_ips']
@@ -23,6 +23,8 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import epoch_store
 
 
 from scipy import stats, signal
@@ -133,8 +135,8 @@ for m, eeg in enumerate(signals):
                 
                 if each_file.startswith(file_name):  #since its all type str you can simply use startswith
                            
-                    with open(settings['out_path'] + each_file, 'rb') as handle:
-                        sub_ = pickle.load(handle)    
+                    if each_file.endswith('.p'):  #the epochs can be stored in npy files next to the pickle, see epoch_store
+                        sub_ = epoch_store.load_epochs(settings['out_path'] + each_file)
            
                         data=sub_['epochs']
                         label_ips=sub_['label_ips']
@@ -21,6 +21,9 @@ import sys
 sys.path.insert(1, '/home/victoria/icn/icn_m1')
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import epoch_store
+import time_dim
 from myssd import SSD
 
 from sklearn.linear_model import ElasticNet
@@ -107,16 +110,6 @@ def optimize_enet(x,y):
     
     return optimizer.max
     # print("Final result:", optimizer.max)        
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 def DetecBadTrials(X,y, verbose=True):
     #based on eq.16 of the paper "Dimensionality reduction for the analysis of brain oscillations"
     #calcule single global variance value (GVV)
@@ -183,8 +176,8 @@ for m, eeg in enumerate(signal):
             for each_file in list_of_files:
                 
                 if each_file.startswith(file_name):  #since its all type str you can simply use startswith
-                    with open(settings['out_path'] + each_file, 'rb') as handle:
-                        sub_ = pickle.load(handle)    
+                    if each_file.endswith('.p'):  #the epochs can be stored in npy files next to the pickle, see epoch_store
+                        sub_ = epoch_store.load_epochs(settings['out_path'] + each_file)
            
                         data=sub_['epochs']
                         label_ips=sub_['label_ips']
@@ -315,8 +308,8 @@ for m, eeg in enumerate(signal):
                     gte=np.clip(gte,-2,2)
                     
                                                 
-                    dat_tr,label_tr = append_time_dim(gtr, Ztr,time_stamps=5)
-                    dat_te,label_te = append_time_dim(gte, Zte,time_stamps=5)
+                    dat_tr,label_tr = time_dim.append_time_dim(gtr, Ztr,time_stamps=5, materialize=True)
+                    dat_te,label_te = time_dim.append_time_dim(gte, Zte,time_stamps=5, materialize=True)
                     
                    
                     # Label_te[mov].append(Zte)
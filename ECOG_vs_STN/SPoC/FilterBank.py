@@ -7,8 +7,11 @@ Created on Wed Jul  8 20:55:45 2020
 """
 from sklearn.pipeline import make_pipeline
 import numpy as np
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import band_jobs
 from sklearn.base import BaseEstimator, TransformerMixin
-from copy import deepcopy
 
 
 class FilterBank(BaseEstimator, TransformerMixin):
@@ -25,18 +28,19 @@ class FilterBank(BaseEstimator, TransformerMixin):
     flatten: bool (True)
         If True, output of each band are concatenated together on the feature
         axis. if False, output are stacked.
+    n_jobs: int (1)
+        number of joblib processes over which the bands are fit and transformed,
+        -1 for all CPUs. The data is shared with the processes as a memory-mapped file.
     """
 
-    def __init__(self, estimator, flatten=True):
+    def __init__(self, estimator, flatten=True, n_jobs=1):
         self.estimator = estimator
         self.flatten = flatten
+        self.n_jobs = n_jobs
 
     def fit(self, X, y=None):
         assert X.ndim == 4
-        self.models = [
-            deepcopy(self.estimator).fit(X[...,i], y)
-            for i in range(X.shape[-1])
-        ]
+        self.models = band_jobs.fit_bands(self.estimator, X, y, n_jobs=self.n_jobs)
         
         
         self.filters= [self.models[i].filters_ for i in range(X.shape[-1])]
@@ -52,7 +56,7 @@ class FilterBank(BaseEstimator, TransformerMixin):
 
     def transform(self, X):
         assert X.ndim == 4
-        out = [self.models[i].transform(X[...,i]) for i in range(X.shape[-1])]
+        out = band_jobs.transform_bands(self.models, X, n_jobs=self.n_jobs)
         assert out[0].ndim == 2, ("Each band must return a n dimensional "
                                   f" matrix, currently have {out[0].ndim}")
         if self.flatten:
@@ -14,6 +14,8 @@ import rereference
 import numpy as np
 import json
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import epoch_store
 import pickle 
 import mne
 from mne import Epochs
@@ -69,6 +71,9 @@ settings['num_patients']=['000', '001', '004', '005', '006', '007', '008', '009'
 settings['BIDS_path']=settings['BIDS_path'].replace("\\", "/")
 settings['out_path']=settings['out_path'].replace("\\", "/")
 
+EPOCH_STORE = True # write the epochs into a memory-mapped npy file next to the pickle, see epoch_store
+EPOCH_DTYPE = np.float32
+
 
 #%%
 
@@ -117,7 +122,7 @@ for s in range(len(settings["num_patients"])):
             else: 
                 Warning('Different sampling freq.')      
             #read data
-            bv_raw, ch_names = IO.read_BIDS_file(vhdr_file)
+            bv_raw, ch_names = IO.read_BIDS_file(vhdr_file, memmap=True)
             
             #check session
             sess_right = IO.sess_right(sess)
@@ -157,8 +162,13 @@ for s in range(len(settings["num_patients"])):
             offset_start = int((sf/seglengths[0]) / (sf/settings['resamplingrate']))
             
             
+            out_path = os.path.join(settings['out_path'],'ECOG_epochs_wofb_sub_' + subject +'_sess_' +sess + '_run_'+ run + '.p')
+            epochs_out = None
+            if EPOCH_STORE:
+                epochs_out = epoch_store.create_epoch_file(out_path[:-2] + '.npy', [new_num_data_points-offset_start, dat_ECOG.shape[0], \
+                    filter_fun.shape[1], len(settings['frequencyranges'])], dtype=EPOCH_DTYPE)
             data=offline_analysis.create_continous_epochs(sf, settings['resamplingrate'], offset_start, settings['frequencyranges'], downsample_idx, line_noise, \
-                      dat_ECOG, filter_fun, new_num_data_points, Verbose=False)
+                      dat_ECOG, filter_fun, new_num_data_points, Verbose=False, out=epochs_out)
                 
                 
             #%% target variable
@@ -224,7 +234,5 @@ for s in range(len(settings["num_patients"])):
                 
             }
             
-            out_path = os.path.join(settings['out_path'],'ECOG_epochs_wofb_sub_' + subject +'_sess_' +sess + '_run_'+ run + '.p')
             
-            with open(out_path, 'wb') as handle:
-                pickle.dump(sub_, handle, protocol=pickle.HIGHEST_PROTOCOL)   
+            epoch_store.save_epochs(out_path, sub_)
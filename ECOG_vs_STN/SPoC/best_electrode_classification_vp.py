@@ -21,6 +21,11 @@ import pickle
 import sys
 import IO
 import os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import enet_path
+import feature_store
+import time_dim
+import xgb_halving
 
 # import tensorflow
 # import keras
@@ -58,6 +63,8 @@ from xgboost import XGBRegressor
 VICTORIA = True
 WRITE_OUT_CH_IND = False
 USED_MODEL = 0 # 0 - Enet, 1 - XGB, 2 - NN
+ENET_PATH = False # select the Enet hyperparameters on a warm started alpha/l1_ratio path grid instead of a GP search
+XGB_HALVING = False # select the XGB hyperparameters by successive halving over boosting rounds instead of a GP search
 settings = {}
 
 if VICTORIA is True:
@@ -102,6 +109,9 @@ def enet_train(alpha,l1_ratio,x,y):
     return clf.score(x, y)
 def optimize_enet(x,y):
     """Apply Bayesian Optimization to select enet parameters."""
+    if ENET_PATH is True:
+        return enet_path.optimize_enet_path(x, y)
+
     def function(alpha, l1_ratio):
           
         return enet_train(alpha=alpha, l1_ratio=l1_ratio, x=x, y=y)
@@ -190,6 +200,9 @@ def optimize_enet(x,y):
 
 def optimize_xgb(x,y):
 
+    if XGB_HALVING is True:
+        return xgb_halving.optimize_xgb_halving(x, y, space_XGB)
+
     def evalerror(preds, dtrain):
         """
         Custom defined r^2 evaluation function
@@ -238,22 +251,13 @@ def get_int_runs(subject_id, subfolder):
     os.listdir(settings['out_path'])
 
     if 'right' in str(subfolder):
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_right') and i.endswith(feature_store.FILE_ENDING)]
     else:
-        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith('.p')]
+        list_subject = [i for i in os.listdir(settings['out_path']) if i.startswith('sub_'+subject_id+'_sess_left') and i.endswith(feature_store.FILE_ENDING)]
 
     return list_subject
 
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
 #%%
 cv = KFold(n_splits=3, shuffle=False)
 laterality=[("CON"), ("IPS")]
@@ -284,8 +288,7 @@ for signal_idx, signal_ in enumerate(signal):
             print('RUNNIN SUBJECT_'+ settings['num_patients'][sub_idx]+ '_SESS_'+ str(subfolder[sess_idx]) + '_SIGNAL_' + signal_)
 
             for run_idx in range(len(list_subject)):
-                with open(settings['out_path']+ '/'+ list_subject[run_idx], 'rb') as handle:
-                    run_ = pickle.load(handle)
+                run_ = feature_store.read_run(os.path.join(settings['out_path'], list_subject[run_idx]))
 
                 #concatenate features
                 #get cortex data only
@@ -380,8 +383,8 @@ for signal_idx, signal_ in enumerate(signal):
                         Ytr, Yte=label[train_index], label[test_index]
                         label_test.append(Yte)
                         label_train.append(Ytr)
-                        dat_tr,label_tr = append_time_dim(Xtr, Ytr, time_stamps=5)
-                        dat_te,label_te = append_time_dim(Xte, Yte, time_stamps=5)
+                        dat_tr,label_tr = time_dim.append_time_dim(Xtr, Ytr, time_stamps=5, materialize=True)
+                        dat_te,label_te = time_dim.append_time_dim(Xte, Yte, time_stamps=5, materialize=True)
 
                         if USED_MODEL == 0: # Enet
                             optimizer=optimize_enet(x=dat_tr,y=label_tr)
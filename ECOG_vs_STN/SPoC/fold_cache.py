@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cross validation with cached transformer outputs for hyperparameter searches
+
+In a search over the parameters of the final regressor of a pipeline, e.g. the ElasticNet of
+make_pipeline(TimeLagFilterBank(SPoC), StandardScaler(), ElasticNet()), the transformer stages
+are refit with the same data in every trial. cross_val_score_cached fits the transformers once per
+fold and stores their train and test outputs under (data fingerprint, train indices of the fold,
+transformer params), such that only the regressor is refit for every trial. The outputs are kept in
+an LRU cache with a memory limit, optionally backed by a size limited folder on disk.
+
+Example:
+    cache = fold_cache.TransformerCache(max_bytes=1024**3)
+    fingerprint = fold_cache.get_fingerprint(x, y)
+    cval = fold_cache.cross_val_score_cached(regr_trans, x, y, cv=3, cache=cache, fingerprint=fingerprint)
+"""
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+from sklearn.base import clone, is_classifier
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.metrics import r2_score
+from sklearn.model_selection import check_cv
+from sklearn.pipeline import Pipeline
+
+
+def get_fingerprint(*arrays):
+    """
+    hash of the shape, dtype and content of the given arrays
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.shape, arr.dtype.str)).encode())
+        h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+
+def get_params_key(estimator):
+    """
+    string of all (nested) parameters of an estimator which are not estimators themselves
+    """
+    params = estimator.get_params(deep=True)
+    return repr(sorted((name, repr(value)) for name, value in params.items() if not hasattr(value, 'get_params')))
+
+
+class TransformerCache:
+    """
+    LRU cache of tuples of np arrays with a memory limit
+
+    Args:
+        max_bytes (int): memory limit, least recently used entries are dropped when it is exceeded
+        cache_dir (string, optional): folder in which dropped entries are kept as npz files
+        max_disk_bytes (int): size limit of cache_dir, the least recently used files are deleted
+    """
+
+    def __init__(self, max_bytes=1024**3, cache_dir=None, max_disk_bytes=10*1024**3):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_file(self, key):
+        return os.path.join(self.cache_dir, hashlib.md5(key.encode()).hexdigest() + '.npz')
+
+    def get(self, key):
+        """
+        Returns:
+            tuple of np arrays, None if key is not cached
+        """
+        if key in self._mem:
+            self._mem.move_to_end(key)
+            return self._mem[key]
+        if self.cache_dir is None or not os.path.exists(self._get_file(key)):
+            return None
+        with np.load(self._get_file(key)) as npz:
+            value = tuple(npz['arr_' + str(i)] for i in range(len(npz.files)))
+        os.utime(self._get_file(key))
+        self._put_mem(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Args:
+            key (string)
+            value (tuple of np arrays)
+        """
+        value = tuple(np.asarray(arr) for arr in value)
+        if self.cache_dir is not None:
+            file = self._get_file(key)
+            tmp_file = file[:-4] + '.tmp' + str(os.getpid()) + '.npz'
+            np.savez(tmp_file, *value)
+            os.replace(tmp_file, file)
+            self._evict_disk()
+        self._put_mem(key, value)
+
+    def _put_mem(self, key, value):
+        size = sum(arr.nbytes for arr in value)
+        if size > self.max_bytes:
+            return
+        if key in self._mem:
+            self._mem_bytes -= sum(arr.nbytes for arr in self._mem.pop(key))
+        self._mem[key] = value
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_bytes:
+            _, value_ = self._mem.popitem(last=False)
+            self._mem_bytes -= sum(arr.nbytes for arr in value_)
+
+    def _evict_disk(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.npz')]
+        stats = sorted(((os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files))
+        disk_bytes = sum(size for _, size, _ in stats)
+        for _, size, f in stats:
+            if disk_bytes <= self.max_disk_bytes:
+                break
+            os.remove(f)
+            disk_bytes -= size
+
+    def get_size(self):
+        """
+        Returns:
+            int: number of bytes held in memory
+        """
+        return self._mem_bytes
+
+    def clear(self):
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+
+
+def cross_val_score_cached(estimator, X, y, cv, cache, fingerprint=None):
+    """
+    r2 cross validation score, equal to cross_val_score(estimator, X, y, scoring='r2', cv=cv), where all
+    pipeline steps before the final estimator are fit only once per fold and data
+
+    Args:
+        estimator: Pipeline, or TransformedTargetRegressor with a Pipeline regressor and func/inverse_func
+        X (np array)
+        y (np array): shape(n_samples)
+        cv: int or sklearn cross validation splitter without shuffling
+        cache (TransformerCache)
+        fingerprint (string, optional): get_fingerprint(X, y), computed if not given
+
+    Returns:
+        np array: r2 score of every fold
+    """
+    func = inverse_func = None
+    if isinstance(estimator, TransformedTargetRegressor):
+        func, inverse_func = estimator.func, estimator.inverse_func
+        pipeline = estimator.regressor
+    else:
+        pipeline = estimator
+    if not isinstance(pipeline, Pipeline):
+        raise ValueError("estimator has to be a Pipeline or a TransformedTargetRegressor of a Pipeline")
+    transformers = pipeline[:-1]
+    final = pipeline.steps[-1][1]
+    if fingerprint is None:
+        fingerprint = get_fingerprint(X, y)
+    params_key = get_params_key(transformers)
+    cv = check_cv(cv, y, classifier=is_classifier(estimator))
+
+    scores = []
+    for train_index, test_index in cv.split(X, y):
+        y_tr = y[train_index]
+        if func is not None:  # applied to 2d targets, as in TransformedTargetRegressor
+            y_tr = func(y_tr.reshape(-1, 1)) if y_tr.ndim == 1 else func(y_tr)
+            y_tr = np.asarray(y_tr).squeeze(axis=1) if y_tr.ndim == 2 and y.ndim == 1 else y_tr
+        # the train indices identify the fold, such that a cache shared between different cv splitters stays valid
+        key = fingerprint + '-' + get_fingerprint(train_index) + '-' + params_key
+        out = cache.get(key)
+        if out is None:
+            transformer = clone(transformers)
+            out = (transformer.fit_transform(X[train_index], y_tr), transformer.transform(X[test_index]))
+            cache.put(key, out)
+        dat_tr, dat_te = out
+        model = clone(final).fit(dat_tr, y_tr)
+        y_pred = model.predict(dat_te)
+        if inverse_func is not None:
+            y_pred = inverse_func(y_pred.reshape(-1, 1)) if y_pred.ndim == 1 else inverse_func(y_pred)
+            y_pred = np.asarray(y_pred).squeeze(axis=1) if y_pred.ndim == 2 and y.ndim == 1 else y_pred
+        scores.append(r2_score(y[test_index], y_pred))
+    return np.array(scores)
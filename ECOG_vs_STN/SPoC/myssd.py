@@ -6,6 +6,11 @@ Created on Wed Jul  29  2020
 @author: Victoria Peterson
 """
 import numpy as np
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'icn_m1'))
+import batch_cov
+import filter_cache
 from sklearn.base import BaseEstimator, TransformerMixin
 import mne
 mne.set_log_level(verbose='warning') #to avoid info at terminal
@@ -142,14 +147,14 @@ class SSD(BaseEstimator, TransformerMixin):
         signal_band = self.freq[0] #signal bandpass band
         #reshape for filtering
         X_aux=np.reshape(X, [n_epochs, n_channels*n_samples])
-        X_s=mne.filter.filter_data(X_aux, self.sampling_freq, l_freq=signal_band[0], h_freq=signal_band[1],method='iir', phase='zero-double')  
+        #the filtered epochs are memoized across fits, see filter_cache
+        fingerprint=filter_cache.get_fingerprint(X_aux)
+        X_s=filter_cache.filter_data(X_aux, self.sampling_freq, fingerprint=fingerprint, copy=False,
+                                     l_freq=signal_band[0], h_freq=signal_band[1],method='iir', phase='zero-double')  
         #reshape to original shape
         X_s=np.reshape(X_s, [n_epochs,n_channels,n_samples])
-        covs = np.empty((n_epochs, n_channels, n_channels))
-        for ii, epoch in enumerate(X_s):
-            covs[ii] = mne.cov._regularized_covariance(
-                epoch, reg=self.reg, method_params=self.cov_method_params,
-                rank=self.rank)
+        covs = batch_cov.regularized_covariances(X_s, reg=self.reg, method_params=self.cov_method_params,
+                                                 rank=self.rank)
             
         C_s = covs.mean(0)
     
@@ -158,17 +163,16 @@ class SSD(BaseEstimator, TransformerMixin):
         noise_bp_band = self.freq[1] #noise bandpass band
         noise_bs_band = self.freq[2] # noise bandstop band
         #rephase for filtering
-        X_aux=np.reshape(X, [n_epochs, n_channels*n_samples])
-        X_n=mne.filter.filter_data(X_aux, self.sampling_freq, l_freq=noise_bp_band[0], h_freq=noise_bp_band[1],method='iir', phase='zero-double')  
-        X_n=mne.filter.filter_data(X_n, self.sampling_freq, l_freq=noise_bs_band[1], h_freq=noise_bs_band[0],method='iir', phase='zero-double')#band stop   
+        #band pass and band stop
+        X_n=filter_cache.filter_chain(X_aux, self.sampling_freq,
+                                      [dict(l_freq=noise_bp_band[0], h_freq=noise_bp_band[1],method='iir', phase='zero-double'),
+                                       dict(l_freq=noise_bs_band[1], h_freq=noise_bs_band[0],method='iir', phase='zero-double')],
+                                      fingerprint=fingerprint, copy=False)
         #reshape to original shape
         X_n=np.reshape(X_n, [n_epochs,n_channels,n_samples])
         # Estimate single trial covariance
-        covs_n = np.empty((n_epochs, n_channels, n_channels))
-        for ii, epoch in enumerate(X_n):
-            covs_n[ii] = mne.cov._regularized_covariance(
-                epoch, reg=self.reg, method_params=self.cov_method_params,
-                rank=self.rank)
+        covs_n = batch_cov.regularized_covariances(X_n, reg=self.reg, method_params=self.cov_method_params,
+                                                   rank=self.rank)
 
         C_n = covs_n.mean(0)
         
@@ -267,19 +271,19 @@ class SSD(BaseEstimator, TransformerMixin):
            
         #project data on source space
         pick_filters = self.filters_[:self.n_components]
-        X = np.asarray([np.dot(pick_filters, epoch) for epoch in X])
+        X = np.matmul(pick_filters, X)
         
         if self.denoised:
             #back-project data on signal space
             pick_patterns = self.patterns_[:self.n_components]
-            X=np.asarray([np.dot(pick_patterns.T, epoch) for epoch in X])
+            X=np.matmul(pick_patterns.T, X)
             if self.return_filtered:
                 #filter data
                 n_epochs, n_channels, n_samples = X.shape
                 signal_band = self.freq[0] #signal bandpass band
                 #rephase for filtering
                 X_aux=np.reshape(X, [n_epochs, n_channels*n_samples])
-                X_s=mne.filter.filter_data(X_aux, self.sampling_freq, l_freq=signal_band[0], h_freq=signal_band[1],method='iir', phase='zero-double')  
+                X_s=filter_cache.filter_data(X_aux, self.sampling_freq, l_freq=signal_band[0], h_freq=signal_band[1],method='iir', phase='zero-double')  
                 #reshape to original shape
                 X=np.reshape(X_s, [n_epochs,n_channels,n_samples])
                 
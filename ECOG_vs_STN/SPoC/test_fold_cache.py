@@ -0,0 +1,19 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.linear_model import Ridge
+from sklearn.model_selection import cross_val_score
+from sklearn.pipeline import make_pipeline
+
+import fold_cache
+
+
+def test_cache_shared_between_cv_splitters():
+    rng = np.random.RandomState(0)
+    X = rng.randn(300, 10)
+    y = X[:, 0] + 0.1*rng.randn(300)
+    estimator = make_pipeline(PCA(n_components=5), Ridge())
+    cache = fold_cache.TransformerCache(max_bytes=1024**2)
+    fingerprint = fold_cache.get_fingerprint(X, y)
+    for cv in (3, 5, 3):
+        scores = fold_cache.cross_val_score_cached(estimator, X, y, cv=cv, cache=cache, fingerprint=fingerprint)
+        np.testing.assert_allclose(scores, cross_val_score(estimator, X, y, scoring='r2', cv=cv))
@@ -7,8 +7,12 @@ Created on Wed Jul  8 20:55:45 2020
 """
 from sklearn.pipeline import make_pipeline
 import numpy as np
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'icn_m1'))
+import band_jobs
+import time_dim
 from sklearn.base import BaseEstimator, TransformerMixin
-from copy import deepcopy
 
 
 class TimeLagFilterBank(BaseEstimator, TransformerMixin):
@@ -25,6 +29,9 @@ class TimeLagFilterBank(BaseEstimator, TransformerMixin):
     flatten: bool (True)
         If True, output of each band are concatenated together on the feature
         axis. if False, output are stacked.
+    n_jobs: int (1)
+        number of joblib processes over which the bands are fit and transformed,
+        -1 for all CPUs. The data is shared with the processes as a memory-mapped file.
    time_stamps: int 
        an integrer indicating of many time windows will be contatenated along features
         
@@ -40,17 +47,15 @@ class TimeLagFilterBank(BaseEstimator, TransformerMixin):
     
     """
 
-    def __init__(self, estimator, flatten=True, time_stamps=5):
+    def __init__(self, estimator, flatten=True, time_stamps=5, n_jobs=1):
         self.estimator = estimator
         self.flatten = flatten
+        self.n_jobs = n_jobs
         self.time_stamps= time_stamps
 
     def fit(self, X, y=None):
         assert X.ndim == 4
-        self.models = [
-            deepcopy(self.estimator).fit(X[...,i], y)
-            for i in range(X.shape[-1])
-        ]
+        self.models = band_jobs.fit_bands(self.estimator, X, y, n_jobs=self.n_jobs)
         
         self.filters= [self.models[i].filters_ for i in range(X.shape[-1])]
         self.patterns= [self.models[i].patterns_ for i in range(X.shape[-1])]
@@ -65,18 +70,13 @@ class TimeLagFilterBank(BaseEstimator, TransformerMixin):
         """
         apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
         """
-        time_arr = np.zeros([np.shape(arr)[0]-time_stamps, int(time_stamps*np.shape(arr)[1])])
-        for time_idx, time_ in enumerate(np.arange(time_stamps, np.shape(arr)[0])):
-            for time_point in range(time_stamps):
-                time_arr[time_idx, time_point*np.shape(arr)[1]:(time_point+1)*np.shape(arr)[1]] = arr[time_-time_point,:]
-           
-        return time_arr
+        return time_dim.append_time_dim(arr, time_stamps=time_stamps, materialize=True)
 
                
 
     def transform(self, X, y):
         assert X.ndim == 4
-        out = [self.models[i].transform(X[...,i]) for i in range(X.shape[-1])]
+        out = band_jobs.transform_bands(self.models, X, n_jobs=self.n_jobs)
         assert out[0].ndim == 2, ("Each band must return a n dimensional "
                                   f" matrix, currently have {out[0].ndim}")
         if self.flatten:
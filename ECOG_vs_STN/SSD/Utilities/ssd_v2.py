@@ -2,14 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
+import os
+import sys
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'icn_m1'))
+import batch_cov
+import filter_cache
 from sklearn.base import BaseEstimator, TransformerMixin
 
 from scipy.linalg import eigh
 from mne.io.base import BaseRaw
 from mne.epochs import BaseEpochs
 from mne.utils import (_validate_type,_time_mask, fill_doc)
-from mne.cov import (_regularized_covariance,compute_raw_covariance)
-from mne.filter import filter_data
+from mne.cov import compute_raw_covariance
 from mne.time_frequency import psd_array_welch
 
 @fill_doc
@@ -164,26 +168,27 @@ class SSD(BaseEstimator, TransformerMixin):
               
                 #reshape for filtering
                 X_aux=np.reshape(inst, [n_epochs, n_channels*n_samples])
-                X_s=filter_data(X_aux, self.sampling_freq, **self.filt_params_signal)  
+                #the filtered epochs are memoized across fits, see filter_cache
+                fingerprint=filter_cache.get_fingerprint(X_aux)
+                X_s=filter_cache.filter_data(X_aux, self.sampling_freq, fingerprint=fingerprint, copy=False,
+                                             **self.filt_params_signal)  
                 
-                #rephase for filtering
-                X_aux=np.reshape(inst, [n_epochs, n_channels*n_samples])
-                X_n=filter_data(X_aux, self.sampling_freq, **self.filt_params_noise)
                 if self.filt_params_noise_stop is not None:          
                     #stop-band filtering after the band-pass filtering
-                    X_n=filter_data(X_n, self.sampling_freq, **self.filt_params_noise_stop)
+                    X_n=filter_cache.filter_chain(X_aux, self.sampling_freq,
+                                                  [self.filt_params_noise, self.filt_params_noise_stop],
+                                                  fingerprint=fingerprint, copy=False)
                 else:
+                    X_n=filter_cache.filter_data(X_aux, self.sampling_freq, fingerprint=fingerprint,
+                                                 **self.filt_params_noise)
                     # subtract signal:
                     X_n -= X_s
                 
                 # Estimate single trial covariance
                 #reshape to original shape
                 X_s=np.reshape(X_s, [n_epochs,n_channels,n_samples])
-                covs = np.empty((n_epochs, n_channels, n_channels))
-                for ii, epoch in enumerate(X_s):
-                    covs[ii] = _regularized_covariance(
-                        epoch, reg=self.estimator, method_params=self.cov_method_params,
-                        rank=self.rank)
+                covs = batch_cov.regularized_covariances(X_s, reg=self.estimator, method_params=self.cov_method_params,
+                                                         rank=self.rank)
                     
                 cov_signal = covs.mean(0)
             
@@ -195,11 +200,8 @@ class SSD(BaseEstimator, TransformerMixin):
                 #reshape to original shape
                 X_n=np.reshape(X_n, [n_epochs,n_channels,n_samples])
                 # Estimate single trial covariance
-                covs_n = np.empty((n_epochs, n_channels, n_channels))
-                for ii, epoch in enumerate(X_n):
-                    covs_n[ii] = _regularized_covariance(
-                        epoch, reg=self.estimator, method_params=self.cov_method_params,
-                        rank=self.rank)
+                covs_n = batch_cov.regularized_covariances(X_n, reg=self.estimator, method_params=self.cov_method_params,
+                                                           rank=self.rank)
         
                 cov_noise = covs_n.mean(0)
                        
@@ -267,7 +269,7 @@ class SSD(BaseEstimator, TransformerMixin):
                 
                 data=inst    
                 #project data on source space
-                X_ssd = np.asarray([np.dot(self.filters_.T, epoch) for epoch in data])
+                X_ssd = np.matmul(self.filters_.T, data)
         
         if self.sort_by_spectral_ratio:
             self.spec_ratio, self.sorter_spec=self.spectral_ratio_ssd(ssd_sources=X_ssd)
@@ -324,7 +326,7 @@ class SSD(BaseEstimator, TransformerMixin):
             if isinstance(inst, BaseEpochs):
                 if not isinstance(inst, np.ndarray):
                     raise ValueError("X should be of type ndarray (got %s)." % type(inst))
-                X=np.asarray([np.dot(pick_patterns, epoch) for epoch in X_ssd])
+                X=np.matmul(pick_patterns, X_ssd)
         
         return X
 
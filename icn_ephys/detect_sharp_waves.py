@@ -46,6 +46,102 @@ class Waveform_analyzer:
 
         return peak_left_idx, peak_right_idx, filtered_dat[peak_left_idx], filtered_dat[peak_right_idx]
 
+    def get_peaks_around_troughs(self, troughs, arr_ind_peaks):
+        """
+        vectorized get_peaks_around for all troughs, arr_ind_peaks has to be sorted (as from find_peaks)
+
+        Returns:
+            peak_idx_left (np array): closest peak left of every trough, -1 if there is none
+            peak_idx_right (np array): closest peak right of every trough, -1 if there is none
+        """
+        if arr_ind_peaks.shape[0] == 0:
+            return np.full(troughs.shape[0], -1), np.full(troughs.shape[0], -1)
+        pos_left = np.searchsorted(arr_ind_peaks, troughs, side='left') - 1
+        pos_right = np.searchsorted(arr_ind_peaks, troughs, side='right')
+        peak_idx_left = np.where(pos_left >= 0, arr_ind_peaks[np.maximum(pos_left, 0)], -1)
+        peak_idx_right = np.where(pos_right < arr_ind_peaks.shape[0],
+                                  arr_ind_peaks[np.minimum(pos_right, arr_ind_peaks.shape[0]-1)], -1)
+        return peak_idx_left, peak_idx_right
+
+    @staticmethod
+    def get_segment_max(arr, starts, ends):
+        """
+        max(arr[starts[i]:ends[i]]) of every segment, all segments have to be non empty
+        """
+        if starts.shape[0] == 0:
+            return np.zeros(0)
+        # -inf appended such that ends may equal arr.shape[0]; the odd reduceat results
+        # (from ends[i] to starts[i+1]) are discarded
+        arr = np.append(arr, -np.inf)
+        return np.maximum.reduceat(arr, np.stack((starts, ends), axis=1).ravel())[::2]
+
+    def get_sharp_wave_features(self, filtered_dat, peaks, troughs, label=False, y_contra=None, y_ipsi=None):
+        """
+        sharp wave features of every trough with an adjacent peak on both sides, which is not within
+        5 ms of the data borders
+
+        Returns:
+            pd.DataFrame: one row per trough
+        """
+        peak_idx_left, peak_idx_right = self.get_peaks_around_troughs(troughs, peaks)
+        valid = (peak_idx_left >= 0) & (peak_idx_right >= 0)
+        if np.any(~valid):
+            # in this case there are no adjacent two peaks around these troughs
+            print(str(np.sum(~valid)) + " troughs without valid peaks")
+        # sharpness is computed +- 5 ms around the trough, convert 5 ms to sample rate
+        shift = int(5*(1000/self.sample_rate))
+        valid &= (troughs - shift > 0) & (troughs + shift < filtered_dat.shape[0])
+
+        trough_idx = troughs[valid]
+        peak_idx_left = peak_idx_left[valid]
+        peak_idx_right = peak_idx_right[valid]
+        peak_left = filtered_dat[peak_idx_left]
+        peak_right = filtered_dat[peak_idx_right]
+        trough = filtered_dat[trough_idx]
+
+        # interval to the previous trough, the first interval is set to zero
+        interval_ = np.diff(trough_idx, prepend=trough_idx[:1]) * (1000/self.sample_rate)
+
+        sharpness = ((trough - filtered_dat[trough_idx-shift]) + (trough - filtered_dat[trough_idx+shift])) / 2
+
+        # rise_steepness, max first der. from the left peak to the trough
+        diff_dat = np.diff(filtered_dat)
+        rise_steepness = self.get_segment_max(diff_dat, peak_idx_left, trough_idx)
+
+        # decay_steepness, from the trough to the right peak
+        decay_steepness = self.get_segment_max(diff_dat, trough_idx, peak_idx_right)
+
+        sharp_wave = {
+            "peak_left" : peak_left,
+            "peak_right" : peak_right,
+            "peak_idx_left" : peak_idx_left,
+            "peak_idx_right" : peak_idx_right,
+            "trough" : trough, # mV
+            "trough_idx" : trough_idx,
+            "width" : peak_idx_right - peak_idx_left, # ms
+            "prominence": np.abs((peak_right + peak_left) / 2 - trough), # mV
+            "interval" : interval_, # ms
+            "decay_time": (peak_idx_left - trough_idx) *(1000/self.sample_rate),
+            "rise_time" : (peak_idx_right - trough_idx) *(1000/self.sample_rate),
+            "sharpness" : sharpness,
+            "rise_steepness" : rise_steepness,
+            "decay_steepness" : decay_steepness,
+            "slope_ratio" : rise_steepness - decay_steepness,
+            "label" : label is True,
+            "MOV_TYPE" : None,
+            "y_contra" : None,
+            "y_ipsi" : None
+        }
+
+        if label is True:
+            y_contra_ = np.asarray(y_contra)[trough_idx]
+            y_ipsi_ = np.asarray(y_ipsi)[trough_idx]
+            # movement
+            sharp_wave["MOV_TYPE"] = np.where(y_ipsi_ > 0, "IPS", np.where(y_contra_ > 0, "CON", "NO_MOV"))
+            sharp_wave["y_contra"] = y_contra_
+            sharp_wave["y_ipsi"] = y_ipsi_
+        return pd.DataFrame(sharp_wave, index=np.arange(trough_idx.shape[0]))
+
     #def analyze_waveform(self, raw_dat, peak_dist=1, trough_dist=5, label=False, y_contra=None, y_ipsi=None, \
     #                        plot_=False):
     def analyze_waveform(self, ch, dat, subject_id, DETECT_PEAKS):
@@ -82,74 +178,7 @@ class Waveform_analyzer:
             plt.plot(filtered_dat, color='black'); plt.legend(['peaks', 'trough'])
             plt.show()
 
-        df  = pd.DataFrame()
-        sharp_wave = {}
-        for trough_idx in troughs:
-            try:
-                peak_idx_left, peak_idx_right, peak_left, peak_right = self.get_peaks_around(trough_idx,
-                                                                                        peaks, filtered_dat)
-            except NoValidTroughException as e:
-                # in this case there is no adjacent two peaks around this trough
-                print(str(e))
-                continue
-
-            # interval
-            if df.shape[0]>0:
-                interval_ = (trough_idx - sharp_wave["trough_idx"]) * (1000/self.sample_rate)
-            else:
-                # set first interval to zero
-                interval_ = 0
-
-            # sharpness
-            if (trough_idx - int(5*(1000/self.sample_rate)) <= 0) or \
-                (trough_idx + int(5*(1000/self.sample_rate)) >= filtered_dat.shape[0]):
-                continue
-            # convert 5 ms to sample rate
-            sharpness = ((filtered_dat[trough_idx] - filtered_dat[trough_idx-int(5*(1000/self.sample_rate))]) +
-                         (filtered_dat[trough_idx] - filtered_dat[trough_idx+int(5*(1000/self.sample_rate))])) / 2
-
-            # rise_steepness, first der. from trough to peak
-            # here  + 1 due to python syntax, s.t. the last element is included
-            rise_steepness = np.max(np.diff(filtered_dat[peak_idx_left : trough_idx+1]))
-
-            # decay_steepness
-            decay_steepness = np.max(np.diff(filtered_dat[trough_idx : peak_idx_right+1]))
-
-            sharp_wave  = {
-                "peak_left" : peak_left,
-                "peak_right" : peak_right,
-                "peak_idx_left" : peak_idx_left,
-                "peak_idx_right" : peak_idx_right,
-                "trough" : filtered_dat[trough_idx], # mV
-                "trough_idx" : trough_idx,
-                "width" : peak_idx_right - peak_idx_left, # ms
-                "prominence": np.abs((peak_right + peak_left) / 2 - filtered_dat[trough_idx]), # mV
-                "interval" : interval_, # ms
-                "decay_time": (peak_idx_left - trough_idx) *(1000/self.sample_rate),
-                "rise_time" : (peak_idx_right - trough_idx) *(1000/self.sample_rate),
-                "sharpness" : sharpness,
-                "rise_steepness" : rise_steepness,
-                "decay_steepness" : decay_steepness,
-                "slope_ratio" : rise_steepness - decay_steepness,
-                "label" : False,
-                "MOV_TYPE" : None,
-                "y_contra" : None,
-                "y_ipsi" : None
-            }
-
-            if label is True:
-                sharp_wave["label"] = True
-                    # movement
-                if y_ipsi[trough_idx] > 0:
-                    MOV_ = "IPS"
-                elif y_contra[trough_idx] > 0:
-                    MOV_ = "CON"
-                else:
-                    MOV_ = "NO_MOV"
-                sharp_wave["MOV_TYPE"] = MOV_
-                sharp_wave["y_contra"] = y_contra[trough_idx]
-                sharp_wave["y_ipsi"] = y_ipsi[trough_idx]
-            df = df.append(sharp_wave, ignore_index=True)
+        df = self.get_sharp_wave_features(filtered_dat, peaks, troughs, label=label, y_contra=y_contra, y_ipsi=y_ipsi)
 
         df.to_pickle(PATH_OUT + "sub_"+subject_id+"_ch_"+ch+".p")
         #return df
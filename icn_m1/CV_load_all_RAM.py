@@ -1,6 +1,8 @@
 import os
 import numpy as np
-import pickle
+import feature_store
+import time_dim
+import cv_scheduler
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import train_test_split
@@ -24,15 +26,13 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import f1_score
 from sklearn import metrics
 
-# load all data from an interpolated folder into the RAM
+# index all runs of an interpolated folder, features are read on access
 settings = {}
 settings['Preprocess_path'] = "C:\\Users\\ICN_admin\\Dropbox (Brain Modulation Lab)\\Shared Lab Folders\\CRCNS\\MOVEMENT DATA\\derivatives\\Int_dist_25_Median_10\\"
 settings['write_path'] = "C:\\Users\\ICN_admin\\Dropbox (Brain Modulation Lab)\\Shared Lab Folders\\CRCNS\\MOVEMENT DATA\\derivatives\\res_dist_25_Median_10_CNN\\"
-int_runs = os.listdir(settings['Preprocess_path'])  # all runs in the preprocessed path
-dat_all = {}
-for file in os.listdir(settings['Preprocess_path']):
-    with open(os.path.join(settings['Preprocess_path'], file), 'rb') as pickle_file:
-        dat_all[file] = pickle.load(pickle_file)
+settings['cache_bytes'] = 8*1024**3  # memory budget of grid points kept in RAM, independent of the cohort size
+store = feature_store.FeatureStore(settings['Preprocess_path'], cache_bytes=settings['cache_bytes'])  # runs are memory-mapped, grid points are read on access
+int_runs = store.runs  # all runs in the preprocessed path
 
 gpu_devices = tf.config.experimental.list_physical_devices('GPU')
 tf.config.experimental.set_memory_growth(gpu_devices[0], True)
@@ -53,16 +53,6 @@ NUM_ECOG_LEFT = grid_[0].shape[1] # 39
 NUM_ECOG_RIGHT = grid_[2].shape[1] + NUM_ECOG_LEFT # 78
 NUM_SUBCORTEX_LEFT = grid_[1].shape[1] + NUM_ECOG_RIGHT #85
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
 
 def get_train_test_runs(subject_test):
     """read all runs for a given subject, return runs from every other patient as train list as well
@@ -77,10 +67,9 @@ def get_train_test_runs(subject_test):
         subject_id = str('00') + str(subject_test)
     else:
         subject_id = str('0') + str(subject_test)
-    list_subject_test = [i for i in os.listdir(settings['Preprocess_path'])
-                         if i.startswith('sub_'+subject_id) and i.endswith('.p')]
-    list_subject_train = [i for i in os.listdir(settings['Preprocess_path'])
-                          if not i.startswith('sub_'+subject_id) and i.endswith('.p')
+    list_subject_test = store.get_runs(subject=subject_id)
+    list_subject_train = [i for i in store.runs
+                          if not i.startswith('sub_'+subject_id)
                           and not i.startswith("sub_016")]
     return list_subject_test, list_subject_train
 
@@ -97,50 +86,60 @@ def get_train_test_dat(grid_point, int_runs, list_subject_test, list_subject_tra
     Returns:
         dat_train, label_train, dat_test, label_test: np arrays
     """
-    start_TRAIN = 0
-    start_TEST = 0
+    contralateral = grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT)
+    dat_test = []
+    label_test = []
+    dat_train = []
+    label_train = []
     for run in int_runs:
         if run in list_subject_test:
-            if grid_point in np.nonzero(dat_all[run]["arr_act_grid_points"])[0]:
-                if start_TEST == 0:
-                    start_TEST = 1
-                    dat_test = dat_all[run]["pf_data_median"][:,grid_point,:]
-                    if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                        label_test = np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==True])
-                    else:
-                        label_test = np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==False])
-                else:
-                    dat_test = np.concatenate((dat_test,
-                                           dat_all[run]["pf_data_median"][:,grid_point,:]), axis=0)
-                    if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                        label_new=np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==True])
-                        label_test = np.concatenate((label_test, label_new), axis=0)
-                    else:
-                        label_new=np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==False])
-                        label_test = np.concatenate((label_test, label_new), axis=0)
+            if grid_point in np.nonzero(store.get_info(run)["arr_act_grid_points"])[0]:
+                dat_test.append(store.get_grid_point(run, grid_point))
+                label_test.append(store.get_label(run, contralateral))
 
         elif run in list_subject_train:
-            if grid_point in np.nonzero(dat_all[run]["arr_act_grid_points"])[0]:
-                if start_TRAIN == 0:
-                    start_TRAIN = 1
-                    dat_train = dat_all[run]["pf_data_median"][:,grid_point,:]
-                    if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                        label_train = np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==True])
-                    else:
-                        label_train = np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==False])
-                else:
-                    dat_train = np.concatenate((dat_train,
-                                           dat_all[run]["pf_data_median"][:,grid_point,:]), axis=0)
-                    if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                        label_new=np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==True])
-                        label_train = np.concatenate((label_train, label_new), axis=0)
-                    else:
-                        label_new=np.squeeze(dat_all[run]['label_baseline_corrected'][dat_all[run]['label_con_true']==False])
-                        label_train = np.concatenate((label_train, label_new), axis=0)
-    dat_train,label_train = append_time_dim(np.clip(dat_train, -2, 2), label_train,time_stamps)
-    dat_test,label_test = append_time_dim(np.clip(dat_test, -2, 2), label_test,time_stamps)
+            if grid_point in np.nonzero(store.get_info(run)["arr_act_grid_points"])[0]:
+                dat_train.append(store.get_grid_point(run, grid_point))
+                label_train.append(store.get_label(run, contralateral))
+    dat_train = np.concatenate(dat_train, axis=0)
+    label_train = np.concatenate(label_train, axis=0)
+    dat_test = np.concatenate(dat_test, axis=0)
+    label_test = np.concatenate(label_test, axis=0)
+    dat_train,label_train = time_dim.append_time_dim(np.clip(dat_train, -2, 2), label_train,time_stamps, materialize=True)
+    dat_test,label_test = time_dim.append_time_dim(np.clip(dat_test, -2, 2), label_test,time_stamps, materialize=True)
     return dat_train, label_train, dat_test, label_test
 
+def fit_predict_xgb(dat_train, label_train, dat_test, label_test):
+    """fit a XGBRegressor with early stopping on a validation split of the train set
+
+    Returns:
+        dict: predict_ output of one grid point
+    """
+    # split data into train and test sets
+    seed = 7
+    test_size = 0.33
+    X_train, X_val, y_train, y_val = train_test_split(dat_train, label_train, test_size=test_size, random_state=seed)
+    model = XGBRegressor(max_depth=20, n_estimators=20)
+
+
+    #model = LinearRegression()
+    #model.fit(dat_train, label_train)
+
+    eval_set = [(X_val, y_val)]
+    model.fit(X_train, y_train, early_stopping_rounds=10, eval_metric="mae", eval_set=eval_set, verbose=False)
+
+    y_test_pred = model.predict(dat_test)
+    y_train_pred = model.predict(X_train)
+
+    return {
+        "y_pred_test": y_test_pred,
+        "y_test": label_test,
+        "y_pred_train": y_train_pred,
+        "y_train": label_train,
+        "r2_test": r2_score(label_test, y_test_pred),
+        "r2_train": r2_score(y_train, y_train_pred)
+    }
+
 def write_CV(subject_test):
     """for a given subject perform the CV; read train and test set for every active grid point
     Write out file as npy
@@ -150,10 +149,10 @@ def write_CV(subject_test):
     patient_CV_out = np.empty(num_grid_points, dtype=object)
     list_subject_test, list_subject_train = get_train_test_runs(subject_test)
     grid_points_test_used = np.unique(np.concatenate(
-            np.array([np.nonzero(dat_all[run_]["arr_act_grid_points"])[0]
+            np.array([np.nonzero(store.get_info(run_)["arr_act_grid_points"])[0]
             for run_ in list_subject_test])))
     grid_points_train_used = np.unique(np.concatenate(
-            np.array([np.nonzero(dat_all[run_]["arr_act_grid_points"])[0]
+            np.array([np.nonzero(store.get_info(run_)["arr_act_grid_points"])[0]
             for run_ in list_subject_train])))
 
     for grid_point in grid_points_test_used:
@@ -164,30 +163,7 @@ def write_CV(subject_test):
             get_train_test_dat(grid_point, int_runs,
                                list_subject_test, list_subject_train)
 
-        # split data into train and test sets
-        seed = 7
-        test_size = 0.33
-        X_train, X_val, y_train, y_val = train_test_split(dat_train, label_train, test_size=test_size, random_state=seed)
-        model = XGBRegressor(max_depth=20, n_estimators=20)
-
-
-        #model = LinearRegression()
-        #model.fit(dat_train, label_train)
-
-        eval_set = [(X_val, y_val)]
-        model.fit(X_train, y_train, early_stopping_rounds=10, eval_metric="mae", eval_set=eval_set, verbose=False)
-
-        y_test_pred = model.predict(dat_test)
-        y_train_pred = model.predict(X_train)
-
-        patient_CV_out[grid_point] = {
-            "y_pred_test": y_test_pred,
-            "y_test": label_test,
-            "y_pred_train": y_train_pred,
-            "y_train": label_train,
-            "r2_test": r2_score(label_test, y_test_pred),
-            "r2_train": r2_score(y_train, y_train_pred)
-        }
+        patient_CV_out[grid_point] = fit_predict_xgb(dat_train, label_train, dat_test, label_test)
     if subject_test < 10:
         subject_id = '00' + str(subject_test)
     else:
@@ -196,6 +172,22 @@ def write_CV(subject_test):
     out_path_file = os.path.join(settings['write_path'], subject_id+'prediction.npy')
     np.save(out_path_file, patient_CV_out)
 
+def write_CV_parallel(subjects, n_jobs=None):
+    """perform the CV of write_CV for all subjects, with one (subject, grid point) task per process,
+    see cv_scheduler; the runs are first copied once into a grid point major dataset
+
+    Args:
+        subjects (list): test subjects (int)
+        n_jobs (int, optional): number of processes
+    """
+    dataset_file = os.path.join(settings['Preprocess_path'], 'grid_point_dataset.hdf5')
+    contralateral = np.array([grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT)
+                              for grid_point in range(num_grid_points)])
+    dataset_runs = [run for run in int_runs if not run.startswith("sub_016")]
+    if not feature_store.is_current_grid_point_dataset(dataset_file, store, contralateral, clip=2, runs=dataset_runs):
+        feature_store.write_grid_point_dataset(store, dataset_file, contralateral, clip=2, runs=dataset_runs)
+    cv_scheduler.run_CV(dataset_file, {"XGB": fit_predict_xgb}, subjects, settings['write_path'], n_jobs=n_jobs)
+
 def correlation(x, y):
     mx = tf.math.reduce_mean(x)
     my = tf.math.reduce_mean(y)
@@ -231,10 +223,10 @@ def write_CV_CNN(subject_test):
     patient_CV_out = np.empty(num_grid_points, dtype=object)
     list_subject_test, list_subject_train = get_train_test_runs(subject_test)
     grid_points_test_used = np.unique(np.concatenate(
-            np.array([np.nonzero(dat_all[run_]["arr_act_grid_points"])[0]
+            np.array([np.nonzero(store.get_info(run_)["arr_act_grid_points"])[0]
             for run_ in list_subject_test])))
     grid_points_train_used = np.unique(np.concatenate(
-            np.array([np.nonzero(dat_all[run_]["arr_act_grid_points"])[0]
+            np.array([np.nonzero(store.get_info(run_)["arr_act_grid_points"])[0]
             for run_ in list_subject_train])))
 
     for grid_point in grid_points_test_used:
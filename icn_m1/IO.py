@@ -3,6 +3,8 @@ import numpy as np
 import os
 import pandas as pd
 import json
+import hashlib
+import sqlite3
 import IO
 
 
@@ -95,16 +97,19 @@ def get_files(subject_path, subfolder, endswith='.vhdr', Verbose=True):
                 if Verbose: print(f_name)
     return vhdr_files
 
-def get_all_vhdr_files(BIDS_path):
+def get_all_vhdr_files(BIDS_path, catalog=None):
     """
     
     Given a BIDS path return all vhdr file paths without BIDS_Layout
 
     Args:
         BIDS_path (string)
+        catalog (BIDSCatalog, optional): if provided the BIDS folder is not crawled
     Returns: 
         vhdr_files (list)
     """
+    if catalog is not None:
+        return catalog.vhdr_files()
     vhdr_files = []
     for root, dirs, files in os.walk(BIDS_path):
         for file in files:
@@ -113,16 +118,155 @@ def get_all_vhdr_files(BIDS_path):
     return vhdr_files
     
 
-def read_BIDS_file(file_path):
+def read_BIDS_file(file_path, memmap=False):
     """
     Read one run file from BIDS standard
     :param file_path: .vhdr file
+    :param memmap: if True, return a BrainVisionMemmap instead of loading all channels,
+        channels and time ranges are then only read and scaled when indexed
     :return: raw dataset array, channel name array
     """
+    if memmap is True:
+        bv_file = BrainVisionMemmap(file_path)
+        return bv_file, bv_file.ch_names
     bv_file = mne_bids.read.io.brainvision.read_raw_brainvision(file_path)
     bv_raw = bv_file.get_data()
     return bv_raw, bv_file.ch_names
 
+BV_BINARY_FORMATS = {
+    "INT_16": "<i2",
+    "UINT_16": "<u2",
+    "INT_32": "<i4",
+    "IEEE_FLOAT_32": "<f4"
+}
+
+BV_UNIT_SCALES = {
+    "V": 1,
+    "mV": 1e-3,
+    "\u00b5V": 1e-6,  # micro sign
+    "\u03bcV": 1e-6,  # greek mu
+    "uV": 1e-6,
+    "nV": 1e-9
+}
+
+def read_vhdr_header(vhdr_file):
+    """
+    read the sections of a BrainVision header file into a dict of dicts
+    """
+    with open(vhdr_file, 'rb') as f:
+        content = f.read()
+    try:
+        content = content.decode('utf-8')
+    except UnicodeDecodeError:
+        content = content.decode('latin-1')
+
+    header = {}
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if len(line) == 0 or line.startswith(';'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+            header[section] = {}
+        elif section is not None and '=' in line:
+            key, value = line.split('=', 1)
+            header[section][key.strip()] = value.strip()
+    return header
+
+class BrainVisionMemmap:
+    """
+    Memory mapped BrainVision run, which is indexed like the array returned by read_BIDS_file
+
+    Indexing reads only the requested channels and time range from the .eeg file and scales
+    them to V in float64, e.g. bv_raw[ind_cortex, :] or bv_raw[ch_idx, start:stop].
+    get_raw returns the unscaled data in the stored int16/float32 dtype, which is a view
+    of the file if channels are selected by an int or a slice.
+    Since multiplexed files store the samples of all channels interleaved, reading a channel
+    subset still touches the whole time range on disk, but only the subset is held in memory.
+
+    Args:
+        vhdr_file (string)
+        dtype (np dtype): dtype of scaled data
+    """
+
+    def __init__(self, vhdr_file, dtype=np.float64):
+        header = read_vhdr_header(vhdr_file)
+        common = header["Common Infos"]
+        if common.get("DataFormat", "BINARY").upper() != "BINARY":
+            raise ValueError('Only BINARY BrainVision files can be memory mapped.')
+        self.vhdr_file = vhdr_file
+        self.eeg_file = os.path.join(os.path.dirname(vhdr_file), common["DataFile"])
+        self.fs = 1e6 / float(common["SamplingInterval"])
+        self.num_channels = int(common["NumberOfChannels"])
+        self.multiplexed = common.get("DataOrientation", "MULTIPLEXED").upper() == "MULTIPLEXED"
+        self.native_dtype = np.dtype(BV_BINARY_FORMATS[header["Binary Infos"]["BinaryFormat"]])
+        self.dtype = dtype
+
+        self.ch_names = []
+        self.scale = np.ones(self.num_channels)
+        for ch_idx in range(self.num_channels):
+            props = header["Channel Infos"]["Ch"+str(ch_idx+1)].split(',')
+            self.ch_names.append(props[0].replace('\\1', ','))
+            resolution = float(props[2]) if len(props) > 2 and props[2] != '' else 1
+            unit = props[3] if len(props) > 3 and props[3] != '' else "\u00b5V"
+            self.scale[ch_idx] = resolution*BV_UNIT_SCALES.get(unit, 1)
+
+        num_samples = os.path.getsize(self.eeg_file) // (self.native_dtype.itemsize*self.num_channels)
+        if self.multiplexed:
+            shape = (num_samples, self.num_channels)
+        else:
+            shape = (self.num_channels, num_samples)
+        self.data = np.memmap(self.eeg_file, dtype=self.native_dtype, mode='r', shape=shape)
+        self.shape = (self.num_channels, num_samples)
+        self.ndim = 2
+
+    def __len__(self):
+        return self.num_channels
+
+    def get_raw(self, picks=None, start=0, stop=None):
+        """
+        unscaled data in the stored dtype
+
+        Args:
+            picks (int, slice, list or np array, optional): channel indices, defaults to all channels
+            start (int): first sample
+            stop (int, optional): last sample (exclusive)
+
+        Returns:
+            np array: shape (n_channels, n_times)
+        """
+        if picks is None:
+            picks = slice(None)
+        if self.multiplexed:
+            dat_ = self.data[start:stop, picks]
+            return dat_.T
+        return self.data[picks, start:stop]
+
+    def get_data(self, picks=None, start=0, stop=None):
+        """
+        scaled data in V, see get_raw
+        """
+        if picks is None:
+            picks = slice(None)
+        return self[picks, start:stop]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        ch_key, time_key = key
+        picks = np.arange(self.num_channels)[ch_key]
+        if self.multiplexed:
+            dat_ = self.data[time_key, picks]
+            if dat_.ndim == 2:
+                dat_ = dat_.T
+        else:
+            dat_ = self.data[picks, time_key]
+        scale = self.scale[picks]
+        if np.ndim(picks) == 1 and dat_.ndim == 2:
+            scale = scale[:, np.newaxis]
+        return np.multiply(dat_, scale, dtype=self.dtype)
+
 def read_M1_channel_specs(run_string):
     # given a run in from, sub-000_ses-right_task-force_run-0, the M1 channel specs file is in form sub-000_ses-right_task-force_run-0_channels_M1.tsv 
     """ 
@@ -170,9 +314,10 @@ def read_grid():
     subcortex_right = np.array(pd.read_csv('settings/subcortex_right.tsv', sep="\t"))
     return cortex_left.T, cortex_right.T, subcortex_left.T, subcortex_right.T
 
-def get_coords_df_from_vhdr(vhdr_file, BIDS_path):
+def get_coords_df_from_vhdr(vhdr_file, BIDS_path, catalog=None):
     """
     given a vhdr file path and the BIDS path
+    :param catalog: optional BIDSCatalog, which is queried instead of parsing the electrodes.tsv file
     :return a pandas dataframe of that session (important: not for the run; run channls might have only a s
     subset of all channels in the coordinate file)
     """
@@ -183,34 +328,43 @@ def get_coords_df_from_vhdr(vhdr_file, BIDS_path):
     else:
         sess = 'left'
     coord_path = os.path.join(BIDS_path, 'sub-'+ subject, 'ses-'+ sess, 'ieeg', 'sub-'+ subject+ '_electrodes.tsv')
+    if catalog is not None:
+        return catalog.electrodes(coord_path)
     df = pd.read_csv(coord_path, sep="\t")
     return df
 
-def read_run_sampling_frequency(vhdr_file):
+def read_run_sampling_frequency(vhdr_file, catalog=None):
     """
     given a .eeg vhdr file, read the respective channel file and return the the sampling frequency for the first
     index, since all channels are throughout the run recorded with the same sampling frequency 
+    :param catalog: optional BIDSCatalog, which is queried instead of parsing the channels.tsv file
     """
     ch_file = vhdr_file[:-9]+'channels.tsv' # read out the channel
+    if catalog is not None:
+        return catalog.channels(ch_file)['sampling_frequency']
     df = pd.read_csv(ch_file, sep="\t")
     return df['sampling_frequency']  
 
-def read_line_noise(BIDS_path, subject):
+def read_line_noise(BIDS_path, subject, catalog=None):
     """
     return the line noise for a given subject (in shape '000') from participants.tsv
+    :param catalog: optional BIDSCatalog, which is queried instead of parsing participants.tsv
     """
+    if catalog is not None:
+        return catalog.line_noise(subject)
     df = pd.read_csv(BIDS_path+'participants.tsv', sep="\t")
     row_ = np.where(df['participant_id'] == 'sub-'+str(subject))[0][0]
     return df.iloc[row_]['line_noise']
 
-def get_patient_coordinates(ch_names, ind_cortex, ind_subcortex, vhdr_file, BIDS_path):
+def get_patient_coordinates(ch_names, ind_cortex, ind_subcortex, vhdr_file, BIDS_path, catalog=None):
     """
     for a given vhdr file, the respective BIDS path, and the used channel names of a BIDS run
+    :param catalog: optional BIDSCatalog, see get_coords_df_from_vhdr
     :return the coordinate file of the used channels 
         in shape (2): cortex; subcortex; fields might be empty (None if no cortex/subcortex channels are existent)
         appart from that the used fields are in numpy array field shape (num_coords, 3)
     """
-    df = get_coords_df_from_vhdr(vhdr_file, BIDS_path)  # this dataframe contains all coordinates in this session
+    df = get_coords_df_from_vhdr(vhdr_file, BIDS_path, catalog)  # this dataframe contains all coordinates in this session
     coord_patient = np.empty(2, dtype=object)
 
     if ind_cortex is not None:
@@ -307,7 +461,8 @@ def get_used_ch_idx(used_channels, ch_names_BV):
 def get_dat_cortex_subcortex(bv_raw, ch_names, used_channels):
     """
     Data segemntation into cortex, subcortex, MOV and dat; returns also respective indizes of bv_raw
-    :param bv_raw: raw np.array of Brainvision-read file
+    :param bv_raw: raw np.array of Brainvision-read file, or a BrainVisionMemmap; then only the used
+        channels are read from disk
     :param ch_names
     """
 
@@ -350,7 +505,7 @@ def sess_right(sess):
         sess_right = False
     return sess_right
 
-def write_all_M1_channel_files(settings, cortex_ref='average', subcortex_ref='-'):
+def write_all_M1_channel_files(settings, cortex_ref='average', subcortex_ref='-', catalog=None):
     """
 
     Read all channels.tsv in the settings defined BIDS path, and write all all channels_M1.tsv files 
@@ -359,43 +514,245 @@ def write_all_M1_channel_files(settings, cortex_ref='average', subcortex_ref='-'
     --> rereference all cortex to average, subcortex=None
     --> used all to 1 
 
+    if a BIDSCatalog is provided, channels.tsv files are listed and read from the catalog
     """
 
     #settings = IO.read_settings()  # reads settings from settings/settings.json file in a dict 
 
 
+    if catalog is not None:
+        ch_files = catalog.list_files('channels')
+    else:
+        ch_files = []
+        for root, dirs, files in os.walk(settings['BIDS_path']):
+            for file in files:
+                if file.endswith("_channels.tsv"):
+                    ch_files.append(os.path.join(root, file))
+
     BIDS_channel_tsv_files = []
-    for root, dirs, files in os.walk(settings['BIDS_path']):
-        for file in files:
-            if file.endswith("_channels.tsv"):
-                ch_file = os.path.join(root, file)
-                
-                df_channel = pd.read_csv(ch_file, sep="\t")
-                
-                df = pd.DataFrame(np.nan, index=np.arange(len(list(df_channel['name']))), columns=['name', 'rereference', 'used', 'target'])
+    for ch_file in ch_files:
+        if catalog is not None:
+            df_channel = catalog.channels(ch_file)
+        else:
+            df_channel = pd.read_csv(ch_file, sep="\t")
+        
+        df = pd.DataFrame(np.nan, index=np.arange(len(list(df_channel['name']))), columns=['name', 'rereference', 'used', 'target'])
 
-                df['used'] = 1
+        df['used'] = 1
 
-                df['name'] = list(df_channel['name'].copy(deep=True))
+        df['name'] = list(df_channel['name'].copy(deep=True))
 
-                ch_mov = [ch_idx for ch_idx, ch in enumerate(df_channel['name']) if ch.startswith('MOV')]
-                target = np.zeros(len(list(df_channel['name'])))
-                target[ch_mov] = 1
-                df['target'] = target.astype(int)
-                
-                rereference = ["" for x in range(len(list(df_channel['name'])))]
+        ch_mov = [ch_idx for ch_idx, ch in enumerate(df_channel['name']) if ch.startswith('MOV')]
+        target = np.zeros(len(list(df_channel['name'])))
+        target[ch_mov] = 1
+        df['target'] = target.astype(int)
+        
+        rereference = ["" for x in range(len(list(df_channel['name'])))]
 
-                for ch_idx, ch in enumerate(df_channel['name']):
-                    if ch.startswith('ECOG'):
-                        rereference[ch_idx]=cortex_ref 
-                    if ch.startswith('STN'):
-                        rereference[ch_idx]=subcortex_ref 
+        for ch_idx, ch in enumerate(df_channel['name']):
+            if ch.startswith('ECOG'):
+                rereference[ch_idx]=cortex_ref 
+            if ch.startswith('STN'):
+                rereference[ch_idx]=subcortex_ref 
 
 
-                
+        
+
+        df['rereference'] =rereference
+
+        df.to_csv(ch_file[:-12]+'channels_M1.tsv', sep='\t')
+
+        BIDS_channel_tsv_files.append(ch_file)
+
+
+class BIDSCatalog:
+    """
+    Persistent SQLite index of a BIDS folder
 
-                df['rereference'] =rereference
+    The catalog lists all runs (.vhdr), channels.tsv and electrodes.tsv files and stores the
+    parsed channel names, types and sampling frequencies, the electrode coordinates and the
+    line noise of participants.tsv. The folder is crawled only if the modification time of
+    one of the previously crawled directories changed; a tsv file is parsed again if its
+    modification time changed. Thus repeated lookups only need a stat instead of a crawl
+    or a parse, which is important for network mounted datasets.
 
-                df.to_csv(ch_file[:-12]+'channels_M1.tsv', sep='\t')
+    Example:
+        catalog = IO.BIDSCatalog(settings['BIDS_path'])
+        vhdr_files = IO.get_all_vhdr_files(settings['BIDS_path'], catalog)
+        sf = IO.read_run_sampling_frequency(vhdr_file, catalog)
+
+    Args:
+        BIDS_path (string)
+        db_file (string, optional): SQLite file; defaults to a file in ~/.cache/icn_m1 per BIDS_path,
+            such that the catalog is stored on the local disk
+    """
+
+    FILE_KINDS = {
+        "vhdr": ".vhdr",
+        "channels": "_channels.tsv",
+        "electrodes": "_electrodes.tsv"
+    }
 
-                BIDS_channel_tsv_files.append(ch_file)
\ No newline at end of file
+    def __init__(self, BIDS_path, db_file=None):
+        self.BIDS_path = BIDS_path
+        if db_file is None:
+            key = hashlib.md5(os.path.abspath(BIDS_path).encode('utf-8')).hexdigest()
+            db_file = os.path.join(os.path.expanduser('~'), '.cache', 'icn_m1', 'bids_catalog_'+key+'.sqlite')
+        if os.path.dirname(db_file) != '':
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self.db_file = db_file
+        self._con = None
+        self._pid = None
+        with self.con:
+            self.con.executescript("""
+                CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL);
+                CREATE TABLE IF NOT EXISTS listing (path TEXT PRIMARY KEY, kind TEXT);
+                CREATE TABLE IF NOT EXISTS runs (vhdr_file TEXT PRIMARY KEY, subject TEXT, sess TEXT, run TEXT);
+                CREATE TABLE IF NOT EXISTS parsed (path TEXT PRIMARY KEY, mtime REAL);
+                CREATE TABLE IF NOT EXISTS channels (file TEXT, idx INTEGER, name TEXT, type TEXT,
+                    sampling_frequency REAL, PRIMARY KEY (file, idx));
+                CREATE TABLE IF NOT EXISTS electrodes (file TEXT, idx INTEGER, name TEXT, x REAL, y REAL, z REAL,
+                    PRIMARY KEY (file, idx));
+                CREATE TABLE IF NOT EXISTS participants (participant_id TEXT PRIMARY KEY, line_noise REAL);
+            """)
+
+    @property
+    def con(self):
+        # connections can not be shared with forked processes, e.g. of multiprocessing.Pool
+        if self._con is None or self._pid != os.getpid():
+            self._con = sqlite3.connect(self.db_file, timeout=60)
+            self._con.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._con
+
+    def _listing_current(self):
+        dirs = self.con.execute('SELECT path, mtime FROM dirs').fetchall()
+        if len(dirs) == 0:
+            return False
+        for path, mtime in dirs:
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def crawl(self):
+        """
+        list all directories and files of the BIDS folder
+        """
+        dirs = []
+        listing = []
+        runs = []
+        for root, _, files in os.walk(self.BIDS_path):
+            dirs.append((root, os.stat(root).st_mtime))
+            for file in files:
+                for kind, ending in self.FILE_KINDS.items():
+                    if file.endswith(ending):
+                        path = os.path.join(root, file)
+                        listing.append((path, kind))
+                        if kind == "vhdr":
+                            runs.append((path,) + tuple(get_sess_run_subject(path)))
+        with self.con:
+            self.con.execute('DELETE FROM dirs')
+            self.con.execute('DELETE FROM listing')
+            self.con.execute('DELETE FROM runs')
+            self.con.executemany('INSERT INTO dirs VALUES (?, ?)', dirs)
+            self.con.executemany('INSERT INTO listing VALUES (?, ?)', listing)
+            self.con.executemany('INSERT INTO runs VALUES (?, ?, ?, ?)', runs)
+
+    def list_files(self, kind):
+        """
+        Args:
+            kind (string): "vhdr", "channels" or "electrodes"
+        Returns:
+            list: sorted file paths
+        """
+        if not self._listing_current():
+            self.crawl()
+        return [row[0] for row in self.con.execute(
+            'SELECT path FROM listing WHERE kind = ? ORDER BY path', (kind,))]
+
+    def vhdr_files(self, subject=None, sess=None):
+        """
+        Args:
+            subject (string, optional): in shape '000'
+            sess (string, optional): e.g. 'right'
+        Returns:
+            list: sorted vhdr files, optionally of one subject/session
+        """
+        if not self._listing_current():
+            self.crawl()
+        query = 'SELECT vhdr_file FROM runs WHERE 1=1'
+        params = []
+        if subject is not None:
+            query += ' AND subject = ?'
+            params.append(subject)
+        if sess is not None:
+            query += ' AND sess = ?'
+            params.append(sess)
+        return [row[0] for row in self.con.execute(query + ' ORDER BY vhdr_file', params)]
+
+    def _parse_if_changed(self, path, parse_fun):
+        mtime = os.stat(path).st_mtime
+        row = self.con.execute('SELECT mtime FROM parsed WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == mtime:
+            return
+        with self.con:
+            parse_fun(path)
+            self.con.execute('INSERT OR REPLACE INTO parsed VALUES (?, ?)', (path, mtime))
+
+    def _parse_channels(self, path):
+        df = pd.read_csv(path, sep="\t")
+        types = df['type'] if 'type' in df.columns else [None]*df.shape[0]
+        fs = df['sampling_frequency'] if 'sampling_frequency' in df.columns else [None]*df.shape[0]
+        self.con.execute('DELETE FROM channels WHERE file = ?', (path,))
+        self.con.executemany('INSERT INTO channels VALUES (?, ?, ?, ?, ?)',
+                             [(path, idx, str(df['name'][idx]), None if pd.isna(types[idx]) else str(types[idx]),
+                               None if pd.isna(fs[idx]) else float(fs[idx])) for idx in range(df.shape[0])])
+
+    def _parse_electrodes(self, path):
+        df = pd.read_csv(path, sep="\t")
+        self.con.execute('DELETE FROM electrodes WHERE file = ?', (path,))
+        self.con.executemany('INSERT INTO electrodes VALUES (?, ?, ?, ?, ?, ?)',
+                             [(path, idx, str(df['name'][idx]), float(df['x'][idx]), float(df['y'][idx]),
+                               float(df['z'][idx])) for idx in range(df.shape[0])])
+
+    def _parse_participants(self, path):
+        df = pd.read_csv(path, sep="\t")
+        line_noise = df['line_noise'] if 'line_noise' in df.columns else [None]*df.shape[0]
+        self.con.execute('DELETE FROM participants')
+        self.con.executemany('INSERT INTO participants VALUES (?, ?)',
+                             [(str(df['participant_id'][idx]),
+                               None if pd.isna(line_noise[idx]) else float(line_noise[idx]))
+                              for idx in range(df.shape[0])])
+
+    def channels(self, channels_file):
+        """
+        Returns:
+            pd DataFrame: name, type and sampling_frequency of a channels.tsv file
+        """
+        self._parse_if_changed(channels_file, self._parse_channels)
+        return pd.read_sql_query('SELECT name, type, sampling_frequency FROM channels WHERE file = ? ORDER BY idx',
+                                 self.con, params=(channels_file,))
+
+    def electrodes(self, electrodes_file):
+        """
+        Returns:
+            pd DataFrame: name, x, y, z of an electrodes.tsv file
+        """
+        self._parse_if_changed(electrodes_file, self._parse_electrodes)
+        return pd.read_sql_query('SELECT name, x, y, z FROM electrodes WHERE file = ? ORDER BY idx',
+                                 self.con, params=(electrodes_file,))
+
+    def line_noise(self, subject):
+        """
+        return the line noise for a given subject (in shape '000') from participants.tsv,
+        raises a KeyError if the subject is not listed or its line noise is missing
+        """
+        self._parse_if_changed(os.path.join(self.BIDS_path, 'participants.tsv'), self._parse_participants)
+        row = self.con.execute('SELECT line_noise FROM participants WHERE participant_id = ?',
+                               ('sub-'+str(subject),)).fetchone()
+        if row is None or row[0] is None or np.isnan(row[0]):
+            raise KeyError('sub-'+str(subject))
+        return int(row[0])
@@ -0,0 +1,50 @@
+"""
+Parallel per band fit and transform of the FilterBank / TimeLagFilterBank estimators.
+
+Every frequency band, the last axis of X in shape(n_epochs, n_channels, n_samples, n_bands), is fit
+with its own deepcopy of the estimator (e.g. SPoC or SSD). With n_jobs > 1 the bands are distributed
+over joblib worker processes. X is passed whole to all jobs: joblib dumps arrays larger than
+max_nbytes once into a memory-mapped file, which every worker opens read only, and each job takes
+its band as a view. The band data is thereby never pickled per band.
+
+With n_jobs=1 (or None) the bands are fit serially in the calling process, as before.
+"""
+from copy import deepcopy
+from joblib import Parallel, delayed
+
+
+def _fit_band(estimator, X, y, band_idx):
+    return deepcopy(estimator).fit(X[..., band_idx], y)
+
+
+def _transform_band(model, X, band_idx):
+    return model.transform(X[..., band_idx])
+
+
+def fit_bands(estimator, X, y=None, n_jobs=1, max_nbytes='1M'):
+    """
+    Args:
+        estimator: sklearn estimator, copied for every band
+        X (np array): shape(..., n_bands)
+        y (np array, optional)
+        n_jobs (int): number of joblib processes, -1 for all CPUs
+        max_nbytes (str | int): arrays above this size are memory-mapped, see joblib.Parallel
+
+    Returns:
+        list: fitted estimator of every band
+    """
+    if n_jobs is None or n_jobs == 1:
+        return [_fit_band(estimator, X, y, band_idx) for band_idx in range(X.shape[-1])]
+    return Parallel(n_jobs=n_jobs, max_nbytes=max_nbytes, mmap_mode='r')(
+        delayed(_fit_band)(estimator, X, y, band_idx) for band_idx in range(X.shape[-1]))
+
+
+def transform_bands(models, X, n_jobs=1, max_nbytes='1M'):
+    """
+    Returns:
+        list: models[i].transform(X[..., i]) of every band i
+    """
+    if n_jobs is None or n_jobs == 1:
+        return [_transform_band(model, X, band_idx) for band_idx, model in enumerate(models)]
+    return Parallel(n_jobs=n_jobs, max_nbytes=max_nbytes, mmap_mode='r')(
+        delayed(_transform_band)(model, X, band_idx) for band_idx, model in enumerate(models))
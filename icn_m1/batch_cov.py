@@ -0,0 +1,111 @@
+"""
+Batched single trial covariance estimation for the SSD and SPoC classes.
+
+regularized_covariances returns the same covariances as calling mne.cov._regularized_covariance
+for every epoch, but computes them for all epochs at once: one batched matrix product
+X @ X^T / n_samples for the empirical covariances (mne assumes centered epochs), followed by vectorized
+shrinkage towards mu*I, mu = trace(C)/n_channels, with the shrinkage intensity of every epoch, and
+the n_samples/(n_samples-1) bias correction of mne:
+
+    reg=None / 'empirical'    no shrinkage
+    reg=float                 fixed shrinkage
+    reg='oas'                 Oracle Approximating Shrinkage (sklearn.covariance.OAS)
+    reg='ledoit_wolf'         Ledoit-Wolf shrinkage (sklearn.covariance.LedoitWolf)
+
+mne estimates the covariance of rank deficient data (rank=None) in the subspace of the data,
+such epochs and all other estimators, method_params and rank options are computed with mne.
+
+    X in shape(n_epochs, n_channels, n_samples) -> covs in shape(n_epochs, n_channels, n_channels)
+"""
+import numpy as np
+import mne
+import mne.cov
+
+SHRINKAGE_METHODS = ("empirical", "oas", "ledoit_wolf")
+
+
+def shrink(covs, shrinkage):
+    """
+    Args:
+        covs (np array): shape(n_epochs, n_channels, n_channels)
+        shrinkage (np array): shape(n_epochs), values in [0, 1]
+
+    Returns:
+        np array: (1-shrinkage)*covs + shrinkage*trace(covs)/n_channels*I
+    """
+    n_channels = covs.shape[-1]
+    shrinkage = np.asarray(shrinkage, dtype=np.float64).reshape(-1, 1, 1)
+    mu = np.trace(covs, axis1=1, axis2=2).reshape(-1, 1, 1) / n_channels
+    return (1 - shrinkage) * covs + shrinkage * mu * np.eye(n_channels)
+
+
+def oas_shrinkage(covs, n_samples):
+    """
+    OAS shrinkage intensity of every epoch, see sklearn.covariance.oas
+    """
+    n_channels = covs.shape[-1]
+    alpha = np.mean(covs**2, axis=(1, 2))
+    mu = np.trace(covs, axis1=1, axis2=2) / n_channels
+    num = alpha + mu**2
+    den = (n_samples + 1) * (alpha - mu**2 / n_channels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shrinkage = np.where(den == 0, 1.0, np.minimum(num / den, 1.0))
+    return shrinkage
+
+
+def ledoit_wolf_shrinkage(X, covs):
+    """
+    Ledoit-Wolf shrinkage intensity of every epoch of centered data, see
+    sklearn.covariance.ledoit_wolf_shrinkage
+    """
+    n_samples, n_channels = X.shape[2], X.shape[1]
+    X2 = X**2
+    emp_cov_trace = X2.sum(axis=2) / n_samples
+    mu = emp_cov_trace.sum(axis=1) / n_channels
+    beta_ = np.sum(X2.sum(axis=1)**2, axis=1)  # sum of X2^T X2
+    delta_ = np.sum((covs * n_samples)**2, axis=(1, 2)) / n_samples**2
+    beta = 1.0 / (n_channels * n_samples) * (beta_ / n_samples - delta_)
+    delta = (delta_ - 2.0 * mu * emp_cov_trace.sum(axis=1) + n_channels * mu**2) / n_channels
+    beta = np.minimum(beta, delta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shrinkage = np.where(beta == 0, 0.0, beta / delta)
+    return shrinkage
+
+
+def _is_batched(reg, method_params, rank):
+    if method_params is not None or rank not in (None, 'full'):
+        return False
+    return reg is None or (not isinstance(reg, str) and np.isscalar(reg)) or reg in SHRINKAGE_METHODS
+
+
+def regularized_covariances(X, reg=None, method_params=None, rank=None):
+    """
+    regularized covariance of every epoch, equal to mne.cov._regularized_covariance(epoch, reg, method_params, rank)
+
+    Args:
+        X (np array): shape(n_epochs, n_channels, n_samples)
+        reg (float | str | None): as in mne.decoding.SPoC, None for the empirical covariance
+        method_params (dict, optional): as in mne.decoding.SPoC, computed per epoch with mne
+        rank (None | dict | 'info' | 'full'): as in mne.decoding.SPoC
+
+    Returns:
+        np array: shape(n_epochs, n_channels, n_channels)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if not _is_batched(reg, method_params, rank):
+        return np.stack([mne.cov._regularized_covariance(epoch, reg=reg, method_params=method_params, rank=rank)
+                         for epoch in X])
+    n_samples = X.shape[2]
+    covs = np.matmul(X, X.transpose(0, 2, 1)) / n_samples
+    if reg == 'oas':
+        covs = shrink(covs, oas_shrinkage(covs, n_samples))
+    elif reg == 'ledoit_wolf':
+        covs = shrink(covs, ledoit_wolf_shrinkage(X, covs))
+    elif reg is not None and reg != 'empirical':
+        covs = shrink(covs, np.full(covs.shape[0], float(reg)))
+    covs *= n_samples / max(n_samples - 1, 1)
+
+    if rank is None:  # mne reduces rank deficient epochs to their subspace
+        for idx in np.where(np.linalg.matrix_rank(X) < X.shape[1])[0]:
+            covs[idx] = mne.cov._regularized_covariance(X[idx], reg=reg, rank=rank)
+    return covs
@@ -0,0 +1,176 @@
+"""
+Parallel leave one subject out cross validation over subjects, grid points and models.
+
+Every (model, subject, grid point) combination is one task. The tasks read their data from a
+memory-mapped feature_store.GridPointDataset, which every worker opens once, so the data is
+shared through the page cache instead of being copied into the workers. Tasks are started in
+order of decreasing training set size, such that the longest tasks do not end up last.
+
+Results are stored with the same predict_ dicts and prediction files as leave_one_out_CV.run_CV:
+an object array in shape(num_grid_points) per subject, saved as <subject_id>prediction.npy once
+all tasks of a subject finished. Intermediate results are saved every checkpoint_s seconds as
+<subject_id>prediction_partial.npy, and finished tasks are skipped when the CV is restarted.
+
+Example:
+    models = {"LM": functools.partial(cv_scheduler.fit_predict_estimator, LinearRegression())}
+    cv_scheduler.run_CV(dataset_file, models, subjects=range(16), write_path=settings['write_path'])
+"""
+import multiprocessing
+import os
+import time
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+import feature_store
+import task_queue
+import time_dim
+
+_worker = {}
+
+
+def fit_predict_estimator(estimator, dat_train, label_train, dat_test, label_test):
+    """
+    fit a clone of a sklearn estimator and return the predict_ dict of leave_one_out_CV.train_grid_point
+    """
+    model = clone(estimator)
+    model.fit(dat_train, label_train)
+    y_test_pred = model.predict(dat_test)
+    y_train_pred = model.predict(dat_train)
+    return {
+        "y_pred_test": y_test_pred,
+        "y_test": label_test,
+        "y_pred_train": y_train_pred,
+        "y_train": label_train,
+        "r2_test": r2_score(label_test, y_test_pred),
+        "r2_train": r2_score(label_train, y_train_pred)
+    }
+
+
+def get_subject_id(subject):
+    return str(subject).zfill(3)
+
+
+def get_out_file(write_path, model_name, subject, num_models, partial=False):
+    if num_models > 1:
+        write_path = os.path.join(write_path, model_name)
+    return os.path.join(write_path, get_subject_id(subject) + ('prediction_partial.npy' if partial else 'prediction.npy'))
+
+
+def get_tasks(dataset, models, subjects, grid_points_skip=(), time_stamps=5):
+    """
+    list all (model_name, subject, grid_point) tasks, sorted by decreasing training set size
+
+    Returns:
+        list of tuples
+    """
+    tasks = []
+    for grid_point in dataset.get_grid_points():
+        if grid_point in grid_points_skip:
+            continue
+        blocks = dataset.get_blocks(grid_point)
+        num_rows = sum(stop - start for _, start, stop in blocks)
+        for subject, start, stop in blocks:
+            if subject not in subjects or stop - start <= time_stamps or num_rows - (stop - start) <= time_stamps:
+                continue
+            for model_name in models:
+                tasks.append((num_rows - (stop - start), model_name, subject, int(grid_point)))
+    tasks.sort(key=lambda task: -task[0])
+    return [task[1:] for task in tasks]
+
+
+def _init_worker(dataset_file, models, time_stamps):
+    _worker["dataset"] = feature_store.GridPointDataset(dataset_file)
+    _worker["models"] = models
+    _worker["time_stamps"] = time_stamps
+
+
+def _run_task(task):
+    model_name, subject, grid_point = task
+    dataset = _worker["dataset"]
+    time_stamps = _worker["time_stamps"]
+    dat_test, label_test, train = dataset.get_split(grid_point, subject)
+    if len(train) == 1:
+        dat_train, label_train = train[0]
+    else:
+        dat_train = np.concatenate([dat_ for dat_, _ in train], axis=0)
+        label_train = np.concatenate([label_ for _, label_ in train], axis=0)
+    dat_train, label_train = time_dim.append_time_dim(dat_train, label_train, time_stamps, materialize=True)
+    dat_test, label_test = time_dim.append_time_dim(dat_test, label_test, time_stamps, materialize=True)
+    return model_name, subject, grid_point, _worker["models"][model_name](dat_train, label_train, dat_test, label_test)
+
+
+def run_CV(dataset_file, models, subjects, write_path, grid_points_skip=(), time_stamps=5, n_jobs=None,
+           checkpoint_s=60, Verbose=True):
+    """
+    run the leave one subject out CV of all models for all subjects and grid points in a process pool
+
+    Args:
+        dataset_file (string): feature_store.GridPointDataset file
+        models (dict): name: function(dat_train, label_train, dat_test, label_test) returning a predict_ dict,
+            e.g. functools.partial(fit_predict_estimator, LinearRegression()); must be picklable
+        subjects (list): test subjects (int)
+        write_path (string): output folder, with one subfolder per model if more than one model is given
+        grid_points_skip (list): grid points which are not tested, e.g. grid_points_none
+        time_stamps (int): time concatenation parameter
+        n_jobs (int, optional): number of processes, defaults to the number of CPUs
+        checkpoint_s (float): time in s between saving intermediate results
+        Verbose (bool)
+    """
+    dataset = feature_store.GridPointDataset(dataset_file)
+    subjects = [int(subject) for subject in subjects]
+    tasks = get_tasks(dataset, models, subjects, grid_points_skip, time_stamps)
+
+    out = {}
+    remaining = {}
+    for model_name, subject, grid_point in tasks:
+        remaining[(model_name, subject)] = remaining.get((model_name, subject), 0) + 1
+    for model_name, subject in list(remaining.keys()):
+        os.makedirs(os.path.dirname(get_out_file(write_path, model_name, subject, len(models))), exist_ok=True)
+        out_file = get_out_file(write_path, model_name, subject, len(models))
+        partial_file = get_out_file(write_path, model_name, subject, len(models), partial=True)
+        if os.path.exists(out_file):
+            del remaining[(model_name, subject)]
+        elif os.path.exists(partial_file):
+            out[(model_name, subject)] = np.load(partial_file, allow_pickle=True)
+        else:
+            out[(model_name, subject)] = np.empty(dataset.num_grid_points, dtype=object)
+
+    tasks = [task for task in tasks if task[:2] in remaining and out[task[:2]][task[2]] is None]
+    for model_name, subject in remaining:
+        remaining[(model_name, subject)] = sum(1 for task in tasks if task[:2] == (model_name, subject))
+    if Verbose:
+        print(str(len(tasks)) + ' CV tasks')
+
+    def save_subject(key, partial):
+        if partial:
+            task_queue.save_atomic(get_out_file(write_path, key[0], key[1], len(models), partial=True), out[key])
+        else:
+            task_queue.save_atomic(get_out_file(write_path, key[0], key[1], len(models)), out[key])
+            partial_file = get_out_file(write_path, key[0], key[1], len(models), partial=True)
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+
+    for key in remaining:
+        if remaining[key] == 0:
+            save_subject(key, partial=False)
+
+    t_checkpoint = time.time()
+    changed = set()
+    with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=(dataset_file, models, time_stamps)) as pool:
+        for num_done, (model_name, subject, grid_point, predict_) in \
+                enumerate(pool.imap_unordered(_run_task, tasks, chunksize=1)):
+            key = (model_name, subject)
+            out[key][grid_point] = predict_
+            remaining[key] -= 1
+            changed.add(key)
+            if remaining[key] == 0:
+                save_subject(key, partial=False)
+                changed.discard(key)
+            if time.time() - t_checkpoint > checkpoint_s:
+                for key_ in changed:
+                    save_subject(key_, partial=True)
+                changed = set()
+                t_checkpoint = time.time()
+            if Verbose:
+                print(str(num_done+1) + '/' + str(len(tasks)) + ' ' + model_name + ' subject ' +
+                      get_subject_id(subject) + ' grid point ' + str(grid_point))
@@ -0,0 +1,164 @@
+"""
+ElasticNet / Ridge hyperparameter search over regularization paths.
+
+Instead of independent cold start fits for every sampled (alpha, l1_ratio), the cross validated
+score is computed on a grid: for every fold the Gram matrix X^T X and X^T y of the centered training
+data are computed once and shared by all l1_ratios. For every l1_ratio the ElasticNet path over the
+decreasing alphas is solved by coordinate descent, each alpha warm started from the solution of the
+previous one (sklearn.linear_model.enet_path). l1_ratio=0 (Ridge) is solved in closed form from
+one eigendecomposition of the Gram matrix.
+
+Several targets with the same features, e.g. the contralateral and ipsilateral movement of one
+channel, are tuned together by passing y in shape(n_samples, n_targets): all targets share the
+centering, the Gram matrix and the Ridge eigendecomposition of every fold, while every target gets
+its own path and hyperparameters. fit_multi fits the selected models with one Gram matrix.
+
+The objective equals the gp_minimize objectives of the best_electrode_classification scripts:
+ElasticNet(alpha, l1_ratio, fit_intercept=True), KFold(cv) without shuffling, r2 per fold clipped
+at 0 and averaged over folds.
+
+Example:
+    res = enet_path.optimize_enet_path(dat_tr, label_tr)
+    model = ElasticNet(alpha=res['x'][0], l1_ratio=res['x'][1], max_iter=1000)
+"""
+import numpy as np
+from scipy.optimize import OptimizeResult
+from sklearn.linear_model import enet_path
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold
+
+ALPHAS = np.logspace(0, -4, 41)
+L1_RATIOS = (0, 0.1, 0.5, 0.7, 0.9, 0.95, 0.99, 1)
+
+
+def ridge_path(Gram, Xy, alphas, n_samples):
+    """
+    Ridge coefficients in the ElasticNet parametrization (l1_ratio=0), i.e. sklearn.linear_model.Ridge
+    with penalty n_samples*alpha, of centered data
+
+    Args:
+        Gram (np array): X^T X, shape(n_features, n_features)
+        Xy (np array): X^T y, shape(n_features) or shape(n_features, n_targets)
+        alphas (np array)
+        n_samples (int)
+
+    Returns:
+        np array: shape(n_features, n_alphas) or shape(n_features, n_targets, n_alphas)
+    """
+    eigvals, eigvecs = np.linalg.eigh((Gram + Gram.T)/2)
+    eigvals = np.clip(eigvals, 0, None)
+    Xy_rot = eigvecs.T @ Xy
+    scale = 1 / (eigvals[:, None] + n_samples*np.asarray(alphas)[None, :])
+    if Xy.ndim == 1:
+        return eigvecs @ (Xy_rot[:, None] * scale)
+    return np.einsum('fk,kta->fta', eigvecs, Xy_rot[:, :, None] * scale[:, None, :])
+
+
+def _center(X_tr, y_tr, standardize):
+    X_mean, y_mean = X_tr.mean(axis=0), y_tr.mean(axis=0)
+    X_tr = X_tr - X_mean
+    X_std = np.ones(X_tr.shape[1])
+    if standardize:
+        X_std = X_tr.std(axis=0)
+        X_std[X_std == 0] = 1
+        X_tr = X_tr / X_std
+    return np.asfortranarray(X_tr), y_tr - y_mean, X_mean, X_std, y_mean
+
+
+def cv_path(x, y, alphas=ALPHAS, l1_ratios=L1_RATIOS, cv=3, standardize=False, max_iter=1000, tol=1e-4):
+    """
+    cross validated r2 for all combinations of alphas and l1_ratios
+
+    Args:
+        x (np array): shape(n_samples, n_features)
+        y (np array): shape(n_samples) or shape(n_samples, n_targets)
+        alphas (np array): regularization strengths, solved in decreasing order
+        l1_ratios (list): ElasticNet mixing parameters, 0 for Ridge
+        cv (int): number of folds, KFold without shuffling
+        standardize (bool): if True the features are scaled with the training fold std first,
+            as make_pipeline(StandardScaler(), ElasticNet())
+        max_iter, tol: coordinate descent parameters of ElasticNet
+
+    Returns:
+        np array: shape(n_l1_ratios, n_alphas), respectively shape(n_targets, n_l1_ratios, n_alphas),
+            mean r2 over folds, each fold clipped at 0
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    Y = y[:, None] if y.ndim == 1 else y
+    alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+    scores = np.zeros((Y.shape[1], len(l1_ratios), len(alphas)))
+    for train_index, test_index in KFold(n_splits=cv, shuffle=False).split(x):
+        X_tr, Y_tr, X_mean, X_std, Y_mean = _center(x[train_index], Y[train_index], standardize)
+        X_te = (x[test_index] - X_mean) / X_std
+        Gram = X_tr.T @ X_tr
+        Xy = X_tr.T @ Y_tr
+        for l1_idx, l1_ratio in enumerate(l1_ratios):
+            if l1_ratio == 0:
+                coefs = ridge_path(Gram, Xy, alphas, X_tr.shape[0])
+            else:
+                coefs = np.stack([enet_path(X_tr, Y_tr[:, target], l1_ratio=l1_ratio, alphas=alphas, precompute=Gram,
+                                            Xy=Xy[:, target], max_iter=max_iter, tol=tol)[1]
+                                  for target in range(Y.shape[1])], axis=1)
+            Y_pred = np.einsum('nf,fta->nta', X_te, coefs) + Y_mean[None, :, None]
+            for target in range(Y.shape[1]):
+                for alpha_idx in range(len(alphas)):
+                    scores[target, l1_idx, alpha_idx] += max(r2_score(Y[test_index, target],
+                                                                      Y_pred[:, target, alpha_idx]), 0)
+    scores = scores / cv
+    return scores[0] if y.ndim == 1 else scores
+
+
+def optimize_enet_path(x, y, alphas=ALPHAS, l1_ratios=L1_RATIOS, cv=3, standardize=False, max_iter=1000):
+    """
+    select alpha and l1_ratio with the best cross validated r2 on the grid of cv_path
+
+    Returns:
+        OptimizeResult: as returned by skopt.gp_minimize, x=[alpha, l1_ratio] and fun=-r2; for the
+            bayes_opt based scripts also params={'alpha', 'l1_ratio'} and target=r2.
+            The full grid is given in scores, alphas and l1_ratios.
+            For y in shape(n_samples, n_targets) a list with one OptimizeResult per target
+    """
+    alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+    scores = cv_path(x, y, alphas, l1_ratios, cv, standardize, max_iter)
+    if scores.ndim == 3:
+        return [_get_result(scores_, alphas, l1_ratios) for scores_ in scores]
+    return _get_result(scores, alphas, l1_ratios)
+
+
+def _get_result(scores, alphas, l1_ratios):
+    l1_idx, alpha_idx = np.unravel_index(np.argmax(scores), scores.shape)
+    alpha, l1_ratio = float(alphas[alpha_idx]), float(l1_ratios[l1_idx])
+    return OptimizeResult(x=[alpha, l1_ratio], fun=-scores[l1_idx, alpha_idx],
+                          params={'alpha': alpha, 'l1_ratio': l1_ratio}, target=scores[l1_idx, alpha_idx],
+                          scores=scores, alphas=alphas, l1_ratios=l1_ratios)
+
+
+def fit_multi(x, y, params, standardize=False, max_iter=1000, tol=1e-4):
+    """
+    fit one ElasticNet per target with a shared Gram matrix
+
+    Args:
+        x (np array): shape(n_samples, n_features)
+        y (np array): shape(n_samples, n_targets)
+        params (list): [alpha, l1_ratio] of every target, e.g. the x of optimize_enet_path
+        standardize (bool): see cv_path, the returned coefficients refer to the unscaled features
+
+    Returns:
+        coefs (np array): shape(n_features, n_targets)
+        intercepts (np array): shape(n_targets)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    X_tr, y_tr, X_mean, X_std, y_mean = _center(x, y, standardize)
+    Gram = X_tr.T @ X_tr
+    Xy = X_tr.T @ y_tr
+    coefs = np.zeros((x.shape[1], y.shape[1]))
+    for target, (alpha, l1_ratio) in enumerate(params):
+        if l1_ratio == 0:
+            coefs[:, target] = ridge_path(Gram, Xy[:, target], [alpha], X_tr.shape[0])[:, 0]
+        else:
+            coefs[:, target] = enet_path(X_tr, y_tr[:, target], l1_ratio=l1_ratio, alphas=[alpha], precompute=Gram,
+                                         Xy=Xy[:, target], max_iter=max_iter, tol=tol)[1][:, 0]
+    coefs = coefs / X_std[:, None]
+    return coefs, y_mean - X_mean @ coefs
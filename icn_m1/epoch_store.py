@@ -0,0 +1,183 @@
+"""
+Memory-mapped storage and lazy views of the continuous epochs of offline_analysis.create_continous_epochs.
+
+The epochs of a run in shape(n_windows, n_channels, n_samples, n_f_bands) need
+n_samples*n_f_bands values per window and channel, i.e. several GB per hour of recording. Instead of
+allocating them in memory and pickling them within the sub_ dict, they can be
+
+    written to disk: create_epoch_file opens a memory-mapped npy file (e.g. float32), into which
+        create_continous_epochs(..., out=epochs) writes window by window; save_epochs pickles the sub_
+        dict with the npy file name in place of the array, load_epochs opens it again memory-mapped
+        (pickles with the array itself are loaded as before)
+
+    computed on demand: lazy_continous_epochs filters the continuous signal once (line noise notch and
+        band filters) and returns a ContinuousEpochs view, whose epochs are strided windows of the
+        filtered signal. Only the filtered signal, n_time*n_channels*n_f_bands values, is stored.
+
+The lazy epochs are aligned with the windows of create_continous_epochs, but are not identical to
+them: create_continous_epochs filters every 1 s window separately, such that its epochs contain
+the edge effects of the 1001 tap band filters, which the continuously filtered signal does not have.
+
+Example:
+    epochs = epoch_store.lazy_continous_epochs(fs, fs_new, offset_start, downsample_idx, line_noise,
+                                               dat_ECOG, filter_fun, new_num_data_points)
+    for X in epochs.iter_chunks(1000):
+        ...  # shape(1000, n_channels, n_samples, n_f_bands)
+"""
+import os
+import pickle
+import numpy as np
+import mne
+import scipy.signal
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def create_epoch_file(file, shape, dtype=np.float32):
+    """
+    Args:
+        file (string): npy file, overwritten if it exists
+        shape (tuple): shape(n_windows, n_channels, n_samples, n_f_bands)
+        dtype: e.g. np.float32 to halve the size of float64 epochs
+
+    Returns:
+        np.memmap: writable epoch array
+    """
+    return np.lib.format.open_memmap(file, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+def save_epochs(out_path, sub_, key="epochs"):
+    """
+    pickle sub_, a memory-mapped sub_[key] is flushed and stored by its npy file name
+
+    Args:
+        out_path (string): pickle file
+        sub_ (dict)
+        key (string): field of the epochs
+    """
+    epochs = sub_[key]
+    if isinstance(epochs, np.memmap):
+        epochs.flush()
+        sub_ = dict(sub_)
+        sub_[key] = os.path.relpath(epochs.filename, os.path.dirname(os.path.abspath(out_path)))
+    with open(out_path, 'wb') as handle:
+        pickle.dump(sub_, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_epochs(in_path, key="epochs", mmap_mode='r'):
+    """
+    load a sub_ dict written by save_epochs or pickle.dump
+
+    Args:
+        in_path (string): pickle file
+        key (string): field of the epochs
+        mmap_mode (string | None): mode of np.load for epochs stored in npy files, None loads them into memory
+
+    Returns:
+        dict: sub_ with sub_[key] as np array or np.memmap
+    """
+    with open(in_path, 'rb') as handle:
+        sub_ = pickle.load(handle)
+    if isinstance(sub_.get(key), str):
+        sub_[key] = np.load(os.path.join(os.path.dirname(os.path.abspath(in_path)), sub_[key]), mmap_mode=mmap_mode)
+    return sub_
+
+
+class ContinuousEpochs:
+    """
+    Lazy epochs in shape(n_windows, n_channels, n_samples, n_f_bands), windows of a filtered signal
+
+    Epoch k is filtered[ends[k]-n_samples:ends[k]], transposed to shape(n_channels, n_samples, n_f_bands).
+    A single epoch (integer index) is a strided view, any other index returns a copy of the selected
+    epochs only.
+
+    Args:
+        filtered (np array): shape(n_time, n_channels, n_f_bands)
+        ends (np array): end sample (exclusive) of every epoch, each at least n_samples
+        n_samples (int): epoch length
+    """
+
+    def __init__(self, filtered, ends, n_samples):
+        ends = np.asarray(ends)
+        if ends.min() < n_samples or ends.max() > filtered.shape[0]:
+            raise ValueError("all epochs have to lie within the filtered signal")
+        self.filtered = filtered
+        self.ends = ends
+        self.n_samples = n_samples
+        # windows[t] = filtered[t:t+n_samples] in shape(n_channels, n_f_bands, n_samples)
+        self.windows = sliding_window_view(filtered, n_samples, axis=0)
+        self.shape = (ends.shape[0], filtered.shape[1], n_samples, filtered.shape[2])
+        self.dtype = filtered.dtype
+        self.ndim = 4
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            epochs = self[idx[0]]
+            if isinstance(idx[0], (int, np.integer)):
+                return epochs[idx[1:]]
+            return epochs[(slice(None),) + idx[1:]]
+        starts = self.ends[idx] - self.n_samples
+        return np.swapaxes(self.windows[starts], -1, -2)
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+    def iter_chunks(self, chunk_size=1000):
+        """
+        Yields:
+            np array: consecutive epochs in shape(<=chunk_size, n_channels, n_samples, n_f_bands)
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self[start:start+chunk_size]
+
+
+def filter_continous(data_, fs, filter_fun, line_noise, notch_length=None, dtype=np.float32):
+    """
+    notch filter of the line noise and its harmonics and band filtering of the whole signal,
+    as filter.apply_filter(..., variance=False) does for every window
+
+    Args:
+        data_ (np array): shape(n_channels, n_time)
+        fs (float): sampling frequency
+        filter_fun (np array): band filters in shape(n_f_bands, filter_len), see filter.calc_band_filters
+        line_noise (int|float): line noise frequency in Hz
+        notch_length (int, optional): notch filter length in samples, default filter_len-2
+            (the notch length of a filter_len-1 sample window in apply_filter)
+        dtype: dtype of the filtered signal
+
+    Returns:
+        np array: shape(n_time, n_channels, n_f_bands)
+    """
+    if notch_length is None:
+        notch_length = filter_fun.shape[1] - 2
+    dat_notch = mne.filter.notch_filter(x=np.asarray(data_, dtype=np.float64), Fs=fs, trans_bandwidth=7,
+                                        freqs=np.arange(line_noise, 4*line_noise, line_noise),
+                                        fir_design='firwin', verbose=False, notch_widths=1, filter_length=notch_length)
+    filtered = np.empty((dat_notch.shape[1], dat_notch.shape[0], filter_fun.shape[0]), dtype=dtype)
+    for band in range(filter_fun.shape[0]):
+        filtered[:, :, band] = scipy.signal.fftconvolve(dat_notch, filter_fun[band][None, :], mode='same', axes=1).T
+    return filtered
+
+
+def lazy_continous_epochs(fs, fs_new, offset_start, downsample_idx, line_noise, data_, filter_fun,
+                          new_num_data_points, dtype=np.float32):
+    """
+    lazy counterpart of offline_analysis.create_continous_epochs, see ContinuousEpochs
+
+    Epoch k ends at downsample_idx[k+offset_start] and has the filter length of filter_fun, as the
+    'same' convolution of a window with the band filters in filter.apply_filter. Samples before the
+    start of the recording are zero.
+
+    Returns:
+        ContinuousEpochs: shape(new_num_data_points-offset_start, n_channels, filter_len, n_f_bands)
+    """
+    n_samples = filter_fun.shape[1]
+    ends = np.asarray(downsample_idx[offset_start:new_num_data_points])
+    filtered = filter_continous(data_, fs, filter_fun, line_noise, dtype=dtype)
+    pad = max(0, n_samples - int(ends.min()))
+    if pad > 0:
+        filtered = np.concatenate((np.zeros((pad,) + filtered.shape[1:], dtype=dtype), filtered), axis=0)
+    return ContinuousEpochs(filtered, ends + pad, n_samples)
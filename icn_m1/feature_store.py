@@ -0,0 +1,473 @@
+"""
+Feature store of preprocessed runs.
+
+Every run of pipeline_runall is written into one HDF5 file, e.g. sub_000_sess_right_run_0.h5,
+instead of one pickled dict. The feature arrays are stored contiguous and uncompressed, such
+that they can be memory-mapped without h5py, and in projection (grid point / channel) major
+order:
+
+    pf_data_median      shape(num_grid_points, time, num_f_bands)
+    rf_data_median      shape(num_channels, time, num_f_bands)
+
+Reading one grid point of a run therefore reads one contiguous block of the file. The small
+fields (labels, active grid points, projection matrices, filter coefficients, ...) are stored
+as further datasets, scalar fields as attributes of the file.
+
+read_run returns the same dict as the previous pickles, with the feature arrays as read only
+views in the previous (time, grid point / channel, f_band) shape; only the accessed parts are
+read from disk. FeatureStore indexes all runs of a folder and slices them by run, grid point,
+channel, band and time.
+
+Example:
+    store = feature_store.FeatureStore(settings['Preprocess_path'])
+    runs = store.get_runs(subject='000', grid_point=10)
+    dat = [store.get_grid_point(run, 10) for run in runs]  # shape(time, num_f_bands)
+"""
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+FILE_ENDING = '.h5'
+
+# feature arrays in shape(time, projection, f_band) in the pipeline, stored as shape(projection, time, f_band)
+FEATURE_FIELDS = ["rf_data_median", "pf_data_median"]
+
+# fields that are arrays or None
+ARRAY_FIELDS = ["downsample_idx", "filter_fun", "arr_act_grid_points", "label_baseline_corrected",
+                "label", "label_con_true"]
+
+# fields in shape (n) with arrays or None as elements
+LIST_FIELDS = ["projection_grid", "coord_patient", "proj_matrix_run"]
+
+
+def get_run_name(subject, sess, run):
+    return 'sub_' + subject + '_sess_' + sess + '_run_' + run
+
+
+def write_run(out_path, run_):
+    """
+    write a run dict of pipeline_runall into a feature store file
+
+    the file is first written under a temporary name and then renamed, such that readers never
+    see a partially written run
+
+    Args:
+        out_path (string): file path ending with FILE_ENDING
+        run_ (dict): fields see pipeline_runall
+    """
+    tmp_path = out_path + '.tmp'
+    with h5py.File(tmp_path, 'w') as f:
+        for key, value in run_.items():
+            if key in FEATURE_FIELDS:
+                f.create_dataset(key, data=np.ascontiguousarray(np.asarray(value).transpose(1, 0, 2)))
+            elif key in ARRAY_FIELDS:
+                if value is not None:
+                    f.create_dataset(key, data=np.asarray(value).astype(bool) if key == "label_con_true"
+                                     else np.asarray(value))
+            elif key in LIST_FIELDS:
+                grp = f.create_group(key)
+                grp.attrs["len"] = len(value)
+                for idx, arr in enumerate(value):
+                    if arr is not None:
+                        grp.create_dataset(str(idx), data=np.asarray(arr))
+            elif key == "used_channels":
+                grp = f.create_group(key)
+                for ch_type, ind in value.items():
+                    if ind is not None:
+                        grp.create_dataset(ch_type, data=np.asarray(ind))
+            elif value is not None:
+                f.attrs[key] = value
+    os.replace(tmp_path, out_path)
+
+
+def _memmap_dataset(file_path, dset):
+    """
+    return a read only np.memmap of a contiguous h5py dataset, None if it is chunked or empty
+    """
+    offset = dset.id.get_offset()
+    if offset is None or dset.chunks is not None or dset.compression is not None:
+        return None
+    return np.memmap(file_path, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape)
+
+
+def read_run(file_path, memmap=True):
+    """
+    read a run of the feature store, or a pickled run of previous pipeline versions
+
+    Args:
+        file_path (string)
+        memmap (bool): if True the feature arrays are memory-mapped, else they are read into memory
+
+    Returns:
+        dict: fields see pipeline_runall; rf_data_median and pf_data_median in shape(time, ch/grid point, f_band)
+    """
+    if file_path.endswith('.p'):
+        with open(file_path, 'rb') as handle:
+            return pickle.load(handle)
+
+    run_ = {}
+    with h5py.File(file_path, 'r') as f:
+        for key, value in f.attrs.items():
+            run_[key] = value.item() if isinstance(value, np.generic) else value
+        for key in ARRAY_FIELDS:
+            run_[key] = f[key][()] if key in f else None
+        for key in LIST_FIELDS:
+            grp = f[key]
+            arr = np.empty(grp.attrs["len"], dtype=object)
+            for idx in range(arr.shape[0]):
+                if str(idx) in grp:
+                    arr[idx] = grp[str(idx)][()]
+            run_[key] = list(arr) if key == "projection_grid" else arr
+        run_["used_channels"] = {ch_type: f["used_channels"][ch_type][()] if ch_type in f["used_channels"] else None
+                                 for ch_type in ["cortex", "subcortex", "labels"]}
+        for key in FEATURE_FIELDS:
+            dat = _memmap_dataset(file_path, f[key]) if memmap else None
+            if dat is None:
+                dat = f[key][()]
+            run_[key] = dat.transpose(1, 0, 2)
+    return run_
+
+
+def convert_pickles(in_path, out_path=None, remove=False):
+    """
+    convert all pickled runs (.p) of a folder into feature store files
+
+    Args:
+        in_path (string): folder with pickled runs
+        out_path (string, optional): output folder, defaults to in_path
+        remove (bool): delete the pickle after conversion
+    """
+    if out_path is None:
+        out_path = in_path
+    for file in sorted(os.listdir(in_path)):
+        if not (file.startswith('sub_') and file.endswith('.p')):
+            continue
+        file_path = os.path.join(in_path, file)
+        write_run(os.path.join(out_path, file[:-2] + FILE_ENDING), read_run(file_path))
+        if remove:
+            os.remove(file_path)
+
+
+class FeatureStore:
+    """
+    Index of all feature store runs in a folder
+
+    The feature arrays are memory-mapped on first access; slices are read only views, so reading
+    one grid point (or channel) of all runs reads only that grid point from disk. At most max_open
+    runs are mapped at the same time, the least recently used are closed.
+
+    With cache_bytes > 0 grid points are additionally copied into memory and kept in a least recently
+    used cache of at most cache_bytes, which avoids rereading the same grid point from (network) disks
+    for every test subject of a cross validation. Cached arrays are read only, so workers forked
+    after preload share them without copy-on-write.
+
+    Args:
+        path (string): folder with run files
+        cache_bytes (int): memory budget in bytes of the grid point cache, 0 disables the cache
+        max_open (int): maximum number of memory-mapped feature arrays
+    """
+
+    def __init__(self, path, cache_bytes=0, max_open=128):
+        self.path = path
+        self.runs = sorted([file[:-len(FILE_ENDING)] for file in os.listdir(path)
+                            if file.startswith('sub_') and file.endswith(FILE_ENDING)])
+        self.cache_bytes = cache_bytes
+        self.max_open = max_open
+        self._info = {}
+        self._maps = OrderedDict()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    def get_file(self, run):
+        return os.path.join(self.path, run + FILE_ENDING)
+
+    def get_info(self, run):
+        """
+        Returns:
+            dict: all fields of a run apart from the feature arrays
+        """
+        if run not in self._info:
+            with h5py.File(self.get_file(run), 'r') as f:
+                info = {key: value.item() if isinstance(value, np.generic) else value
+                        for key, value in f.attrs.items()}
+                for key in ["arr_act_grid_points", "label_baseline_corrected", "label_con_true"]:
+                    info[key] = f[key][()] if key in f else None
+                info["used_channels"] = {ch_type: f["used_channels"][ch_type][()]
+                                         if ch_type in f["used_channels"] else None
+                                         for ch_type in ["cortex", "subcortex", "labels"]}
+            self._info[run] = info
+        return self._info[run]
+
+    def get_feature_array(self, run, field="pf_data_median"):
+        """
+        Returns:
+            np array: read only memmap in shape(num_grid_points/num_channels, time, num_f_bands)
+        """
+        if (run, field) in self._maps:
+            self._maps.move_to_end((run, field))
+            return self._maps[(run, field)]
+        with h5py.File(self.get_file(run), 'r') as f:
+            dat = _memmap_dataset(self.get_file(run), f[field])
+            if dat is None:
+                dat = f[field][()]
+                dat.flags.writeable = False
+        self._maps[(run, field)] = dat
+        while len(self._maps) > self.max_open:
+            self._maps.popitem(last=False)  # the file is unmapped once no view references it
+        return dat
+
+    def _get_cached(self, run, field, idx):
+        """
+        return the array of one grid point / channel from the cache, read it if it is not cached
+        """
+        key = (run, field, idx)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        dat = np.array(self.get_feature_array(run, field)[idx])
+        dat.flags.writeable = False
+        if dat.nbytes <= self.cache_bytes:
+            self._cache[key] = dat
+            self._cached_bytes += dat.nbytes
+            while self._cached_bytes > self.cache_bytes:
+                self._cached_bytes -= self._cache.popitem(last=False)[1].nbytes
+        return dat
+
+    def preload(self, grid_points, runs=None):
+        """
+        read grid points of all (or the given) runs into the cache, e.g. before starting a multiprocessing.Pool
+
+        Args:
+            grid_points (list)
+            runs (list, optional)
+        """
+        for run in self.runs if runs is None else runs:
+            act_ = self.get_info(run)["arr_act_grid_points"]
+            for grid_point in grid_points:
+                if act_[grid_point] != 0:
+                    self._get_cached(run, "pf_data_median", grid_point)
+
+    def get_cache_size(self):
+        """
+        Returns:
+            int: bytes of all cached grid points
+        """
+        return self._cached_bytes
+
+    def get_runs(self, subject=None, sess=None, grid_point=None):
+        """
+        Args:
+            subject (string, optional): in shape '000'
+            sess (string, optional): 'right' or 'left'
+            grid_point (int, optional): only runs where the grid point is active
+
+        Returns:
+            list: run names
+        """
+        runs = self.runs
+        if subject is not None:
+            runs = [run for run in runs if run.startswith('sub_' + subject + '_')]
+        if sess is not None:
+            runs = [run for run in runs if '_sess_' + sess + '_' in run]
+        if grid_point is not None:
+            runs = [run for run in runs if self.get_info(run)["arr_act_grid_points"][grid_point] != 0]
+        return runs
+
+    def get_grid_point(self, run, grid_point, f_bands=None, start=None, stop=None):
+        """
+        Returns:
+            np array: projected features of one grid point in shape(time, num_f_bands)
+        """
+        if self.cache_bytes > 0:
+            dat = self._get_cached(run, "pf_data_median", grid_point)[start:stop]
+        else:
+            dat = self.get_feature_array(run, "pf_data_median")[grid_point, start:stop]
+        if f_bands is not None:
+            dat = dat[:, f_bands]
+        return dat
+
+    def get_channels(self, run, channels, f_bands=None, start=None, stop=None):
+        """
+        Args:
+            channels (int or array): channel indices of rf_data_median
+
+        Returns:
+            np array: features in shape(time, num_f_bands) for one channel, shape(time, num_channels, num_f_bands) else
+        """
+        dat = self.get_feature_array(run, "rf_data_median")[channels, start:stop]
+        if dat.ndim == 3:
+            dat = dat.transpose(1, 0, 2)
+        if f_bands is not None:
+            dat = dat[..., f_bands]
+        return dat
+
+    def get_label(self, run, contralateral=True):
+        """
+        Returns:
+            np array: baseline corrected contra- or ipsilateral movement label in shape(time)
+        """
+        info = self.get_info(run)
+        return np.squeeze(info["label_baseline_corrected"][info["label_con_true"] == contralateral])
+
+
+def get_source_fingerprint(store, runs, contralateral, clip):
+    """
+    hash of the run names, their file modification times and sizes and the dataset parameters,
+    which identifies the content of a grid point dataset
+
+    Returns:
+        string
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for run in runs:
+        stat = os.stat(store.get_file(run))
+        h.update(repr((run, stat.st_mtime_ns, stat.st_size)).encode())
+    h.update(repr((np.asarray(contralateral, dtype=bool).tolist(), clip)).encode())
+    return h.hexdigest()
+
+
+def is_current_grid_point_dataset(file_path, store, contralateral, clip=2, runs=None):
+    """
+    check if a grid point dataset exists and was written from the current runs of store with
+    the same parameters, see write_grid_point_dataset
+
+    Returns:
+        bool: False if the dataset has to be (re)written
+    """
+    if not os.path.exists(file_path):
+        return False
+    if runs is None:
+        runs = store.runs
+    with h5py.File(file_path, 'r') as f:
+        fingerprint = f.attrs.get("source_fingerprint")
+    return fingerprint == get_source_fingerprint(store, runs, contralateral, clip)
+
+
+def write_grid_point_dataset(store, out_path, contralateral, clip=2, runs=None):
+    """
+    write the projected features of all runs of a FeatureStore in grid point major order
+
+    For every grid point, the features and labels of all runs where the grid point is active are
+    stored contiguous and sorted by subject, such that the data of one subject is one contiguous
+    block. The index dataset lists for every block the grid point, subject, run and its rows.
+    The fingerprint of the source runs is stored as attribute, see is_current_grid_point_dataset.
+
+    Args:
+        store (FeatureStore)
+        out_path (string): HDF5 file
+        contralateral (np array): bool in shape(num_grid_points), True if the contralateral label
+            is used for a grid point, else the ipsilateral label
+        clip (float, optional): features are clipped to [-clip, clip], None for no clipping
+        runs (list, optional): runs of the store which are used, defaults to all
+    """
+    if runs is None:
+        runs = store.runs
+    index = []
+    num_rows = 0
+    for grid_point in range(len(contralateral)):
+        for run_idx, run in enumerate(runs):
+            if store.get_info(run)["arr_act_grid_points"][grid_point] == 0:
+                continue
+            num_samples = store.get_feature_array(run)[grid_point].shape[0]
+            index.append((grid_point, int(run[4:7]), run_idx, num_rows, num_rows + num_samples))
+            num_rows += num_samples
+    index = np.array(index, dtype=np.int64).reshape(-1, 5)
+    num_f_bands = store.get_feature_array(runs[0]).shape[2]
+
+    tmp_path = out_path + '.tmp'
+    with h5py.File(tmp_path, 'w') as f:
+        dat = f.create_dataset("dat", shape=(num_rows, num_f_bands), dtype=np.float64)
+        label = f.create_dataset("label", shape=(num_rows,), dtype=np.float64)
+        f.create_dataset("index", data=index)
+        f.create_dataset("runs", data=np.array(runs, dtype=h5py.string_dtype()))
+        f.attrs["clip"] = np.nan if clip is None else clip
+        f.attrs["num_grid_points"] = len(contralateral)
+        f.attrs["source_fingerprint"] = get_source_fingerprint(store, runs, contralateral, clip)
+        for grid_point, _, run_idx, start, stop in index:
+            run = runs[run_idx]
+            dat_ = store.get_grid_point(run, grid_point)
+            dat[start:stop] = dat_ if clip is None else np.clip(dat_, -clip, clip)
+            label[start:stop] = store.get_label(run, bool(contralateral[grid_point]))
+    os.replace(tmp_path, out_path)
+
+
+class GridPointDataset:
+    """
+    Memory-mapped grid point major dataset, see write_grid_point_dataset
+
+    All returned arrays are read only views into the file.
+
+    Args:
+        file_path (string)
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with h5py.File(file_path, 'r') as f:
+            self.index = f["index"][()]
+            self.runs = [run.decode() if isinstance(run, bytes) else run for run in f["runs"][()]]
+            self.clip = f.attrs["clip"]
+            self.num_grid_points = int(f.attrs.get("num_grid_points", self.index[:, 0].max() + 1))
+            self.dat = _memmap_dataset(file_path, f["dat"])
+            self.label = _memmap_dataset(file_path, f["label"])
+
+    def get_grid_points(self):
+        return np.unique(self.index[:, 0])
+
+    def get_subjects(self, grid_point):
+        """
+        Returns:
+            np array: subjects (int) with data for the grid point
+        """
+        return np.unique(self.index[self.index[:, 0] == grid_point, 1])
+
+    def get_rows(self, grid_point, subject=None):
+        """
+        Returns:
+            start, stop (int): rows of the grid point, or of one subject of the grid point;
+                (0, 0) if there is no data
+        """
+        blocks = self.index[self.index[:, 0] == grid_point]
+        if subject is not None:
+            blocks = blocks[blocks[:, 1] == subject]
+        if blocks.shape[0] == 0:
+            return 0, 0
+        return blocks[0, 3], blocks[-1, 4]
+
+    def get_blocks(self, grid_point):
+        """
+        Returns:
+            list of (subject, start, stop): rows of every subject of the grid point
+        """
+        blocks = self.index[self.index[:, 0] == grid_point]
+        return [(int(subject), int(blocks[blocks[:, 1] == subject, 3][0]), int(blocks[blocks[:, 1] == subject, 4][-1]))
+                for subject in np.unique(blocks[:, 1])]
+
+    def get_data(self, grid_point, subject=None):
+        """
+        Returns:
+            dat (np array): shape(time, num_f_bands) of all runs of the grid point (of one subject)
+            label (np array): shape(time)
+        """
+        start, stop = self.get_rows(grid_point, subject)
+        return self.dat[start:stop], self.label[start:stop]
+
+    def get_split(self, grid_point, subject_test):
+        """
+        leave one subject out split
+
+        Returns:
+            dat_test, label_test: views of the test subject
+            train: list of (dat, label) views, the rows before and after the test subject
+        """
+        start, stop = self.get_rows(grid_point)
+        start_test, stop_test = self.get_rows(grid_point, subject_test)
+        if start_test == stop_test:
+            return self.dat[0:0], self.label[0:0], [(self.dat[start:stop], self.label[start:stop])]
+        train = [(self.dat[start:start_test], self.label[start:start_test]),
+                 (self.dat[stop_test:stop], self.label[stop_test:stop])]
+        return self.dat[start_test:stop_test], self.label[start_test:stop_test], \
+            [(dat_, label_) for dat_, label_ in train if dat_.shape[0] > 0]
@@ -0,0 +1,136 @@
+"""
+Memoized band filtering of epoched data for the SSD classes.
+
+SSD.fit filters the same epochs for the signal band, the noise band-pass and the noise band-stop
+on every fit, which during band and hyperparameter sweeps (e.g. Eval_ssd_spoc_ECOG_STN*) repeats
+the identical mne.filter.filter_data calls many times. filter_data here is a drop-in replacement,
+which stores the filtered arrays under (data fingerprint, sampling frequency, filter parameters)
+in an LRU cache with a memory limit. A chain of filters (band-pass followed by band-stop) is keyed
+by the fingerprint of the input and all parameters of the chain, such that the intermediate
+results are never hashed.
+
+All SSD classes share the module cache CACHE, its memory limit can be changed or set to 0 to
+disable the caching:
+    filter_cache.CACHE.max_bytes = 4*1024**3
+"""
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import mne
+
+
+def get_fingerprint(arr):
+    """
+    hash of the shape, dtype and content of an array
+    """
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((arr.shape, arr.dtype.str)).encode())
+    h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+
+def get_params_key(sfreq, filter_params):
+    """
+    string of the sampling frequency and the filter_data keyword arguments
+    """
+    return repr((float(sfreq), sorted((name, repr(value)) for name, value in filter_params.items())))
+
+
+class FilterCache:
+    """
+    LRU cache of filtered arrays with a memory limit
+
+    Args:
+        max_bytes (int): memory limit, least recently used arrays are dropped when it is exceeded
+    """
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns:
+            np array (read only), None if key is not cached
+        """
+        if key in self._mem:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return self._mem[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, arr):
+        if arr.nbytes > self.max_bytes:
+            return
+        arr.setflags(write=False)
+        if key in self._mem:
+            self._mem_bytes -= self._mem.pop(key).nbytes
+        self._mem[key] = arr
+        self._mem_bytes += arr.nbytes
+        while self._mem_bytes > self.max_bytes:
+            _, arr_ = self._mem.popitem(last=False)
+            self._mem_bytes -= arr_.nbytes
+
+    def get_size(self):
+        """
+        Returns:
+            int: number of bytes held in memory
+        """
+        return self._mem_bytes
+
+    def clear(self):
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+
+
+CACHE = FilterCache()
+
+
+def filter_chain(data, sfreq, params_list, fingerprint=None, cache=None, copy=True):
+    """
+    apply mne.filter.filter_data with every parameter dict of params_list in sequence, memoized
+
+    Args:
+        data (np array): shape(..., n_times)
+        sfreq (float): sampling frequency
+        params_list (list of dict): filter_data keyword arguments, e.g. l_freq, h_freq, method
+        fingerprint (string, optional): get_fingerprint(data), if already known
+        cache (FilterCache, optional): default CACHE
+        copy (bool): if False the cached array is returned, which is read only
+
+    Returns:
+        np array: filtered data, shape of data
+    """
+    cache = CACHE if cache is None else cache
+    if cache.max_bytes <= 0:  # caching disabled
+        for params in params_list:
+            data = mne.filter.filter_data(data, sfreq, **params)
+        return data
+    key = get_fingerprint(data) if fingerprint is None else fingerprint
+    out, start = data, 0
+    keys = []
+    for params in params_list:
+        key = key + '|' + get_params_key(sfreq, params)
+        keys.append(key)
+    # the longest cached prefix of the chain
+    for idx in range(len(keys)-1, -1, -1):
+        cached = cache.get(keys[idx])
+        if cached is not None:
+            out, start = cached, idx + 1
+            break
+    for idx in range(start, len(params_list)):
+        out = mne.filter.filter_data(out, sfreq, **params_list[idx])
+        cache.put(keys[idx], out)
+    return out.copy() if copy and not out.flags.writeable else out
+
+
+def filter_data(data, sfreq, fingerprint=None, cache=None, copy=True, **filter_params):
+    """
+    memoized mne.filter.filter_data(data, sfreq, **filter_params), see filter_chain
+    """
+    return filter_chain(data, sfreq, [filter_params], fingerprint=fingerprint, cache=cache, copy=copy)
@@ -0,0 +1,240 @@
+"""
+In-memory early stopping and batched training of the small Keras decoders of the best channel scripts.
+
+fit_best_weights replaces the EarlyStopping + ModelCheckpoint('best_model.h5') + load_model pattern:
+the weights of the best validation epoch are kept in memory and restored at the end of training, so
+there are no disk round trips and no file name collisions between concurrent workers.
+
+For the per channel / per laterality decoders, which are all tiny networks with the same input
+size, create_grouped_model builds num_groups independent copies of the create_model_NN architecture
+as one Keras model. Every layer keeps separate weights per group (GroupedDense, and BatchNormalization
+on the group-major flattened units), and the loss is the sum of the per group mse, so the gradient of
+every group equals the gradient of its own model. fit_grouped stops and restores every group at its
+own best validation epoch. Thousands of tiny models thereby pay the TensorFlow graph construction
+and per batch overhead once.
+
+    X in shape(n_samples, num_groups, num_features), y in shape(n_samples, num_groups)
+"""
+import numpy as np
+import tensorflow as tf
+from sklearn import metrics
+from sklearn.model_selection import KFold, train_test_split
+from skopt.space import Space
+
+
+class BestWeights(tf.keras.callbacks.Callback):
+    """
+    early stopping which restores the weights of the best epoch from memory
+
+    Args:
+        monitor (string): e.g. 'val_mse'
+        patience (int): number of epochs without improvement after which training is stopped
+        mode (string): 'min' or 'max'
+    """
+
+    def __init__(self, monitor='val_mse', patience=10, mode='min'):
+        super().__init__()
+        self.monitor = monitor
+        self.patience = patience
+        self.sign = 1 if mode == 'min' else -1
+
+    def on_train_begin(self, logs=None):
+        self.best = np.inf
+        self.best_epoch = 0
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is None:
+            return
+        if self.sign*current < self.best:
+            self.best = self.sign*current
+            self.best_epoch = epoch
+            self.best_weights = self.model.get_weights()
+        elif epoch - self.best_epoch >= self.patience:
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+
+def fit_best_weights(model, X_train, y_train, X_val, y_val, monitor='val_mse', patience=10, epochs=1000,
+                     batch_size=100, verbose=0):
+    """
+    fit a compiled model with early stopping on the validation data and restore its best epoch
+
+    Returns:
+        model: the fitted model with the weights of the best epoch
+    """
+    model.fit(X_train, y_train, validation_data=(X_val, y_val), epochs=epochs, batch_size=batch_size,
+              verbose=verbose, callbacks=[BestWeights(monitor, patience)])
+    return model
+
+
+class GroupedDense(tf.keras.layers.Layer):
+    """
+    num_groups independent Dense layers, on input and output flattened group-major,
+    shape(batch, num_groups*input_units) -> shape(batch, num_groups*units)
+    """
+
+    def __init__(self, num_groups, units, activation=None, **kwargs):
+        super().__init__(**kwargs)
+        self.num_groups = num_groups
+        self.units = units
+        self.activation = tf.keras.activations.get(activation)
+
+    def build(self, input_shape):
+        self.input_units = int(input_shape[-1]) // self.num_groups
+        self.kernel = self.add_weight(name='kernel', shape=(self.num_groups, self.input_units, self.units),
+                                      initializer='glorot_uniform')
+        self.bias = self.add_weight(name='bias', shape=(self.num_groups, self.units), initializer='zeros')
+
+    def call(self, inputs):
+        x = tf.reshape(inputs, (-1, self.num_groups, self.input_units))
+        out = tf.einsum('bgi,giu->bgu', x, self.kernel) + self.bias
+        return self.activation(tf.reshape(out, (-1, self.num_groups*self.units)))
+
+
+def grouped_mse(y_true, y_pred):
+    """
+    sum over groups of the mean squared error of every group
+    """
+    return tf.reduce_sum(tf.square(y_pred - y_true), axis=-1)
+
+
+def create_grouped_model(num_groups, num_features, learning_rate, num_dense_layers, num_input_nodes,
+                         num_dense_nodes, activation):
+    """
+    num_groups copies of create_model_NN of the best_electrode_classification scripts as one model
+    """
+    inputs = tf.keras.Input(shape=(num_groups*num_features,))
+    x = GroupedDense(num_groups, num_input_nodes, activation=activation)(inputs)
+    for i in range(num_dense_layers):
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.Dropout(0.2)(x)
+        x = GroupedDense(num_groups, num_dense_nodes, activation=activation, name='layer_dense_{0}'.format(i+1))(x)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    outputs = GroupedDense(num_groups, 1, activation='linear')(x)
+    model = tf.keras.Model(inputs, outputs)
+    model.num_groups = num_groups
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss=grouped_mse)
+    return model
+
+
+def _flatten(X):
+    return np.ascontiguousarray(X, dtype=np.float32).reshape(X.shape[0], -1)
+
+
+def predict_grouped(model, X, batch_size=10000):
+    """
+    Returns:
+        np array: shape(n_samples, num_groups)
+    """
+    return model.predict(_flatten(X), batch_size=batch_size, verbose=0)
+
+
+class GroupBestWeights(tf.keras.callbacks.Callback):
+    """
+    per group early stopping on the validation mse, the weights of every group are restored
+    from its own best epoch; training stops when all groups stopped
+    """
+
+    def __init__(self, X_val, y_val, patience=10):
+        super().__init__()
+        self.X_val = X_val
+        self.y_val = y_val
+        self.patience = patience
+
+    def _get_group_weights(self):
+        return [w.reshape(self.model.num_groups, -1) for w in self.model.get_weights()]
+
+    def on_train_begin(self, logs=None):
+        num_groups = self.model.num_groups
+        self.best = np.full(num_groups, np.inf)
+        self.best_epoch = np.zeros(num_groups, dtype=int)
+        self.stopped = np.zeros(num_groups, dtype=bool)
+        self.best_weights = [w.copy() for w in self._get_group_weights()]
+
+    def on_epoch_end(self, epoch, logs=None):
+        y_pred = self.model(self.X_val, training=False).numpy()
+        mse = np.mean((y_pred - self.y_val)**2, axis=0)
+        improved = (mse < self.best) & ~self.stopped
+        if np.any(improved):
+            for best_w, w in zip(self.best_weights, self._get_group_weights()):
+                best_w[improved] = w[improved]
+            self.best[improved] = mse[improved]
+            self.best_epoch[improved] = epoch
+        self.stopped |= epoch - self.best_epoch >= self.patience
+        if np.all(self.stopped):
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        self.model.set_weights([best_w.reshape(w.shape) for best_w, w in zip(self.best_weights,
+                                                                                self.model.get_weights())])
+
+
+def fit_grouped(model, X_train, y_train, X_val, y_val, patience=10, epochs=1000, batch_size=100, verbose=0):
+    """
+    fit a create_grouped_model model with per group early stopping
+
+    Args:
+        X_train, X_val (np array): shape(n_samples, num_groups, num_features)
+        y_train, y_val (np array): shape(n_samples, num_groups)
+
+    Returns:
+        np array: best validation mse of every group
+    """
+    X_val = _flatten(X_val)
+    y_val = np.asarray(y_val, dtype=np.float32)
+    best_weights = GroupBestWeights(X_val, y_val, patience)
+    model.fit(_flatten(X_train), np.asarray(y_train, dtype=np.float32), epochs=epochs, batch_size=batch_size,
+              verbose=verbose, callbacks=[best_weights])
+    return best_weights.best
+
+
+def get_configs(space, n_configs=10, random_state=0):
+    """
+    sample configurations from a list of skopt dimensions, e.g. space_NN
+
+    Returns:
+        list of lists: values in the order of space
+    """
+    return [[value.item() if isinstance(value, np.generic) else value for value in config]
+            for config in Space(space).rvs(n_configs, random_state=random_state)]
+
+
+def search_grouped(X, y, space, n_configs=10, n_splits=3, random_state=0, batch_size=100, verbose=0):
+    """
+    score the same sampled configurations for all groups, every configuration trained once per fold
+    for all groups together; the objective equals optimize_nn: KFold cross validation with an
+    inner 80/20 train/validation split and r2 of every fold clipped at 0
+
+    Args:
+        X (np array): shape(n_samples, num_groups, num_features)
+        y (np array): shape(n_samples, num_groups)
+        space (list): skopt dimensions named learning_rate, num_dense_layers, num_input_nodes,
+            num_dense_nodes, activation
+
+    Returns:
+        configs (list): sampled configurations
+        scores (np array): shape(n_configs, num_groups), mean r2 over folds
+    """
+    names = [dim.name for dim in space]
+    configs = get_configs(space, n_configs, random_state)
+    num_groups = X.shape[1]
+    scores = np.zeros((n_configs, num_groups))
+    cv = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for config_idx, config in enumerate(configs):
+        params = dict(zip(names, config))
+        for train_index, test_index in cv.split(X):
+            X_train, X_val, y_train, y_val = train_test_split(X[train_index], y[train_index], train_size=0.8,
+                                                              shuffle=False)
+            model = create_grouped_model(num_groups, X.shape[2], **params)
+            fit_grouped(model, X_train, y_train, X_val, y_val, batch_size=batch_size, verbose=verbose)
+            y_pred = predict_grouped(model, X[test_index])
+            for group in range(num_groups):
+                scores[config_idx, group] += max(metrics.r2_score(y_pred[:, group], y[test_index, group]), 0)
+        tf.keras.backend.clear_session()
+    return configs, scores / n_splits
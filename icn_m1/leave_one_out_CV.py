@@ -1,8 +1,12 @@
 import os
 import numpy as np
 import settings
-import pickle
 import IO
+import feature_store
+import time_dim
+import loso_linear
+import cv_scheduler
+import functools
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import train_test_split
@@ -15,6 +19,7 @@ import settings
 
 
 VICTORIA = True
+LOSO_LINEAR = False # fit the linear models of all patients at once in closed form, see run_CV_linear
 
 
 settings = {}
@@ -37,20 +42,20 @@ else:
 settings['BIDS_path']=settings['BIDS_path'].replace("\\", "/")
 settings['Preprocess_path']=settings['Preprocess_path'].replace("\\", "/")
 
+store = feature_store.FeatureStore(settings['Preprocess_path'])
+
 
 def get_int_runs(patient_idx):
     """
 
     :param patient_idx:
-    :return: list with all run files for the given patient
+    :return: list with all runs of the feature store for the given patient
     """
-    os.listdir(settings['Preprocess_path'])
     if patient_idx < 10:
         subject_id = str('00') + str(patient_idx)
     else:
         subject_id = str('0') + str(patient_idx)
-    list_subject = [i for i in os.listdir(settings['Preprocess_path']) if i.startswith('sub_'+subject_id) and i.endswith('.p')]
-    return list_subject
+    return store.get_runs(subject=subject_id)
 
 
 def get_act_int_list(patient_idx):
@@ -63,10 +68,7 @@ def get_act_int_list(patient_idx):
     runs_ = get_int_runs(patient_idx)
     act_ = np.zeros([len(runs_), num_grid_points])
     for idx in range(len(runs_)):
-        file = open(os.path.join(settings['Preprocess_path'], runs_[idx]), 'rb')
-        out = pickle.load(file)
-
-        act_[idx, :] = out['arr_act_grid_points']
+        act_[idx, :] = store.get_info(runs_[idx])['arr_act_grid_points']
 
     return act_
 
@@ -98,88 +100,43 @@ def check_leave_out_grid_points(act_, load=True):
     np.save('grid_points_none.npy', grid_points_none)
     return grid_points_none
 
-def append_time_dim(arr, y_, time_stamps):
-    """
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
-    """
-    time_arr = np.zeros([arr.shape[0]-time_stamps, int(time_stamps*arr.shape[1])])
-    for time_idx, time_ in enumerate(np.arange(time_stamps, arr.shape[0])):
-        for time_point in range(time_stamps):
-            time_arr[time_idx, time_point*arr.shape[1]:(time_point+1)*arr.shape[1]] = arr[time_-time_point,:]
-    return time_arr, y_[time_stamps:]
-
-def get_train_test_dat(patient_test, grid_point, act_, Train=True, Clip=True):
+def get_train_test_dat(patient_test, grid_point, Train=True):
     """
     For a given grid_point, and a given provided test patient, acquire all combined dat and label information
+    from the grid point major dataset
     
     Parameters
     ----------
-    patient_test : TYPE
-        DESCRIPTION.
-    grid_point : TYPE
-        DESCRIPTION.
-    act_ : TYPE
-        DESCRIPTION.
-    Train : TYPE, optional
-        etermine if data is returned only from patient_test, or from all other. The default is True.
+    patient_test : int
+        test patient
+    grid_point : int
+    Train : bool, optional
+        determine if data is returned only from patient_test, or from all other. The default is True.
 
     Returns
     -------
     dat : array shape(n_data points,n_frequency bands)
-        DESCRIPTION.
-    label : TYPE
-        DESCRIPTION.
+        clipped features; a read only view of the dataset for the test patient
+    label : array shape(n_data points)
+        contralateral or ipsilateral baseline corrected label, depending on the grid point
 
     """
-    start = 0
-    for patient_idx in range(NUM_PATIENTS):
-        if Train is True and patient_idx == patient_test:
-            continue
-        if Train is False and patient_idx != patient_test:
-            continue
-        # now load from every patient that has data for that grid point
-        if grid_point in np.nonzero(np.sum(act_[patient_idx], axis=0))[0]:
-            runs = get_int_runs(patient_idx)
-            for run_idx, run in enumerate(runs):
-                # does this run has the grid point?
-                if act_[patient_idx][run_idx, grid_point] != 0:
-                    # load file
-                    file = open(os.path.join(settings['Preprocess_path'], run), 'rb')
-                    out = pickle.load(file)
-
-                    # fill dat
-                    if start == 0:
-                        dat = out['pf_data_median'][:,grid_point,:]
-                        if Clip:
-                            dat=np.clip(dat, -2,2)
-                        if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                            label = np.squeeze(out['label_baseline_corrected'][out['label_con_true']==True])
-                        else:
-                            label = np.squeeze(out['label_baseline_corrected'][out['label_con_true']==False])
-                        start = 1
-                    else:
-                        dat_new=out['pf_data_median'][:,grid_point,:]
-                        if Clip:
-                            dat_new=np.clip(dat_new, -2,2)
-                        dat = np.concatenate((dat, dat_new), axis=0)
-
-                        if grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT):  # contralateral
-                            label_new=np.squeeze(out['label_baseline_corrected'][out['label_con_true']==True])
-                            label = np.concatenate((label, label_new), axis=0)
-                        else:
-                            label_new=np.squeeze(out['label_baseline_corrected'][out['label_con_true']==False])
-                            label = np.concatenate((label, label_new), axis=0)
-    return dat, label
-
-
-def train_grid_point(time_stamps, act_, patient_test, grid_point, model, Verbose=False):
+    dat_test, label_test, train = dataset.get_split(grid_point, patient_test)
+    if Train is False:
+        return dat_test, label_test
+    if len(train) == 1:
+        return train[0]
+    return np.concatenate([dat_ for dat_, _ in train], axis=0), np.concatenate([label_ for _, label_ in train], axis=0)
+
+
+def train_grid_point(time_stamps, patient_test, grid_point, model, Verbose=False):
     if Verbose:
         print(grid_point)
-    dat, label = get_train_test_dat(patient_test, grid_point, act_, Train=True)
-    dat,label = append_time_dim(dat, label,time_stamps)
+    dat, label = get_train_test_dat(patient_test, grid_point, Train=True)
+    dat,label = time_dim.append_time_dim(dat, label,time_stamps, materialize=True)
 
-    dat_test, label_test = get_train_test_dat(patient_test, grid_point, act_, Train=False)
-    dat_test,label_test = append_time_dim(dat_test, label_test, time_stamps)
+    dat_test, label_test = get_train_test_dat(patient_test, grid_point, Train=False)
+    dat_test,label_test = time_dim.append_time_dim(dat_test, label_test, time_stamps, materialize=True)
 
     model.fit(dat, label)
 
@@ -216,7 +173,7 @@ def run_CV(patient_test, model=LinearRegression(), time_stamps=5):
     for grid_point in np.nonzero(arr_active_grid_points)[0]:
         if grid_point in grid_points_none:
             continue
-        patient_CV_out[grid_point] = train_grid_point(time_stamps, act_, patient_test, grid_point, model)
+        patient_CV_out[grid_point] = train_grid_point(time_stamps, patient_test, grid_point, model)
         
     if patient_test < 10:
         subject_id = '00' + str(patient_test)
@@ -225,6 +182,80 @@ def run_CV(patient_test, model=LinearRegression(), time_stamps=5):
 
     out_path_file = os.path.join(settings['write_path'], subject_id+'prediction.npy')
     np.save(out_path_file, patient_CV_out)
+
+def run_CV_parallel(model=LinearRegression(), time_stamps=5, n_jobs=None):
+    """
+    run_CV for all patients, with one (patient, grid point) task per process, see cv_scheduler
+    :param model: sklearn estimator, cloned for every task
+    :param time_stamps: time concatenation parameter
+    :param n_jobs: number of processes, defaults to the number of CPUs
+    :return:
+    """
+    cv_scheduler.run_CV(dataset_file, {"model": functools.partial(cv_scheduler.fit_predict_estimator, model)},
+                        np.arange(NUM_PATIENTS), settings['write_path'], grid_points_none, time_stamps, n_jobs)
+
+def run_CV_linear(alpha=0, time_stamps=5):
+    """
+    closed form leave one patient out CV of linear (alpha=0) or ridge regression for all patients, see loso_linear
+    every grid point is read once and the models of all test patients are obtained from per patient statistics;
+    the time dimension is appended per patient, s.t. no sample combines features of two patients
+    saves the same prediction files as run_CV
+    :param alpha: ridge penalty
+    :param time_stamps: time concatenation parameter
+    :return:
+    """
+    patient_CV_out = np.empty([NUM_PATIENTS, num_grid_points], dtype=object)
+
+    for grid_point in dataset.get_grid_points():
+        if grid_point in grid_points_none:
+            continue
+        blocks = {}
+        for patient_idx, start, stop in dataset.get_blocks(grid_point):
+            if stop - start > time_stamps:
+                blocks[patient_idx] = time_dim.append_time_dim(dataset.dat[start:stop], dataset.label[start:stop], time_stamps, materialize=True)
+        stats = loso_linear.LOSOStats(blocks)
+
+        for patient_test in blocks:
+            coef, intercept = stats.fit(patient_test, alpha)
+            dat_test, label_test = blocks[patient_test]
+            label = np.concatenate([blocks[patient_idx][1] for patient_idx in blocks if patient_idx != patient_test])
+            y_test_pred = dat_test @ coef + intercept
+            y_train_pred = np.concatenate([blocks[patient_idx][0] @ coef for patient_idx in blocks
+                                           if patient_idx != patient_test]) + intercept
+            patient_CV_out[patient_test, grid_point] = {
+                "y_pred_test": y_test_pred,
+                "y_test": label_test,
+                "y_pred_train": y_train_pred,
+                "y_train": label,
+                "r2_test": r2_score(label_test, y_test_pred),
+                "r2_train": r2_score(label, y_train_pred)
+            }
+
+    for patient_test in range(NUM_PATIENTS):
+        if patient_test < 10:
+            subject_id = '00' + str(patient_test)
+        else:
+            subject_id = '0' + str(patient_test)
+        out_path_file = os.path.join(settings['write_path'], subject_id+'prediction.npy')
+        np.save(out_path_file, patient_CV_out[patient_test])
+
+def get_ridge_path_r2(grid_point, alphas, time_stamps=5):
+    """
+    leave one patient out test r2 of a ridge path for a given grid point
+    :return: patients (list), r2 array in shape (num_patients, num_alphas)
+    """
+    blocks = {}
+    for patient_idx, start, stop in dataset.get_blocks(grid_point):
+        if stop - start > time_stamps:
+            blocks[patient_idx] = time_dim.append_time_dim(dataset.dat[start:stop], dataset.label[start:stop], time_stamps, materialize=True)
+    stats = loso_linear.LOSOStats(blocks)
+    r2 = np.zeros([len(blocks), len(alphas)])
+    for idx, patient_test in enumerate(blocks):
+        coefs, intercepts = stats.fit_path(patient_test, alphas)
+        dat_test, label_test = blocks[patient_test]
+        y_test_pred = dat_test @ coefs.T + intercepts
+        r2[idx] = [r2_score(label_test, y_test_pred[:, alpha_idx]) for alpha_idx in range(len(alphas))]
+    return list(blocks.keys()), r2
 #%%
 cortex_left, cortex_right, subcortex_left, subcortex_right = IO.read_grid()
 grid_ = [cortex_left, subcortex_left, cortex_right, subcortex_right]
@@ -237,6 +268,15 @@ NUM_PATIENTS=16
 act_ = save_all_act_grid_points()  # obtain here the act_.npy array and the grid points none array; needs to be adapted for different proprocessing parameters
 grid_points_none = check_leave_out_grid_points(act_, False)
 
+# grid point major copy of all runs, rewritten when the runs of the Preprocess_path change
+dataset_file = os.path.join(settings['Preprocess_path'], 'grid_point_dataset.hdf5')
+contralateral = np.array([grid_point < NUM_ECOG_LEFT or (grid_point > NUM_ECOG_RIGHT and grid_point < NUM_SUBCORTEX_LEFT)
+                          for grid_point in range(num_grid_points)])
+dataset_runs = [run for run in store.runs if int(run[4:7]) < NUM_PATIENTS]
+if not feature_store.is_current_grid_point_dataset(dataset_file, store, contralateral, clip=2, runs=dataset_runs):
+    feature_store.write_grid_point_dataset(store, dataset_file, contralateral, clip=2, runs=dataset_runs)
+dataset = feature_store.GridPointDataset(dataset_file)
+
 
 if __name__== "__main__":
 
@@ -245,5 +285,12 @@ if __name__== "__main__":
 
     #     run_CV(patient)
 
-    pool = multiprocessing.Pool()
-    pool.map(run_CV, np.arange(NUM_PATIENTS))
\ No newline at end of file
+    if LOSO_LINEAR is True:
+        # linear models are fitted for all patients at once, see run_CV_linear
+        run_CV_linear()
+    else:
+        pool = multiprocessing.Pool()
+        pool.map(run_CV, np.arange(NUM_PATIENTS))
+
+    # other models are fitted per (patient, grid point) task in a process pool
+    # run_CV_parallel(RandomForestRegressor())
\ No newline at end of file
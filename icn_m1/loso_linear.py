@@ -0,0 +1,107 @@
+"""
+Closed form leave one subject out (LOSO) cross validation of linear and ridge regression.
+
+For every subject the sufficient statistics n, sum(X), sum(y), X^T X and X^T y are computed once.
+The statistics of a training set are the totals minus the statistics of the held out subject, and
+the model is obtained by solving a (num_features x num_features) system. A full LOSO of one grid
+point is therefore as expensive as one pass over the data. The intercept is not penalized, which
+equals sklearn.linear_model.Ridge(alpha, fit_intercept=True); alpha=0 equals LinearRegression.
+
+Example:
+    stats = loso_linear.LOSOStats({subject: (X, y) for ...})
+    coef, intercept = stats.fit(subject_test, alpha=1)
+    coefs, intercepts = stats.fit_path(subject_test, np.logspace(-2, 4, 20))
+"""
+import numpy as np
+
+
+def get_stats(X, y):
+    """
+    Args:
+        X (np array): shape(n_samples, n_features)
+        y (np array): shape(n_samples)
+
+    Returns:
+        dict: n, sum_x, sum_y, XtX, Xty
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return {
+        "n": X.shape[0],
+        "sum_x": X.sum(axis=0),
+        "sum_y": y.sum(),
+        "XtX": X.T @ X,
+        "Xty": X.T @ y
+    }
+
+
+class LOSOStats:
+    """
+    Sufficient statistics of every subject and of all subjects
+
+    Args:
+        blocks (dict): subject: (X, y) with X in shape(n_samples, n_features)
+    """
+
+    def __init__(self, blocks):
+        self.subjects = list(blocks.keys())
+        self.stats = {subject: get_stats(X, y) for subject, (X, y) in blocks.items()}
+        self.total = {key: sum(stats_[key] for stats_ in self.stats.values())
+                      for key in ["n", "sum_x", "sum_y", "XtX", "Xty"]}
+
+    def get_train_stats(self, subject_test):
+        """
+        Returns:
+            dict: statistics of all subjects apart from subject_test
+        """
+        if subject_test not in self.stats:
+            return self.total
+        return {key: self.total[key] - self.stats[subject_test][key] for key in self.total}
+
+    def _centered(self, subject_test):
+        stats_ = self.get_train_stats(subject_test)
+        n = stats_["n"]
+        mean_x = stats_["sum_x"] / n
+        mean_y = stats_["sum_y"] / n
+        C = stats_["XtX"] - n*np.outer(mean_x, mean_x)
+        c = stats_["Xty"] - n*mean_x*mean_y
+        return (C + C.T)/2, c, mean_x, mean_y
+
+    def fit(self, subject_test, alpha=0):
+        """
+        fit on all subjects apart from subject_test
+
+        Args:
+            subject_test: held out subject
+            alpha (float): ridge penalty, 0 for ordinary least squares
+
+        Returns:
+            coef (np array): shape(n_features)
+            intercept (float)
+        """
+        C, c, mean_x, mean_y = self._centered(subject_test)
+        if alpha > 0:
+            coef = np.linalg.solve(C + alpha*np.eye(C.shape[0]), c)
+        else:
+            coef = np.linalg.lstsq(C, c, rcond=None)[0]  # minimum norm solution for collinear features
+        return coef, mean_y - mean_x @ coef
+
+    def fit_path(self, subject_test, alphas):
+        """
+        fit a ridge path from one eigendecomposition of the training statistics
+
+        Returns:
+            coefs (np array): shape(n_alphas, n_features)
+            intercepts (np array): shape(n_alphas)
+        """
+        C, c, mean_x, mean_y = self._centered(subject_test)
+        eigvals, eigvecs = np.linalg.eigh(C)
+        eigvals = np.clip(eigvals, 0, None)
+        c_rot = eigvecs.T @ c
+        alphas = np.asarray(alphas, dtype=np.float64)
+        denom = eigvals[None, :] + alphas[:, None]
+        tol = eigvals.max()*C.shape[0]*np.finfo(np.float64).eps
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(denom > tol, 1/denom, 0)  # pseudo inverse for alpha=0
+        coefs = (scale*c_rot[None, :]) @ eigvecs.T
+        return coefs, mean_y - coefs @ mean_x
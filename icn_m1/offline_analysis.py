@@ -94,13 +94,20 @@ def run(fs, fs_new, seglengths, f_ranges, downsample_idx, bv_raw, line_noise, \
         return rf_data_norm
 
 def create_continous_epochs(fs, fs_new, offset_start, f_ranges, downsample_idx, line_noise, \
-                      data_, filter_fun, new_num_data_points, Verbose=False):
-
+                      data_, filter_fun, new_num_data_points, Verbose=False, out=None):
+    """
+    :param out: optional preallocated array in shape(new_num_data_points-offset_start, channels, filter_len, f_bands),
+        e.g. a memory-mapped float32 file of epoch_store.create_epoch_file, into which the epochs are written
+    :return: epochs in shape(new_num_data_points-offset_start, channels, filter_len, f_bands)
+    """
     num_channels = data_.shape[0]
     num_f_bands = len(f_ranges)
     num_samples =  np.shape(filter_fun)[1]
     #
-    rf_data = np.zeros([new_num_data_points-offset_start, num_channels, num_samples, num_f_bands])  # raw frequency array
+    if out is None:
+        rf_data = np.zeros([new_num_data_points-offset_start, num_channels, num_samples, num_f_bands])  # raw frequency array
+    else:
+        rf_data = out
 
     new_idx = 0
 
@@ -1,61 +1,118 @@
 import filter
 import numpy as np 
 import projection
+import stream_source
 import time
+import time_dim
 from matplotlib import pyplot as plt 
 
 def append_time_dim(X, y_=None, time_stamps=5):
     """
-    :param X: in shape(time, grid_points/channels, f_bands)
-    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms / need to check with 1375Hz
+    :param X: in shape(time, grid_points/channels, f_bands) or shape(time, features)
+    apply added time dimension for the data array and label given time_stamps, see time_dim.append_time_dim
     """
-    if len(X.shape) == 3:
-        num_time = X.shape[0]
-        num_channels = X.shape[1]
-        num_f_bands = X.shape[2]
-
-        time_arr = np.zeros([num_time-time_stamps, num_channels, int(time_stamps*num_f_bands)])
-        for ch in range(num_channels):
-            for time_idx, time_ in enumerate(np.arange(time_stamps, num_time)):
-                for time_point in range(time_stamps):
-                    time_arr[time_idx, ch, time_point*num_f_bands:(time_point+1)*num_f_bands] = X[time_-time_point,ch,:]
-
-        if y_ is None:
-            return time_arr
-        return time_arr, y_[time_stamps:]
-    elif len(X.shape) == 2:
-        if time_stamps == X.shape[0]:
-            time_arr = np.zeros([1+X.shape[0]-time_stamps, int(time_stamps*X.shape[1])])
-            #print(time_arr.shape)
-            for time_idx, time_ in enumerate(np.arange(time_stamps-1, X.shape[0])):
-                #print(time_idx)
-                #print('time_:'+str(time_))
-                for time_point in range(time_stamps):
-                    #print('time_point: '+str(time_point))
-                    time_arr[time_idx, time_point*X.shape[1]:(time_point+1)*X.shape[1]] = X[time_-time_point,:]
-        else:
-            time_arr = np.zeros([X.shape[0]-time_stamps, int(time_stamps*X.shape[1])])
-            for time_idx, time_ in enumerate(np.arange(time_stamps, X.shape[0])):
-                for time_point in range(time_stamps):
-                    time_arr[time_idx, time_point*X.shape[1]:(time_point+1)*X.shape[1]] = X[time_-time_point,:]
-        if y_ is None:
-            return time_arr
-        return time_arr, y_[time_stamps:]
-    
+    return time_dim.append_time_dim(X, y_, time_stamps, materialize=True)
 
-def predict(pf_stream, grid_classifiers, arr_act_grid_points):
-    res_predict = np.zeros([num_grid_points])
-    X = np.clip(pf_stream, -2, 2)
-    for grid_point in range(arr_act_grid_points.shape[0]):
-        if arr_act_grid_points[grid_point] == 0:
-            continue
-        
-        X_test = X[:,grid_point,:]
-        X_test_reshaped = np.reshape(X_test, (X_test.shape[0]*X_test.shape[1]))
+
+class FeatureRing:
+    """
+    Fixed size history of feature frames in shape(grid_points/channels, f_bands)
+
+    Every frame is written twice, at pos and pos+size, while the write position moves
+    backwards. Thus the last n frames are always a contiguous slice with the newest frame
+    first, which is the column ordering of append_time_dim. Memory and cost per frame do
+    not depend on the number of streamed frames.
+
+    Args:
+        size (int): maximum number of stored frames
+        num_channels (int): number of grid points/channels
+        num_f_bands (int)
+    """
+
+    def __init__(self, size, num_channels, num_f_bands):
+        self.size = size
+        self.buf = np.zeros([num_channels, 2*size, num_f_bands])
+        self.pos = 0
+        self.count = 0
+
+    def append(self, frame):
+        self.pos = (self.pos - 1) % self.size
+        self.buf[:, self.pos, :] = frame
+        self.buf[:, self.pos+self.size, :] = frame
+        self.count = min(self.count+1, self.size)
+
+    def last(self, n=None):
+        """
+        view of the last n (default all stored) frames in shape(grid_points/channels, n, f_bands), newest first
+        """
+        if n is None or n > self.count:
+            n = self.count
+        return self.buf[:, self.pos:self.pos+n, :]
+
+    def stacked(self, time_stamps):
+        """
+        view of the last time_stamps frames in shape(grid_points/channels, time_stamps*f_bands);
+        every row equals the append_time_dim features of the newest frame
+        """
+        return self.last(time_stamps).reshape(self.buf.shape[0], -1)
+
+def predict(X_stacked, grid_classifiers, arr_act_grid_points):
+    """
+    :param X_stacked: time appended features in shape(grid_points, time_stamps*f_bands), see FeatureRing.stacked
+    :return: array with the prediction of every active grid point
+    """
+    res_predict = np.zeros([arr_act_grid_points.shape[0]])
+    X = np.clip(X_stacked, -2, 2)
+    for grid_point in np.nonzero(arr_act_grid_points)[0]:
         model = grid_classifiers[grid_point]
-        res_predict[grid_point] = model.predict(np.expand_dims(X_test_reshaped, axis=0))
+        res_predict[grid_point] = model.predict(np.expand_dims(X[grid_point,:], axis=0))[0]
     return res_predict
 
+def get_rf_features(dat_buffer, fs, filter_fun, line_noise, seglengths):
+    """
+    Band power of every buffered channel for the current time point
+
+    Parameters
+    ----------
+    dat_buffer : array, shape(n_channels, n_samples)
+        most recent raw data segment of the streamed channels
+    fs : float
+        sampling frequency.
+    filter_fun : array
+        output of filter.calc_band_filters.
+    line_noise : int|float
+        (in Hz) the line noise frequency.
+    seglengths : list
+        number of samples per frequency band which are used for the variance
+
+    Returns
+    -------
+    rf_data_rt : array, shape(n_channels, n_f_bands)
+        band power of the current buffer
+    """
+    rf_data_rt = np.zeros([dat_buffer.shape[0], filter_fun.shape[0]])
+    for ch in range(dat_buffer.shape[0]):  #  think about using multiprocessing pool to do this simulatenously
+        rf_data_rt[ch,:] = filter.apply_filter(dat_buffer[ch,:], sample_rate=fs, filter_fun=filter_fun, line_noise=line_noise, seglengths=seglengths)
+    return rf_data_rt
+
+def median_normalize(stream, dat_):
+    """
+    normalize dat_ acc. to the median of the previous samples in stream
+
+    Parameters
+    ----------
+    stream : array, shape(n_samples, ...)
+        previous normalization samples
+    dat_ : array
+        current sample, same shape as stream[0]
+
+    Returns
+    -------
+    array: (dat_ - median) / median
+    """
+    median_ = np.median(stream, axis=0)
+    return (dat_ - median_) / median_
+
 def simulate_data_stream(bv_raw, ind_DAT, ind_time, fs):
     #time.sleep(1/fs)
     return bv_raw[ind_DAT, ind_time]
@@ -63,7 +120,16 @@ def simulate_data_stream(bv_raw, ind_DAT, ind_time, fs):
 
 def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx, bv_raw, line_noise, \
                       sess_right, dat_cortex, dat_subcortex, dat_label, ind_cortex, ind_subcortex, ind_label, ind_DAT, \
-                      filter_fun, proj_matrix_run, arr_act_grid_points, grid_classifiers, normalization_samples, ch_names):
+                      filter_fun, proj_matrix_run, arr_act_grid_points, grid_classifiers, normalization_samples, ch_names, \
+                      source=None, time_stamps=5):
+    """
+    run the online decoding on a data stream
+    :param source: stream_source.StreamSource of the ind_DAT channels, e.g. a SocketStreamSource
+        receiving data from replay_server.py; if None bv_raw[ind_DAT,:] is streamed
+    :param time_stamps: number of time appended feature frames used by grid_classifiers
+    """
+    if source is None:
+        source = stream_source.ArrayStreamSource(bv_raw[ind_DAT,:], fs)
     
     num_grid_points = grid_[0].shape[1] + grid_[1].shape[1]+ grid_[2].shape[1]+ grid_[3].shape[1]
 
@@ -89,24 +155,25 @@ def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx
     rf_data_rt = np.zeros([ind_DAT.shape[0], len(f_ranges)])
     pf_data_rt = np.zeros([num_grid_points, len(f_ranges)])
 
-    pf_stream = []
-    rf_stream = []
-    pf_stream_median = []
-    rf_stream_median = []
+    pf_stream = FeatureRing(normalization_samples, num_grid_points, len(f_ranges))
+    pf_stream_median = FeatureRing(time_stamps, num_grid_points, len(f_ranges))
     estimates = []
     buffer_counter = 0
     idx_stream = 0
-    for ind_time in range(bv_raw.shape[1]):
+    while True:
+        dat_ = source.read(1)
+        if dat_ is None:
+            break
         if idx_stream == 0:
             if buffer_counter < seglengths[0]-1:
-                dat_buffer[:, buffer_counter] = simulate_data_stream(bv_raw, ind_DAT, ind_time, fs)
+                dat_buffer[:, buffer_counter] = dat_[:,0]
                 buffer_counter += 1 
                 continue
         else:
             if buffer_counter < seglengths[7]-1:
                 dat_buffer[:,:-1] = dat_buffer[:,1:]
                 buffer_offset = seglengths[0] - seglengths[-1] # to have steps of 100 ms
-                dat_buffer[:, buffer_counter+buffer_offset] = simulate_data_stream(bv_raw, ind_DAT, ind_time, fs)
+                dat_buffer[:, buffer_counter+buffer_offset] = dat_[:,0]
                 buffer_counter += 1 
                 continue
         #plt.imshow(dat_buffer, aspect='auto')
@@ -116,12 +183,7 @@ def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx
         #print(str(np.round(ind_time*(1/fs),2))+' s')
         buffer_counter = 0    
         
-        rf_data_rt = np.zeros([ind_DAT.shape[0], len(f_ranges)])
-        pf_data_rt = np.zeros([num_grid_points, len(f_ranges)])
-        for ch in ind_DAT:  #  think about using multiprocessing pool to do this simulatenously
-            dat_ = dat_buffer[ch,:]
-            dat_filt = filter.apply_filter(dat_, sample_rate=fs, filter_fun=filter_fun, line_noise=line_noise, seglengths=seglengths)
-            rf_data_rt[ch,:] = dat_filt
+        rf_data_rt = get_rf_features(dat_buffer, fs, filter_fun, line_noise, seglengths)
         
         #plt.imshow(rf_data_rt.T, aspect='auto')
         #plt.title('raw t-f transformed')
@@ -131,37 +193,22 @@ def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx
         dat_cortex = rf_data_rt[ind_cortex,:]
         dat_subcortex = rf_data_rt[ind_subcortex,:]
         proj_cortex, proj_subcortex = projection.get_projected_cortex_subcortex_data(proj_matrix_run, sess_right, dat_cortex, dat_subcortex)
-        pf_data_rt = projection.write_proj_data(ch_names, sess_right, dat_label, ind_label, proj_cortex, proj_subcortex)
+        pf_data_rt = projection.write_proj_data(ch_names, sess_right, dat_label, ind_label, grid_, proj_cortex, proj_subcortex)
         
         #plt.imshow(pf_data_rt.T, aspect='auto')
         #plt.title('projected t-f transformed')
         #plt.show()
         
-        if idx_stream<normalization_samples:
-            if idx_stream == 0:
-                n_idx = 0
-            else:
-                n_idx = np.arange(0,idx_stream,1)
-        else:
-            n_idx = np.arange(idx_stream-normalization_samples, idx_stream, 1)
-        
+        # normalize acc. to the median of the previous normalization samples
         if idx_stream == 0:
 
             pf_stream.append(pf_data_rt)
             pf_stream_median.append(pf_data_rt)
-            
-            rf_stream.append(rf_data_rt)
-            rf_stream_median.append(rf_data_rt)
         else:
             
-            rf_stream.append(rf_data_rt)
-            median_ = np.median(np.array(rf_stream)[n_idx,:,:], axis=0)
-            rf_stream_val = (rf_data_rt - median_) / median_
-            rf_stream_median.append(rf_stream_val)
-            
+            pf_data_rt_median = median_normalize(pf_stream.last()[arr_act_grid_points>0,:,:].transpose(1, 0, 2), \
+                                                 pf_data_rt[arr_act_grid_points>0,:])
             pf_stream.append(pf_data_rt)
-            median_ = np.median(np.array(pf_stream)[n_idx,:,:][:,arr_act_grid_points>0,:], axis=0)
-            pf_data_rt_median = (pf_data_rt[arr_act_grid_points>0,:] - median_) / median_
             pf_data_set = np.zeros([num_grid_points, len(f_ranges)])
             pf_data_set[arr_act_grid_points>0,:] = pf_data_rt_median
             pf_stream_median.append(pf_data_set)
@@ -171,11 +218,8 @@ def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx
             #plt.show()
             
             # now use the predictors to estimate the labelement 
-            if idx_stream >= 5:
-                time_stamp_tf_dat = np.array(pf_stream_median)[-5:,:,:]
-                #plt.imshow(time_stamp_tf_dat[:,:,0].T, aspect='auto')
-                #plt.clim(-10,10)
-                #plt.show()
+            if idx_stream >= time_stamps:
+                time_stamp_tf_dat = pf_stream_median.stacked(time_stamps)
                 predictions = predict(time_stamp_tf_dat, grid_classifiers, arr_act_grid_points)
                 estimates.append(predictions)
                 
@@ -183,10 +227,10 @@ def real_time_simulation(fs, fs_new, seglengths, f_ranges, grid_, downsample_idx
                 dat_res[:,-1] = predictions
                 
                 dat_label_con[:-1] = dat_label_con[1:]
-                dat_label_con[-1] = label_con[idx_stream-5]
+                dat_label_con[-1] = label_con[idx_stream-time_stamps]
                 
                 dat_label_ips[:-1] = dat_label_ips[1:]
-                dat_label_ips[-1] = label_ips[idx_stream-5]
+                dat_label_ips[-1] = label_ips[idx_stream-time_stamps]
                 
                 
                 plt.clf()
@@ -0,0 +1,332 @@
+"""
+Online SSD and SPoC spatial filters with recursively updated covariances.
+
+The offline SSD and SPoC estimators compute the single trial covariances of all epochs and solve the
+generalized eigenproblem on every fit, such that a sliding window analysis refits every window from
+scratch. Here the average covariances are running means, updated with the covariances of the new
+epochs only (a rank n_samples update per epoch):
+
+    forget=None, window=None    mean of all epochs seen so far
+    forget=float in (0, 1]      exponentially weighted mean, the weight of an epoch decays by forget
+                                for every later epoch
+    window=int                  mean of the last window epochs, the leaving epochs are subtracted
+
+The eigenproblem is re-solved every refit_every calls of partial_fit, or on demand with solve()
+(refit_every=None). As in ssd.SSD, every epoch is band filtered with its channels concatenated to
+one signal, shape(n_epochs, n_channels*n_samples), such that with window=n and no forgetting the
+filters equal those of an offline fit on the last n epochs. Between two solves the eigenvector signs are kept aligned with the previous
+filters, such that the component time series do not flip sign.
+
+The single trial covariances are computed with batch_cov.regularized_covariances, i.e. as
+mne.cov._regularized_covariance for the estimator / reg options of the offline classes.
+
+Example (real-time decoder, one new buffer of shape(n_channels, n_samples) per step):
+    spoc = online_spatial.OnlineSPoC(n_components=1, reg='oas', rank='full', window=600, refit_every=10)
+    spoc.partial_fit(dat_buffer[None], y[None])
+    features = spoc.transform(dat_buffer[None])
+"""
+import numpy as np
+from scipy.linalg import eigh
+from mne.filter import filter_data
+import batch_cov
+
+
+class RecursiveMean:
+    """
+    Running (weighted) mean of a stream of equally shaped arrays, e.g. covariance matrices
+
+    Args:
+        shape (tuple): shape of one item
+        forget (float, optional): exponential forgetting factor per item in (0, 1]
+        window (int, optional): number of most recent items in the mean
+    """
+
+    def __init__(self, shape, forget=None, window=None):
+        if forget is not None and window is not None:
+            raise ValueError("only one of forget and window can be set")
+        if forget is not None and not 0 < forget <= 1:
+            raise ValueError("forget has to be in (0, 1]")
+        self.shape = tuple(shape)
+        self.forget = forget
+        self.window = window
+        self.sum = np.zeros(self.shape)
+        self.weight = 0.0
+        self.count = 0
+        if window is not None:
+            self.items = np.zeros((window,) + self.shape)
+            self.weights = np.zeros(window)
+            self.pos = 0
+
+    def update(self, items, weights=None):
+        """
+        Args:
+            items (np array): shape(n_items, *shape), in temporal order
+            weights (np array, optional): shape(n_items), default 1
+        """
+        items = np.asarray(items, dtype=np.float64).reshape((-1,) + self.shape)
+        weights = np.ones(items.shape[0]) if weights is None else np.asarray(weights, dtype=np.float64)
+        if self.window is not None:
+            self._update_window(items, weights)
+        elif self.forget is not None and self.forget < 1:
+            # sum_k = forget^n*sum_0 + sum_j forget^(n-1-j)*w_j*item_j
+            decay = self.forget ** np.arange(items.shape[0]-1, -1, -1) * weights
+            self.sum = self.forget**items.shape[0] * self.sum + np.tensordot(decay, items, axes=1)
+            self.weight = self.forget**items.shape[0] * self.weight + decay.sum()
+        else:
+            self.sum += np.tensordot(weights, items, axes=1)
+            self.weight += weights.sum()
+        self.count += items.shape[0]
+
+    def _update_window(self, items, weights):
+        if items.shape[0] > self.window:
+            items, weights = items[-self.window:], weights[-self.window:]
+        idx = (self.pos + np.arange(items.shape[0])) % self.window
+        # rank update: add the new, subtract the leaving items
+        self.sum += np.tensordot(weights, items, axes=1) - np.tensordot(self.weights[idx], self.items[idx], axes=1)
+        self.weight += weights.sum() - self.weights[idx].sum()
+        self.items[idx] = items
+        self.weights[idx] = weights
+        self.pos = (self.pos + items.shape[0]) % self.window
+        if self.pos < items.shape[0]:  # once per pass through the ring, remove the rounding drift
+            self.sum = np.tensordot(self.weights, self.items, axes=1)
+            self.weight = self.weights.sum()
+
+    @property
+    def mean(self):
+        if self.weight == 0:
+            raise RuntimeError("no items have been added")
+        return self.sum / self.weight
+
+
+def _align_signs(evecs, prev):
+    """
+    flip the eigenvectors (columns) of evecs with a negative inner product with the columns of prev
+    """
+    if prev is None or prev.shape != evecs.shape:
+        return evecs
+    signs = np.sign(np.sum(evecs * prev, axis=0))
+    signs[signs == 0] = 1
+    return evecs * signs
+
+
+def _filter_epochs(X, sampling_freq, filt_params):
+    """
+    filter_data of the epochs in shape(n_epochs, n_channels, n_samples) reshaped to
+    shape(n_epochs, n_channels*n_samples), as in ssd.SSD.fit
+    """
+    return filter_data(X.reshape(X.shape[0], -1), sampling_freq, **filt_params).reshape(X.shape)
+
+
+class OnlineSSD:
+    """
+    SSD of epoched data with running signal and noise covariances, see ssd.SSD
+
+    Args:
+        filt_params_signal (dict): filter_data parameters of the frequencies of interest (l_freq, h_freq, ...)
+        filt_params_noise (dict): filter_data parameters of the flanking frequencies
+        sampling_freq (float)
+        estimator (float | str | None): covariance estimator, as in ssd.SSD
+        n_components (int, optional): number of returned components, None for all
+        return_filtered (bool): if True transform projects the signal band filtered data
+        cov_method_params (dict, optional): as in ssd.SSD
+        rank (None | 'full'): as in ssd.SSD
+        forget (float, optional): exponential forgetting factor per epoch, see RecursiveMean
+        window (int, optional): number of most recent epochs, see RecursiveMean
+        refit_every (int, optional): solve the eigenproblem every refit_every calls of partial_fit,
+            None to solve only on demand
+    """
+
+    def __init__(self, filt_params_signal, filt_params_noise, sampling_freq, estimator='oas', n_components=None,
+                 return_filtered=False, cov_method_params=None, rank=None, forget=None, window=None, refit_every=1):
+        if (filt_params_noise['l_freq'] > filt_params_signal['l_freq'] or
+                filt_params_signal['h_freq'] > filt_params_noise['h_freq']):
+            raise ValueError('Wrongly specified frequency bands!\nThe signal band-pass must be within the noise band-pass!')
+        self.filt_params_signal = filt_params_signal
+        self.filt_params_noise = filt_params_noise
+        self.sampling_freq = sampling_freq
+        self.estimator = estimator
+        self.n_components = n_components
+        self.return_filtered = return_filtered
+        self.cov_method_params = cov_method_params
+        self.rank = rank
+        self.forget = forget
+        self.window = window
+        self.refit_every = refit_every
+        self.reset()
+
+    def reset(self):
+        self.cov_signal = None
+        self.cov_noise = None
+        self.filters_ = None
+        self.patterns_ = None
+        self.eigvals_ = None
+        self.n_updates = 0
+
+    def _filter(self, X):
+        X_s = _filter_epochs(X, self.sampling_freq, self.filt_params_signal)
+        X_n = _filter_epochs(X, self.sampling_freq, self.filt_params_noise) - X_s
+        return X_s, X_n
+
+    def partial_fit(self, X, y=None):
+        """
+        add epochs to the signal and noise covariances
+
+        Args:
+            X (np array): shape(n_epochs, n_channels, n_samples), in temporal order
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if self.cov_signal is None:
+            self.cov_signal = RecursiveMean(X.shape[1:2]*2, self.forget, self.window)
+            self.cov_noise = RecursiveMean(X.shape[1:2]*2, self.forget, self.window)
+        X_s, X_n = self._filter(X)
+        self.cov_signal.update(batch_cov.regularized_covariances(X_s, reg=self.estimator,
+                                                                 method_params=self.cov_method_params, rank=self.rank))
+        self.cov_noise.update(batch_cov.regularized_covariances(X_n, reg=self.estimator,
+                                                                method_params=self.cov_method_params, rank=self.rank))
+        self.n_updates += 1
+        if self.refit_every is not None and self.n_updates % self.refit_every == 0:
+            self.solve()
+        return self
+
+    def fit(self, X, y=None):
+        self.reset()
+        self.partial_fit(X)
+        return self.solve()
+
+    def solve(self):
+        """
+        solve the generalized eigenproblem of the current signal and noise covariances
+        """
+        eigvals_, eigvects_ = eigh(self.cov_signal.mean, self.cov_noise.mean)
+        ix = np.argsort(eigvals_)[::-1]
+        self.eigvals_ = eigvals_[ix]
+        self.filters_ = _align_signs(eigvects_[:, ix], self.filters_)
+        self.patterns_ = np.linalg.pinv(self.filters_)
+        return self
+
+    def transform(self, X):
+        """
+        Args:
+            X (np array): shape(n_epochs, n_channels, n_samples)
+
+        Returns:
+            np array: shape(n_epochs, n_components, n_samples)
+        """
+        if self.filters_ is None:
+            self.solve()
+        X = np.asarray(X, dtype=np.float64)
+        if self.return_filtered:
+            X = _filter_epochs(X, self.sampling_freq, self.filt_params_signal)
+        return np.matmul(self.filters_[:, :self.n_components].T, X)
+
+
+class OnlineSPoC:
+    """
+    SPoC of epoched data with running covariance and target weighted covariance, see mne.decoding.SPoC
+
+    The target is z-scored over the same (weighted) epochs as the covariances:
+    C = mean(C_i), C_z = mean(C_i*y_i) - mean(y)*C, divided by std(y).
+
+    Args:
+        n_components (int)
+        reg (float | str | None): as in mne.decoding.SPoC
+        log (None | bool): as in mne.decoding.SPoC, only log features (True or None) are supported
+        transform_into ('average_power' | 'csp_space'): as in mne.decoding.SPoC
+        cov_method_params (dict, optional): as in mne.decoding.SPoC
+        rank (None | 'full'): as in mne.decoding.SPoC
+        forget (float, optional): exponential forgetting factor per epoch, see RecursiveMean
+        window (int, optional): number of most recent epochs, see RecursiveMean
+        refit_every (int, optional): solve the eigenproblem every refit_every calls of partial_fit,
+            None to solve only on demand
+    """
+
+    def __init__(self, n_components=4, reg=None, log=None, transform_into='average_power', cov_method_params=None,
+                 rank=None, forget=None, window=None, refit_every=1):
+        if log is False and transform_into == 'average_power':
+            raise ValueError("the running features can not be standardized, use log=True")
+        self.n_components = n_components
+        self.reg = reg
+        self.log = log
+        self.transform_into = transform_into
+        self.cov_method_params = cov_method_params
+        self.rank = rank
+        self.forget = forget
+        self.window = window
+        self.refit_every = refit_every
+        self.reset()
+
+    def reset(self):
+        self.covs = None
+        self.target = None
+        self.filters_ = None
+        self.patterns_ = None
+        self.eigvals_ = None
+        self.n_updates = 0
+
+    def partial_fit(self, X, y):
+        """
+        add epochs to the covariances
+
+        Args:
+            X (np array): shape(n_epochs, n_channels, n_samples), in temporal order
+            y (np array): shape(n_epochs)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        n_channels = X.shape[1]
+        if self.covs is None:
+            # C_i and C_i*y_i stacked, such that both share one ring buffer
+            self.covs = RecursiveMean((2, n_channels, n_channels), self.forget, self.window)
+            self.target = RecursiveMean((2,), self.forget, self.window)
+        covs = batch_cov.regularized_covariances(X, reg=self.reg, method_params=self.cov_method_params,
+                                                 rank=self.rank)
+        self.covs.update(np.stack((covs, covs * y[:, None, None]), axis=1))
+        self.target.update(np.stack((y, y**2), axis=1))
+        self.n_updates += 1
+        # no solve as long as the target is constant, e.g. for the first epoch
+        if self.refit_every is not None and self.n_updates % self.refit_every == 0 and self._target_std() > 0:
+            self.solve()
+        return self
+
+    def fit(self, X, y):
+        self.reset()
+        self.partial_fit(X, y)
+        return self.solve()
+
+    def _target_std(self):
+        y_mean, y2_mean = self.target.mean
+        return np.sqrt(max(y2_mean - y_mean**2, 0))
+
+    def solve(self):
+        """
+        solve the generalized eigenproblem of the current covariances
+        """
+        C, C_y = self.covs.mean
+        y_std = self._target_std()
+        if y_std == 0:
+            raise RuntimeError("the target is constant in the current epochs")
+        C_z = (C_y - self.target.mean[0] * C) / y_std
+        evals, evecs = eigh(C_z, C)
+        ix = np.argsort(np.abs(evals))[::-1]
+        # rows are the filters, as in mne.decoding.SPoC
+        self.eigvals_ = evals[ix]
+        prev = None if self.filters_ is None else self.filters_.T
+        self.filters_ = _align_signs(evecs[:, ix], prev).T
+        self.patterns_ = np.linalg.pinv(self.filters_)
+        return self
+
+    def transform(self, X):
+        """
+        Args:
+            X (np array): shape(n_epochs, n_channels, n_samples)
+
+        Returns:
+            np array: log average power in shape(n_epochs, n_components), or for transform_into='csp_space'
+                the components in shape(n_epochs, n_components, n_samples)
+        """
+        if self.filters_ is None:
+            self.solve()
+        X = np.matmul(self.filters_[:self.n_components], np.asarray(X, dtype=np.float64))
+        if self.transform_into == 'average_power':
+            X = np.log((X**2).mean(axis=2))
+        return X
@@ -10,7 +10,7 @@ import rereference
 import numpy as np
 import json
 import os
-import pickle 
+import feature_store
 from matplotlib import pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D #for 3D plotting
 import scipy
@@ -53,12 +53,13 @@ settings['out_path']=settings['out_path'].replace("\\", "/")
 #     settings = IO.read_settings('mysettings')
 
 #2. write _channels_MI file
+catalog = IO.BIDSCatalog(settings['BIDS_path'])  # index of the BIDS folder, refreshed on changes
 write_ALL = False
 if write_ALL is True:
-    IO.write_all_M1_channel_files()
+    IO.write_all_M1_channel_files(settings, catalog=catalog)
 
 #3. get all vhdr files (from a subject or from all BIDS_path)
-vhdr_files=IO.get_all_vhdr_files(settings['BIDS_path'])
+vhdr_files=IO.get_all_vhdr_files(settings['BIDS_path'], catalog)
 
 #4. read grid
 #%% grid projection
@@ -93,15 +94,7 @@ ecog_grid_right = grid_[2]
 
 def run_vhdr_file(s):
    
-    if s<10:
-        subject_path=settings['BIDS_path'] + 'sub-00' + str(s)
-    else:
-        subject_path=settings['BIDS_path'] + 'sub-0' + str(s)
-    
-        
-    subfolder=IO.get_subfolders(subject_path)
-           
-    vhdr_files=IO.get_files(subject_path, subfolder)
+    vhdr_files=catalog.vhdr_files(str(s).zfill(3))
     
     len(vhdr_files)
     for f in range(len(vhdr_files)):
@@ -117,7 +110,7 @@ def run_vhdr_file(s):
 
         
         #read sf
-        sf=IO.read_run_sampling_frequency(vhdr_file)
+        sf=IO.read_run_sampling_frequency(vhdr_file, catalog)
         if len(sf.unique())==1: #all sf are equal
             sf=int(sf[0])
         else: 
@@ -152,7 +145,7 @@ def run_vhdr_file(s):
                 
         #%% 8. project data to grid points
         #read all used coordinates from session coordinates.tsv BIDS file
-        coord_patient = IO.get_patient_coordinates(ch_names, ind_cortex, ind_subcortex, vhdr_file, settings['BIDS_path'])
+        coord_patient = IO.get_patient_coordinates(ch_names, ind_cortex, ind_subcortex, vhdr_file, settings['BIDS_path'], catalog)
         # # # given those coordinates and the provided grid, estimate the projection matrix
         proj_matrix_run = projection.calc_projection_matrix(coord_patient, grid_, sess_right, settings['max_dist_cortex'], settings['max_dist_subcortex'])
         # #They show the relative weights of every channel for every gridpoint
@@ -167,7 +160,7 @@ def run_vhdr_file(s):
         seglengths = settings['seglengths']
         
         # read line noise from participants.tsv
-        line_noise = IO.read_line_noise(settings['BIDS_path'],subject)
+        line_noise = IO.read_line_noise(settings['BIDS_path'],subject, catalog)
         if sf>1000:
             filter_len=sf
         else:
@@ -264,10 +257,9 @@ def run_vhdr_file(s):
             "label_con_true" : con_true,        
         }
 
-        out_path = os.path.join(settings['out_path'],'sub_' + subject + '_sess_' + sess + '_run_' + run + '.p')
+        out_path = os.path.join(settings['out_path'], feature_store.get_run_name(subject, sess, run) + feature_store.FILE_ENDING)
     
-        with open(out_path, 'wb') as handle:
-            pickle.dump(run_, handle, protocol=pickle.HIGHEST_PROTOCOL)    
+        feature_store.write_run(out_path, run_)
 
                                 
 
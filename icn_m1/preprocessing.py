@@ -13,7 +13,8 @@ def rereference(run_string, bv_raw, get_ch_names=True, get_cortex_subcortex=Fals
     run_string (string): run string without specific ending in form sub-000_ses-right_task-force_run-0
 
     bv_raw : array, shape(n_channels, n_samples)
-        raw data 
+        raw data, or an IO.BrainVisionMemmap; with get_cortex_subcortex=True only
+        cortex and subcortex channels are then read
 
     
     Returns
@@ -31,7 +32,6 @@ def rereference(run_string, bv_raw, get_ch_names=True, get_cortex_subcortex=Fals
    
     channels_name=df_channel['name'].tolist()
     
-    new_data=bv_raw.copy()
 
     if used_channels['subcortex'] is not None: 
         data_subcortex = bv_raw[used_channels['subcortex'],:]
@@ -58,7 +58,6 @@ def rereference(run_string, bv_raw, get_ch_names=True, get_cortex_subcortex=Fals
                     
                 new_data_subcortex[idx]=ch-np.mean(data_subcortex[index,:], axis=0)
             idx=idx+1    
-        new_data[used_channels['subcortex'],:]=new_data_subcortex 
 
     else:
         new_data_subcortex=None
@@ -94,7 +93,6 @@ def rereference(run_string, bv_raw, get_ch_names=True, get_cortex_subcortex=Fals
                 new_data_cortex[idx]=ch-np.mean(data_cortex[index,:], axis=0)
                 
             idx=idx+1
-        new_data[used_channels['cortex'],:]=new_data_cortex 
     else:
         new_data_cortex=None
     
@@ -104,6 +102,11 @@ def rereference(run_string, bv_raw, get_ch_names=True, get_cortex_subcortex=Fals
         else:
             return new_data_cortex, new_data_subcortex
     else:
+        new_data=np.array(bv_raw[:,:])
+        if new_data_subcortex is not None:
+            new_data[used_channels['subcortex'],:]=new_data_subcortex
+        if new_data_cortex is not None:
+            new_data[used_channels['cortex'],:]=new_data_cortex
         if get_ch_names:
             return new_data, channels_name
         else:
@@ -0,0 +1,161 @@
+"""
+Local replay server for online decoding without hardware.
+
+A BrainVision (.vhdr) or Medtronic Percept (.json) recording is served over TCP at its
+native sampling rate. Samples are sent in packets, as an amplifier would send them,
+and the protocol is described in stream_source.py. Since packets are written with
+blocking sends, a slow client back-pressures the server; the server then sends the
+delayed packets as fast as possible to catch up with the recording time.
+
+Example:
+    server = replay_server.ReplayServer(dat, fs, ch_names)
+    server.start()
+    source = stream_source.SocketStreamSource(port=server.port)
+"""
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy as np
+import mne
+
+PACKET_MS_BRAINVISION = 20
+PACKET_SAMPLES_PERCEPT = 62  # BrainSense streaming packets at 250 Hz
+
+
+def read_recording(file_path):
+    """
+    read a BrainVision or Percept file
+
+    Args:
+        file_path (string): .vhdr or Percept .json report
+
+    Returns:
+        dat (np array): shape(n_channels, n_samples)
+        fs (float): sampling frequency
+        ch_names (list)
+    """
+    if file_path.endswith('.vhdr'):
+        raw = mne.io.read_raw_brainvision(file_path, preload=True, verbose=False)
+    elif file_path.endswith('.json'):
+        sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'icn_perceive'))
+        import icn_perceive
+        raw = icn_perceive.import_rawdata(file_path)
+        if raw is None:
+            raise ValueError('No time domain data in '+file_path)
+    else:
+        raise ValueError('Only .vhdr and Percept .json files can be replayed.')
+    return raw.get_data(), raw.info['sfreq'], raw.ch_names
+
+
+class ReplayServer:
+    """
+    Serve a recording to one client at a time
+
+    Args:
+        dat (np array): shape(n_channels, n_samples)
+        fs (float): sampling frequency
+        ch_names (list)
+        host (string)
+        port (int): 0 selects a free port, see attribute port
+        packet_samples (int, optional): samples per packet, defaults to PACKET_MS_BRAINVISION
+        packet_jitter (float): relative random variation of the packet size
+        loop (bool): restart the recording when it ended
+        seed (int): random seed of the packet size variation
+    """
+
+    def __init__(self, dat, fs, ch_names, host='127.0.0.1', port=50001, packet_samples=None,
+                 packet_jitter=0, loop=False, seed=0):
+        self.dat = np.ascontiguousarray(dat.T, dtype='<f4')  # shape(n_samples, n_channels)
+        self.fs = fs
+        self.ch_names = list(ch_names)
+        if packet_samples is None:
+            packet_samples = max(1, int(fs*PACKET_MS_BRAINVISION/1000))
+        self.packet_samples = packet_samples
+        self.packet_jitter = packet_jitter
+        self.loop = loop
+        self.rng = np.random.RandomState(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+        self.stopped = threading.Event()
+        self.thread = None
+        self.max_lag = 0  # largest delay in s of a packet w.r.t. the recording time
+
+    def get_packet_sizes(self):
+        num_samples = self.dat.shape[0]
+        sizes = []
+        pos = 0
+        while pos < num_samples:
+            n = self.packet_samples
+            if self.packet_jitter > 0:
+                n = int(round(n*(1 + self.rng.uniform(-self.packet_jitter, self.packet_jitter))))
+            n = min(max(n, 1), num_samples - pos)
+            sizes.append(n)
+            pos += n
+        return sizes
+
+    def serve_client(self, conn):
+        header = json.dumps({"fs": self.fs, "ch_names": self.ch_names}).encode('utf-8')
+        conn.sendall(struct.pack('!I', len(header)) + header)
+        while not self.stopped.is_set():
+            t_start = time.perf_counter()
+            pos = 0
+            for n in self.get_packet_sizes():
+                if self.stopped.is_set():
+                    break
+                pos += n
+                wait = t_start + pos/self.fs - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    self.max_lag = max(self.max_lag, -wait)
+                conn.sendall(struct.pack('!I', n) + self.dat[pos-n:pos].tobytes())
+            if not self.loop:
+                break
+        conn.sendall(struct.pack('!I', 0))
+
+    def serve_forever(self):
+        self.sock.settimeout(0.5)
+        while not self.stopped.is_set():
+            try:
+                conn, addr = self.sock.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            with conn:
+                try:
+                    self.serve_client(conn)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+        self.sock.close()
+
+    def start(self):
+        """
+        run the server in a background thread
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == "__main__":
+
+    file_path = sys.argv[1]
+    dat, fs, ch_names = read_recording(file_path)
+    if file_path.endswith('.json'):
+        packet_samples = PACKET_SAMPLES_PERCEPT
+    else:
+        packet_samples = None
+    print('serving '+file_path+' with '+str(len(ch_names))+' channels at '+str(fs)+' Hz')
+    ReplayServer(dat, fs, ch_names, packet_samples=packet_samples, packet_jitter=0.1).serve_forever()
@@ -0,0 +1,192 @@
+"""
+Results store of the per channel decoding outputs of a sweep.
+
+Instead of one pickled BestChpredictions npy file per subject, signal, channel, laterality and
+session, all results of a sweep are written into one SQLite file:
+
+    results    one row per result: key (the former file name), subject, signal, channel, laterality,
+               session, score_tr, score_te and the pickled small fields (e.g. model_hyperparams)
+    arrays     one row per result, array field and fold: the npy bytes of e.g. y_pred_test[fold]
+
+Every result is written in one transaction, such that concurrent workers can append to the same
+file (WAL journal, writers wait for the lock) and readers never see a partial result. The score
+table is loaded as a pandas DataFrame for filtering and best channel ranking, the predictions are
+read only on demand, per result, field and fold.
+
+Example:
+    store = results_store.ResultsStore(os.path.join(settings['out_path_process'], 'results.sqlite'))
+    scores = store.get_scores(signal='ECOG', laterality='CON')
+    best = store.get_best_channels(signal='ECOG')
+    y_pred = store.get_array(best['key'].iloc[0], 'y_pred_test', fold=0)
+"""
+import io
+import os
+import pickle
+import re
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+# fields with one array per fold
+ARRAY_FIELDS = ("y_pred_test", "y_test", "y_pred_train", "y_train", "coef")
+SCORE_FIELDS = ("score_tr", "score_te")
+ID_FIELDS = ("subject", "signal", "channel", "laterality", "session")
+
+FILE_PATTERN = re.compile(r'^(?P<subject>[^_]+)BestChpredictions_(?P<signal>[A-Za-z]+)-ch-(?P<channel>\d+)'
+                          r'-lat-(?P<laterality>[A-Za-z]+)-(?P<session>.+)\.npy$')
+
+
+def _to_bytes(arr):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(arr), allow_pickle=False)
+    return buf.getvalue()
+
+
+def _from_bytes(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+def parse_file_name(file_name):
+    """
+    Returns:
+        dict: subject, signal, channel, laterality and session of a BestChpredictions file name,
+            None if the name does not match
+    """
+    match = FILE_PATTERN.match(os.path.basename(file_name))
+    if match is None:
+        return None
+    ids = match.groupdict()
+    ids['channel'] = int(ids['channel'])
+    return ids
+
+
+class ResultsStore:
+    """
+    Args:
+        db_file (string): SQLite file, created if it does not exist
+        timeout (float): time in s a writer waits for the lock of another writer
+    """
+
+    def __init__(self, db_file, timeout=600):
+        self.db_file = db_file
+        self.con = sqlite3.connect(db_file, timeout=timeout)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, subject TEXT, signal TEXT, "
+                         "channel INTEGER, laterality TEXT, session TEXT, score_tr REAL, score_te REAL, "
+                         "num_folds INTEGER, params BLOB, updated REAL)")
+        self.con.execute("CREATE TABLE IF NOT EXISTS arrays (key TEXT, field TEXT, fold INTEGER, data BLOB, "
+                         "PRIMARY KEY (key, field, fold))")
+        self.con.execute("CREATE INDEX IF NOT EXISTS results_ids ON results (subject, signal, laterality, session)")
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    def write(self, key, predict_, subject, signal, channel, laterality, session):
+        """
+        write (or replace) a result
+
+        Args:
+            key (string): unique name, e.g. the BestChpredictions file name
+            predict_ (dict): y_pred_test, y_test, y_pred_train, y_train, coef as lists with one array per fold,
+                score_tr, score_te as float; further fields (e.g. model_hyperparams) are pickled
+            subject, signal, channel, laterality, session: identifiers of the score table
+        """
+        params = {field: value for field, value in predict_.items() if field not in ARRAY_FIELDS + SCORE_FIELDS}
+        num_folds = max([len(predict_.get(field, [])) for field in ARRAY_FIELDS])
+        arrays = [(key, field, fold, _to_bytes(arr)) for field in ARRAY_FIELDS
+                  for fold, arr in enumerate(predict_.get(field, []))]
+        with self.con:  # one transaction
+            self.con.execute("DELETE FROM arrays WHERE key=?", (key,))
+            self.con.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, str(subject), str(signal), int(channel), str(laterality), str(session),
+                              float(predict_["score_tr"]), float(predict_["score_te"]), num_folds,
+                              pickle.dumps(params), time.time()))
+            self.con.executemany("INSERT INTO arrays VALUES (?, ?, ?, ?)", arrays)
+
+    def has_key(self, key):
+        return self.con.execute("SELECT 1 FROM results WHERE key=?", (key,)).fetchone() is not None
+
+    def get_scores(self, **filters):
+        """
+        score table, sorted by descending score_te
+
+        Args:
+            filters: equality conditions on the ID_FIELDS, e.g. signal='ECOG', laterality='CON'
+
+        Returns:
+            pd.DataFrame: columns key, subject, signal, channel, laterality, session, score_tr, score_te
+        """
+        for field in filters:
+            if field not in ID_FIELDS:
+                raise ValueError("filters have to be in " + str(ID_FIELDS))
+        where = " AND ".join(field + "=?" for field in filters)
+        query = "SELECT key, subject, signal, channel, laterality, session, score_tr, score_te FROM results" + \
+            (" WHERE " + where if where else "") + " ORDER BY score_te DESC"
+        return pd.read_sql_query(query, self.con, params=list(filters.values()))
+
+    def get_best_channels(self, by=("subject", "signal", "laterality"), **filters):
+        """
+        Returns:
+            pd.DataFrame: the row with the highest score_te of every group in by
+        """
+        scores = self.get_scores(**filters)
+        return scores.groupby(list(by), sort=True).head(1).reset_index(drop=True)
+
+    def get_array(self, key, field, fold=None):
+        """
+        Args:
+            key (string)
+            field (string): one of ARRAY_FIELDS
+            fold (int, optional): if None the arrays of all folds are returned as list
+
+        Returns:
+            np array or list of np arrays
+        """
+        if fold is not None:
+            row = self.con.execute("SELECT data FROM arrays WHERE key=? AND field=? AND fold=?",
+                                   (key, field, fold)).fetchone()
+            if row is None:
+                raise KeyError(str((key, field, fold)))
+            return _from_bytes(row[0])
+        return [_from_bytes(row[0]) for row in self.con.execute(
+            "SELECT data FROM arrays WHERE key=? AND field=? ORDER BY fold", (key, field))]
+
+    def read(self, key):
+        """
+        Returns:
+            dict: the predict_ dict as written, equal to the dict of the former BestChpredictions npy file
+        """
+        row = self.con.execute("SELECT score_tr, score_te, params FROM results WHERE key=?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        predict_ = {field: self.get_array(key, field) for field in ARRAY_FIELDS}
+        predict_["score_tr"], predict_["score_te"] = row[0], row[1]
+        predict_.update(pickle.loads(row[2]))
+        return predict_
+
+
+def convert_npy(in_path, store, remove=False):
+    """
+    import the BestChpredictions npy files of a folder into a ResultsStore
+
+    Args:
+        in_path (string): folder of the npy files
+        store (ResultsStore)
+        remove (bool): if True the npy files are deleted after they were written into the store
+
+    Returns:
+        list: names of the imported files
+    """
+    imported = []
+    for file_name in sorted(os.listdir(in_path)):
+        ids = parse_file_name(file_name)
+        if ids is None:
+            continue
+        predict_ = np.load(os.path.join(in_path, file_name), allow_pickle=True).item()
+        store.write(file_name, predict_, **ids)
+        imported.append(file_name)
+        if remove is True:
+            os.remove(os.path.join(in_path, file_name))
+    return imported
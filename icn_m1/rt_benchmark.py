@@ -0,0 +1,333 @@
+"""
+Real-time factor benchmark of the online feature engine.
+
+A BIDS run (or a synthetic recording) is replayed hop by hop through the same
+steps as online_analysis.real_time_simulation: feature extraction, projection to the
+grid, median normalization of the projected features and the prediction of every active
+grid point, either as fast as possible or paced at the wall-clock rate of the recording.
+Without trained grid classifiers a synthetic decoder of the same size is used. For every configuration
+of channel count, frequency band set and hop size the real time factor, the latency
+distribution and the number of dropped frames are reported. Results are written as
+json, such that they can be compared between versions.
+
+real_time_factor = computation time / duration of the replayed data
+    values < 1 indicate that the engine keeps up with real time
+latency = time from the arrival of the last sample of a hop until its prediction is available
+    in the as fast as possible mode the arrival is the start of the computation
+dropped frame = in paced mode a hop that was skipped, since a newer hop had already arrived
+    when the engine became ready
+
+Network fed streams can be benchmarked with replay_source and a
+stream_source.SocketStreamSource connected to replay_server.py.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+from sklearn.linear_model import LinearRegression
+import filter
+import IO
+import online_analysis
+import projection
+import stream_source
+
+BAND_SETS = {
+    "default": ([[4, 8], [8, 12], [13, 20], [20, 35], [13, 35], [60, 80], [90, 200], [60, 200]],
+                [1, 2, 2, 3, 3, 3, 10, 10]),
+    "beta_gamma": ([[13, 35], [60, 200]], [3, 10]),
+    "low": ([[4, 8], [8, 12], [13, 20], [20, 35]], [1, 2, 2, 3]),
+}
+
+
+def synthetic_recording(num_channels, fs=1000, duration=30, line_noise=50, seed=0):
+    """
+    create a recording of white noise with a superimposed line noise component
+
+    Args:
+        num_channels (int)
+        fs (int): sampling frequency
+        duration (float): recording length in s
+        line_noise (int): line noise frequency in Hz
+        seed (int): random seed
+
+    Returns:
+        np array: shape(num_channels, fs*duration)
+    """
+    rng = np.random.RandomState(seed)
+    num_samples = int(fs*duration)
+    t = np.arange(num_samples) / fs
+    dat = rng.randn(num_channels, num_samples)*1e-5
+    dat += 1e-5*np.sin(2*np.pi*line_noise*t)
+    return dat
+
+
+def synthetic_decoder(num_channels, num_f_bands, num_grid_points=78, time_stamps=5, seed=0):
+    """
+    create a projection matrix and linear grid classifiers of the size used in online_analysis
+
+    Args:
+        num_channels (int)
+        num_f_bands (int)
+        num_grid_points (int): number of active grid points, default the 78 cortical grid points
+        time_stamps (int): number of time stamps of the classifier features
+        seed (int): random seed
+
+    Returns:
+        proj_matrix (np array): shape(num_grid_points, num_channels), rows sum up to 1
+        grid_classifiers (list): fitted LinearRegression of every grid point
+        arr_act_grid_points (np array): shape(num_grid_points), all grid points active
+    """
+    rng = np.random.RandomState(seed)
+    proj_matrix = rng.rand(num_grid_points, num_channels)
+    proj_matrix /= proj_matrix.sum(axis=1, keepdims=True)
+    grid_classifiers = []
+    for grid_point in range(num_grid_points):
+        X = rng.randn(10*time_stamps*num_f_bands, time_stamps*num_f_bands)
+        grid_classifiers.append(LinearRegression().fit(X, rng.randn(X.shape[0])))
+    return proj_matrix, grid_classifiers, np.ones(num_grid_points)
+
+
+def read_BIDS_recording(vhdr_file, BIDS_path):
+    """
+    read the data channels (no label channels) of a BIDS run
+
+    Args:
+        vhdr_file (string)
+        BIDS_path (string)
+
+    Returns:
+        dat (np array): shape(num_data_channels, num_samples)
+        fs (int): sampling frequency
+        line_noise (int)
+    """
+    bv_raw, ch_names = IO.read_BIDS_file(vhdr_file)
+    fs = int(IO.read_run_sampling_frequency(vhdr_file)[0])
+    subject, run, sess = IO.get_sess_run_subject(vhdr_file)
+    line_noise = IO.read_line_noise(BIDS_path, subject)
+    used_channels = IO.read_M1_channel_specs(vhdr_file[:-10])
+    data_ = IO.get_dat_cortex_subcortex(bv_raw, ch_names, used_channels)
+    if data_["ind_dat"] is None:
+        return bv_raw, fs, line_noise
+    return bv_raw[data_["ind_dat"],:], fs, line_noise
+
+
+def replay(dat, fs, f_ranges, seglengths, hop_ms=100, line_noise=50, normalization_time=10,
+           paced=False, max_frames=None, decoder=None, time_stamps=5):
+    """
+    stream dat hop by hop through the online engine
+
+    Parameters
+    ----------
+    dat : array, shape(n_channels, n_samples)
+        recording which is replayed
+    fs : int
+        sampling frequency
+    f_ranges : list
+        frequency bands in Hz
+    seglengths : list
+        seglengths in Hz for every frequency band, see settings.json
+    hop_ms : float
+        time in ms between two feature estimations
+    line_noise : int
+        line noise frequency in Hz
+    normalization_time : float
+        time in s used for median normalization
+    paced : bool
+        if True, samples are released at the wall clock rate of the recording,
+        else the data is streamed as fast as possible
+    max_frames : int, optional
+        stop after max_frames hops
+    decoder : tuple, optional
+        (proj_matrix, grid_classifiers, arr_act_grid_points) with proj_matrix in
+        shape(grid_points, n_channels), defaults to synthetic_decoder
+    time_stamps : int
+        number of time stamps of the classifier features
+
+    Returns
+    -------
+    dict
+        real_time_factor, latency statistics in ms, number of processed and dropped frames;
+        the latency statistics are NaN if no frame was processed
+    """
+    source = stream_source.ArrayStreamSource(dat, fs, paced=paced)
+    return replay_source(source, f_ranges, seglengths, hop_ms, line_noise, normalization_time,
+                         skip_stale=paced, max_frames=max_frames, decoder=decoder, time_stamps=time_stamps)
+
+
+def replay_source(source, f_ranges, seglengths, hop_ms=100, line_noise=50, normalization_time=10,
+                  skip_stale=True, max_frames=None, decoder=None, time_stamps=5):
+    """
+    run the online engine on a stream_source.StreamSource, e.g. a
+    SocketStreamSource connected to replay_server.py
+
+    Args:
+        source (StreamSource)
+        f_ranges, seglengths, hop_ms, line_noise, normalization_time, decoder, time_stamps: see replay
+        skip_stale (bool): if True, hops which are outdated when the engine becomes ready are dropped
+        max_frames (int, optional): stop after max_frames hops
+
+    Returns:
+        dict: see replay
+    """
+    fs = int(source.fs)
+    seglengths = np.asarray(seglengths)
+    buffer_len = fs  # 1 s data buffer, as used in offline_analysis.run
+    hop = int(fs*hop_ms/1000)
+    filter_len = fs if fs > 1000 else 1001
+    filter_fun = filter.calc_band_filters(f_ranges, sample_rate=fs, filter_len=filter_len)
+    seglengths_samples = (fs/seglengths).astype(int)
+    normalization_samples = int(normalization_time*1000/hop_ms)
+
+    latencies = []
+    compute_time = 0
+    num_frames = 0
+    dropped = 0
+    t_start = time.perf_counter()
+    dat_buffer = source.read(buffer_len - hop)
+    if dat_buffer is not None:
+        if decoder is None:
+            decoder = synthetic_decoder(dat_buffer.shape[0], len(f_ranges), time_stamps=time_stamps)
+        proj_matrix, grid_classifiers, arr_act_grid_points = decoder
+        act_ = arr_act_grid_points > 0
+        pf_stream = online_analysis.FeatureRing(normalization_samples, proj_matrix.shape[0], len(f_ranges))
+        pf_stream_median = online_analysis.FeatureRing(time_stamps, proj_matrix.shape[0], len(f_ranges))
+    while dat_buffer is not None and (max_frames is None or num_frames < max_frames):
+        dat_ = source.read(hop)
+        if dat_ is None:
+            break
+        dat_buffer = np.concatenate((dat_buffer[:, hop-buffer_len:], dat_), axis=1)
+        num_frames += 1
+        if skip_stale and source.available() >= hop:
+            dropped += 1
+            continue
+
+        t_frame = time.perf_counter()
+        rf_data_rt = online_analysis.get_rf_features(dat_buffer, fs, filter_fun, line_noise, seglengths_samples)
+        pf_data_rt, _ = projection.get_projected_cortex_subcortex_data((proj_matrix, None), True, rf_data_rt)
+        if pf_stream.count == 0:
+            pf_stream.append(pf_data_rt)
+            pf_stream_median.append(pf_data_rt)
+        else:
+            pf_data_set = np.zeros(pf_data_rt.shape)
+            pf_data_set[act_,:] = online_analysis.median_normalize(pf_stream.last()[act_,:,:].transpose(1, 0, 2),
+                                                                   pf_data_rt[act_,:])
+            pf_stream.append(pf_data_rt)
+            pf_stream_median.append(pf_data_set)
+            if pf_stream_median.count >= time_stamps:
+                online_analysis.predict(pf_stream_median.stacked(time_stamps), grid_classifiers, arr_act_grid_points)
+        t_done = time.perf_counter()
+
+        compute_time += t_done - t_frame
+        latencies.append(t_done - source.last_arrival)
+
+    latencies = np.array(latencies)*1000
+    if latencies.shape[0] == 0:  # nothing read or all frames dropped
+        latencies = np.array([np.nan])
+    return {
+        "real_time_factor": compute_time / (num_frames*hop/fs) if num_frames > 0 else np.nan,
+        "wall_time_s": time.perf_counter() - t_start,
+        "num_frames": int(num_frames),
+        "processed_frames": int(num_frames - dropped),
+        "dropped_frames": int(dropped),
+        "latency_ms": {
+            "mean": float(np.mean(latencies)),
+            "median": float(np.median(latencies)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(np.max(latencies))
+        }
+    }
+
+
+def sweep(dat=None, fs=1000, line_noise=50, channel_counts=(1, 6, 12), band_sets=None, hop_sizes=(50, 100),
+          paced=False, duration=30, normalization_time=10, Verbose=True):
+    """
+    run replay for every combination of channel count, band set and hop size
+
+    Args:
+        dat (np array, optional): recording in shape(n_channels, n_samples); if None a synthetic recording is used.
+            Channel counts larger than the number of recorded channels are obtained by tiling the channels.
+        fs (int): sampling frequency
+        line_noise (int)
+        channel_counts (tuple): number of streamed channels
+        band_sets (dict, optional): name: (f_ranges, seglengths); defaults to BAND_SETS
+        hop_sizes (tuple): hop sizes in ms
+        paced (bool): see replay
+        duration (float): replayed time in s
+        normalization_time (float)
+        Verbose (bool)
+
+    Returns:
+        list of dicts: configuration and results of every run
+    """
+    if band_sets is None:
+        band_sets = BAND_SETS
+    if dat is None:
+        dat = synthetic_recording(max(channel_counts), fs, duration, line_noise)
+    dat = dat[:, :int(duration*fs)]
+
+    results = []
+    for num_channels in channel_counts:
+        dat_ = np.tile(dat, (int(np.ceil(num_channels/dat.shape[0])), 1))[:num_channels,:]
+        for band_set, (f_ranges, seglengths) in band_sets.items():
+            for hop_ms in hop_sizes:
+                res = replay(dat_, fs, f_ranges, seglengths, hop_ms, line_noise, normalization_time, paced)
+                res.update({
+                    "num_channels": int(num_channels),
+                    "band_set": band_set,
+                    "num_f_bands": len(f_ranges),
+                    "hop_ms": hop_ms,
+                    "fs": fs,
+                    "paced": paced
+                })
+                if Verbose:
+                    print('channels: '+str(num_channels)+' bands: '+band_set+' hop: '+str(hop_ms)+ \
+                          ' ms RTF: '+str(np.round(res["real_time_factor"], 3)))
+                results.append(res)
+    return results
+
+
+def get_version():
+    """
+    return the git revision of the toolbox, None if not available
+    """
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def write_results(results, out_path):
+    """
+    write sweep results together with version and machine information as json
+    """
+    out_ = {
+        "version": get_version(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "results": results
+    }
+    with open(out_path, 'w') as fp:
+        json.dump(out_, fp, indent=4)
+
+
+if __name__ == "__main__":
+
+    # set vhdr_file to a BIDS run in order to replay recorded data instead of synthetic data
+    vhdr_file = None
+    BIDS_path = None
+
+    if vhdr_file is None:
+        results = sweep()
+    else:
+        dat, fs, line_noise = read_BIDS_recording(vhdr_file, BIDS_path)
+        results = sweep(dat, fs, line_noise)
+    results += sweep(channel_counts=(6,), hop_sizes=(100,), paced=True, duration=10)
+    write_results(results, 'rt_benchmark.json')
@@ -0,0 +1,178 @@
+"""
+Data stream sources for the online analysis.
+
+Every source provides the sampling frequency, the channel names and a blocking read
+of a given number of samples in shape (n_channels, n_samples). A source returns None
+when the stream ended. The attribute last_arrival is the time.perf_counter() time
+at which the last returned sample became available, and is used for latency estimation.
+
+ArrayStreamSource streams an in memory array (e.g. bv_raw), optionally paced at the
+sampling rate. SocketStreamSource receives a stream from replay_server.py, or any
+other server implementing the same protocol:
+
+    header: uint32 (network order) length + utf-8 json {"fs", "ch_names"}
+    packet: uint32 (network order) num_samples + float32 (little endian) array in shape
+            (num_samples, n_channels); num_samples = 0 marks the end of the stream
+"""
+import json
+import select
+import socket
+import struct
+import time
+from collections import deque
+import numpy as np
+
+
+class StreamSource:
+    """
+    Interface of an online data stream
+    """
+
+    fs = None
+    ch_names = None
+    last_arrival = None
+
+    def read(self, num_samples):
+        """
+        block until num_samples are available
+
+        Returns:
+            np array: shape(n_channels, num_samples), None if the stream ended
+        """
+        raise NotImplementedError
+
+    def available(self):
+        """
+        Returns:
+            int: number of samples that can be read without blocking
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ArrayStreamSource(StreamSource):
+    """
+    Stream an array sample by sample
+
+    Args:
+        dat (np array): shape(n_channels, n_samples)
+        fs (float): sampling frequency
+        ch_names (list, optional)
+        paced (bool): if True, samples are released at the wall clock rate given by fs,
+            starting with the first read; else samples are available immediately
+    """
+
+    def __init__(self, dat, fs, ch_names=None, paced=False):
+        self.dat = dat
+        self.fs = fs
+        self.ch_names = ch_names
+        self.paced = paced
+        self.idx = 0
+        self.t_start = None
+
+    def _released(self):
+        if not self.paced:
+            return self.dat.shape[1]
+        if self.t_start is None:
+            return 0
+        return min(self.dat.shape[1], int((time.perf_counter() - self.t_start)*self.fs))
+
+    def available(self):
+        return self._released() - self.idx
+
+    def read(self, num_samples):
+        if self.idx + num_samples > self.dat.shape[1]:
+            return None
+        if self.paced:
+            if self.t_start is None:
+                self.t_start = time.perf_counter()
+            t_arrival = self.t_start + (self.idx + num_samples)/self.fs
+            wait = t_arrival - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_arrival = t_arrival
+        else:
+            self.last_arrival = time.perf_counter()
+        dat_ = self.dat[:, self.idx:self.idx+num_samples]
+        self.idx += num_samples
+        return dat_
+
+
+class SocketStreamSource(StreamSource):
+    """
+    Receive a data stream over TCP, see replay_server.py
+
+    Args:
+        host (string)
+        port (int)
+        timeout (float, optional): socket timeout in s
+    """
+
+    def __init__(self, host='127.0.0.1', port=50001, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        header_len = struct.unpack('!I', self._recv_exact(4))[0]
+        header = json.loads(self._recv_exact(header_len).decode('utf-8'))
+        self.fs = header["fs"]
+        self.ch_names = header["ch_names"]
+        self.num_channels = len(self.ch_names)
+        self.chunks = deque()  # (array in shape(n_channels, n), arrival time)
+        self.num_buffered = 0
+        self.ended = False
+
+    def _recv_exact(self, num_bytes):
+        buf = bytearray(num_bytes)
+        view = memoryview(buf)
+        pos = 0
+        while pos < num_bytes:
+            n = self.sock.recv_into(view[pos:], num_bytes - pos)
+            if n == 0:
+                raise ConnectionError('stream closed by server')
+            pos += n
+        return buf
+
+    def _recv_packet(self):
+        num_samples = struct.unpack('!I', self._recv_exact(4))[0]
+        if num_samples == 0:
+            self.ended = True
+            return
+        payload = self._recv_exact(num_samples*self.num_channels*4)
+        dat_ = np.frombuffer(payload, dtype='<f4').reshape(num_samples, self.num_channels).T
+        self.chunks.append((dat_, time.perf_counter()))
+        self.num_buffered += num_samples
+
+    def available(self):
+        while not self.ended and select.select([self.sock], [], [], 0)[0]:
+            self._recv_packet()
+        return self.num_buffered
+
+    def read(self, num_samples):
+        while self.num_buffered < num_samples and not self.ended:
+            self._recv_packet()
+        if self.num_buffered < num_samples:
+            return None
+
+        out = np.empty([self.num_channels, num_samples])
+        pos = 0
+        while pos < num_samples:
+            dat_, t_arrival = self.chunks[0]
+            n = min(dat_.shape[1], num_samples - pos)
+            out[:, pos:pos+n] = dat_[:, :n]
+            if n == dat_.shape[1]:
+                self.chunks.popleft()
+            else:
+                self.chunks[0] = (dat_[:, n:], t_arrival)
+            pos += n
+        self.num_buffered -= num_samples
+        self.last_arrival = t_arrival
+        return out
+
+    def close(self):
+        self.sock.close()
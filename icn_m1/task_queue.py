@@ -0,0 +1,268 @@
+"""
+Resumable process pool for long running parameter sweeps, e.g. the best channel decoding.
+
+Every task has a unique key, typically the name of its output file. The state of every task is
+kept in a persistent SQLite ledger:
+
+    pending -> running -> done
+                       -> pending (retry) -> ... -> failed (after max_retries retries)
+
+A fixed number of worker processes is started once. Each worker receives its next task as soon
+as it is idle, so a slow task never blocks the others, and tasks are pulled lazily from the task
+iterable, such that at most n_jobs task arguments are held in memory. A task which exceeds the
+timeout is stopped by terminating its worker, which is replaced by a new one. Every worker reports
+through its own result pipe, such that a worker terminated while sending can not corrupt the results
+of the other workers. If the sweep is
+stopped or crashes, tasks found in the running state on restart are set back to pending and done
+tasks are skipped, hence nothing is lost or computed twice. Tasks should write their results
+with save_atomic, s.t. an interrupted task never leaves a partial file.
+
+Example:
+    ledger = task_queue.TaskLedger(os.path.join(settings['out_path_process'], 'task_ledger.sqlite'))
+    tasks = ((key, args) for key, args in ... if not ledger.is_done(key))
+    task_queue.run_tasks(ledger, tasks, pool_function, n_jobs=50, max_retries=2, timeout=3600)
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import sqlite3
+import time
+import traceback
+import numpy as np
+
+STATES = ("pending", "running", "done", "failed")
+
+
+def save_atomic(out_file, arr):
+    """
+    write a npy file under a temporary name and rename it, s.t. a crash never leaves a partial file
+
+    Args:
+        out_file (string): ending with .npy
+        arr: np array or object which is saved with np.save, e.g. a dict
+    """
+    tmp_file = out_file[:-4] + '.tmp' + str(os.getpid()) + '.npy'
+    np.save(tmp_file, arr)
+    os.replace(tmp_file, out_file)
+
+
+class TaskLedger:
+    """
+    Persistent state of all tasks of a sweep
+
+    Args:
+        db_file (string): SQLite file, created if it does not exist
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.con = sqlite3.connect(db_file, timeout=60)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS tasks (key TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                         "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL)")
+        self.con.commit()
+
+    def get_status(self, key):
+        """
+        Returns:
+            string: one of STATES, None for unknown tasks
+        """
+        row = self.con.execute("SELECT status FROM tasks WHERE key=?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def is_done(self, key):
+        return self.get_status(key) == "done"
+
+    def get_attempts(self, key):
+        row = self.con.execute("SELECT attempts FROM tasks WHERE key=?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def get_keys(self, status):
+        return [row[0] for row in self.con.execute("SELECT key FROM tasks WHERE status=? ORDER BY key", (status,))]
+
+    def get_errors(self):
+        """
+        Returns:
+            dict: key: traceback of the last failed attempt, for all failed tasks
+        """
+        return dict(self.con.execute("SELECT key, error FROM tasks WHERE status='failed'").fetchall())
+
+    def summary(self):
+        """
+        Returns:
+            dict: number of tasks per state
+        """
+        counts = dict(self.con.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in STATES}
+
+    def set_status(self, key, status, error=None, attempt=False):
+        """
+        set the state of a task, add the task if it is unknown
+
+        Args:
+            key (string)
+            status (string): one of STATES
+            error (string, optional): traceback of a failed attempt
+            attempt (bool): if True the number of attempts is increased by one
+        """
+        self.con.execute("INSERT INTO tasks (key, status, attempts, error, updated) VALUES (?, ?, ?, ?, ?) "
+                         "ON CONFLICT(key) DO UPDATE SET status=excluded.status, attempts=attempts+?, "
+                         "error=COALESCE(excluded.error, error), updated=excluded.updated",
+                         (key, status, int(attempt), error, time.time(), int(attempt)))
+        self.con.commit()
+
+    def recover(self, retry_failed=False):
+        """
+        set tasks which were running when the previous sweep stopped back to pending
+
+        Args:
+            retry_failed (bool): if True, failed tasks are set to pending with their attempts reset
+        """
+        self.con.execute("UPDATE tasks SET status='pending' WHERE status='running'")
+        if retry_failed:
+            self.con.execute("UPDATE tasks SET status='pending', attempts=0 WHERE status='failed'")
+        self.con.commit()
+
+
+def _worker_loop(func, task_q, result_conn):
+    while True:
+        item = task_q.get()
+        if item is None:
+            break
+        task_id, args = item
+        try:
+            func(*args)
+            result_conn.send((task_id, None))
+        except Exception:
+            result_conn.send((task_id, traceback.format_exc()))
+
+
+class _Worker:
+
+    def __init__(self, ctx, func):
+        self.task_q = ctx.Queue()
+        self.result_conn, child_conn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=_worker_loop, args=(func, self.task_q, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()  # the worker holds the only write end, s.t. its exit is seen as EOF
+        self.task = None
+        self.task_id = None
+        self.t_start = None
+
+    def submit(self, task, task_id):
+        self.task, self.task_id, self.t_start = task, task_id, time.time()
+        self.task_q.put((task_id, task[1]))
+
+    def release(self):
+        task = self.task
+        self.task, self.task_id, self.t_start = None, None, None
+        return task
+
+    def stop(self, terminate=False):
+        if terminate:
+            self.process.terminate()
+        else:
+            self.task_q.put(None)
+        self.process.join()
+        self.result_conn.close()
+
+
+def run_tasks(ledger, tasks, func, n_jobs=None, max_retries=2, timeout=None, retry_failed=False, Verbose=True):
+    """
+    run func(*args) for all (key, args) of tasks which are not done yet in a pool of n_jobs processes
+
+    Args:
+        ledger (TaskLedger)
+        tasks (iterable): (key, args) tuples, consumed lazily; keys must be unique
+        func (function): top level function (picklable), which writes its own results
+        n_jobs (int, optional): number of processes, defaults to the number of CPUs
+        max_retries (int): number of repetitions of a failed or timed out task
+        timeout (float, optional): time in s after which a task is stopped and counted as failed
+        retry_failed (bool): if True, tasks which failed in a previous sweep are repeated
+        Verbose (bool)
+
+    Returns:
+        dict: number of tasks per state, see TaskLedger.summary
+    """
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    ledger.recover(retry_failed)
+    ctx = multiprocessing.get_context()
+    workers = [_Worker(ctx, func) for _ in range(n_jobs)]
+    retry = []  # (key, args) of failed attempts which are repeated
+    tasks = iter(tasks)
+    exhausted = False
+
+    def next_task():
+        nonlocal exhausted
+        if retry:
+            return retry.pop(0)
+        while not exhausted:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+            elif ledger.get_status(task[0]) not in ("done", "failed"):
+                return task
+        return None
+
+    def finish(task, error):
+        key = task[0]
+        if error is None:
+            ledger.set_status(key, "done")
+            if Verbose:
+                print("done: " + str(key))
+        elif ledger.get_attempts(key) <= max_retries:
+            ledger.set_status(key, "pending", error)
+            retry.append(task)
+            if Verbose:
+                print("retrying: " + str(key) + "\n" + error)
+        else:
+            ledger.set_status(key, "failed", error)
+            if Verbose:
+                print("failed: " + str(key) + "\n" + error)
+
+    task_id = 0
+    try:
+        while True:
+            for worker in workers:
+                if worker.task is None:
+                    task = next_task()
+                    if task is None:
+                        break
+                    ledger.set_status(task[0], "running", attempt=True)
+                    task_id += 1
+                    worker.submit(task, task_id)
+            if all(worker.task is None for worker in workers):
+                break
+
+            busy = [worker for worker in workers if worker.task is not None]
+            for conn in multiprocessing.connection.wait([worker.result_conn for worker in busy], timeout=1):
+                worker = next(worker for worker in busy if worker.result_conn is conn)
+                try:
+                    task_id_done, error = conn.recv()
+                except EOFError:  # the worker exited, see below
+                    continue
+                if worker.task_id == task_id_done:
+                    finish(worker.release(), error)
+
+            for worker_idx, worker in enumerate(workers):
+                if worker.task is None:
+                    continue
+                if timeout is not None and time.time() - worker.t_start > timeout:
+                    error = "timeout after " + str(timeout) + " s"
+                elif not worker.process.is_alive():
+                    error = "worker exited with code " + str(worker.process.exitcode)
+                else:
+                    continue
+                worker.stop(terminate=True)
+                workers[worker_idx] = _Worker(ctx, func)
+                finish(worker.release(), error)
+    finally:
+        for worker in workers:
+            worker.stop(terminate=worker.task is not None)
+        ledger.recover()
+
+    summary = ledger.summary()
+    if Verbose:
+        print(summary)
+    return summary
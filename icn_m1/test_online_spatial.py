@@ -0,0 +1,36 @@
+import os
+import sys
+import numpy as np
+from mne.decoding import SPoC
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ECOG_vs_STN', 'SSD', 'Utilities'))
+import ssd
+import online_spatial
+
+FILT_PARAMS_SIGNAL = dict(l_freq=8, h_freq=12, l_trans_bandwidth=1, h_trans_bandwidth=1, verbose=False)
+FILT_PARAMS_NOISE = dict(l_freq=5, h_freq=15, l_trans_bandwidth=1, h_trans_bandwidth=1, verbose=False)
+
+
+def test_online_ssd_window_equals_offline_fit():
+    rng = np.random.RandomState(0)
+    X = rng.randn(30, 4, 1000)
+    ssd_online = online_spatial.OnlineSSD(FILT_PARAMS_SIGNAL, FILT_PARAMS_NOISE, 1000, window=10, refit_every=None)
+    for epoch in X:
+        ssd_online.partial_fit(epoch[None])
+    ssd_online.solve()
+    ssd_offline = ssd.SSD(FILT_PARAMS_SIGNAL, FILT_PARAMS_NOISE, 1000).fit(X[-10:])
+    np.testing.assert_allclose(ssd_online.eigvals_, ssd_offline.eigvals_, rtol=1e-6)
+
+
+def test_online_spoc_window_equals_offline_fit():
+    rng = np.random.RandomState(0)
+    X = rng.randn(60, 4, 200)
+    y = rng.randn(60)
+    spoc_online = online_spatial.OnlineSPoC(n_components=2, reg='oas', rank='full', window=20, refit_every=None)
+    for epoch, target in zip(X, y):
+        spoc_online.partial_fit(epoch[None], target[None])
+    spoc_online.solve()
+    spoc_offline = SPoC(n_components=2, reg='oas', rank='full').fit(X[-20:], y[-20:])
+    filters_online = spoc_online.filters_ / np.linalg.norm(spoc_online.filters_, axis=1, keepdims=True)
+    filters_offline = spoc_offline.filters_ / np.linalg.norm(spoc_offline.filters_, axis=1, keepdims=True)
+    np.testing.assert_allclose(np.abs(np.sum(filters_online * filters_offline, axis=1)), 1, rtol=1e-8)
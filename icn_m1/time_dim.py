@@ -0,0 +1,49 @@
+"""
+Time lagged features, shared by the offline, online and cross validation scripts.
+
+append_time_dim stacks for every sample the features of the current and the previous
+time_stamps-1 samples, newest first. Instead of copying sample by sample, the lags are a
+strided view of the input (numpy sliding_window_view), which is returned read only:
+
+    X in shape(time, features)             -> view in shape(time-time_stamps, time_stamps, features)
+    X in shape(time, grid_points, f_bands) -> view in shape(time-time_stamps, grid_points, time_stamps, f_bands)
+
+With materialize=True the view is copied once into the previous layout, shape(time-time_stamps,
+time_stamps*features) respectively shape(time-time_stamps, grid_points, time_stamps*f_bands), with
+column blocks [X[t], X[t-1], ..., X[t-time_stamps+1]]. A flattening reshape of the view gives the
+same array.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def append_time_dim(X, y_=None, time_stamps=5, materialize=False):
+    """
+    apply added time dimension for the data array and label given time_stamps (with downsample_rate=100) in 100ms
+
+    The first sample with a time dimension is X[time_stamps], such that every label y_[time_stamps:] has a
+    full history. If time_stamps equals the number of samples of a 2-D X, as in the online analysis, the
+    single newest sample X[-1] is returned; the label is y_[time_stamps:] nevertheless.
+
+    Args:
+        X (np array): shape(time, features) or shape(time, grid_points/channels, f_bands)
+        y_ (np array, optional): label in shape(time)
+        time_stamps (int): number of stacked samples
+        materialize (bool): if True return a (writeable) array in the flat layout, else a read only view
+
+    Returns:
+        time_arr (np array): see module docstring
+        y_ (np array): y_[time_stamps:], only if y_ is given
+    """
+    X = np.asarray(X)
+    start = time_stamps - 1 if X.ndim == 2 and time_stamps == X.shape[0] else time_stamps
+    # windows[j, ..., k] = X[j+k], the newest sample of window j is X[j+time_stamps-1]
+    windows = sliding_window_view(X, time_stamps, axis=0)[start-time_stamps+1:, ..., ::-1]
+    time_arr = np.moveaxis(windows, -1, -2)
+    if materialize:
+        time_arr = time_arr.reshape(time_arr.shape[:-2] + (time_arr.shape[-2]*time_arr.shape[-1],))
+        if np.shares_memory(time_arr, X):
+            time_arr = time_arr.copy()
+    if y_ is None:
+        return time_arr
+    return time_arr, y_[time_stamps:]
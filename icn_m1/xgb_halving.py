@@ -0,0 +1,162 @@
+"""
+Successive halving search of XGBoost hyperparameters.
+
+The cross validation data is converted once per fold into a QuantileDMatrix (the quantized input
+of the hist tree method, a DMatrix for xgboost versions without it), instead of once per trial.
+n_configs random configurations of the search space are boosted for a few rounds on every fold,
+the best 1/eta of them are boosted further, and so on until max_rounds rounds. Boosters are
+continued from the previous rung, such that no boosting round is computed twice.
+
+The score is the r2 of xgb.cv in optimize_xgb of the best_electrode_classification scripts: r2 of
+every fold clipped at 0 and averaged over folds.
+
+Several targets with the same features, e.g. the contralateral and ipsilateral movement of one
+channel, share the quantized fold matrices: for y in shape(n_samples, n_targets) only the labels of
+the matrices are exchanged between targets, and fit_multi trains the final boosters of all targets on
+one QuantileDMatrix.
+
+Example:
+    res = xgb_halving.optimize_xgb_halving(dat_tr, label_tr, space_XGB)
+    model = XGBRegressor(max_depth=res['x'][0], learning_rate=res['x'][1], gamma=res['x'][2])
+"""
+import numpy as np
+import xgboost as xgb
+from scipy.optimize import OptimizeResult
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold
+
+FIXED_PARAMS = {
+    'subsample': 0.8,
+    'eta': 0.1,
+    'disable_default_eval_metric': 1,
+    'tree_method': 'hist'
+}
+
+
+def get_dmatrix(x, y=None, ref=None, max_bin=256):
+    """
+    QuantileDMatrix, or DMatrix for xgboost versions without it; test data is quantized with the bins of ref
+    """
+    if hasattr(xgb, 'QuantileDMatrix'):
+        if ref is None:
+            return xgb.QuantileDMatrix(x, label=y, max_bin=max_bin)
+        return xgb.QuantileDMatrix(x, label=y, ref=ref)
+    return xgb.DMatrix(x, label=y)
+
+
+def get_fold_dmatrices(x, nfold=3, seed=0, max_bin=256):
+    """
+    Returns:
+        list of tuples: (dtrain, dtest, train_index, test_index) of every fold, the labels are set by the caller
+    """
+    folds = []
+    for train_index, test_index in KFold(n_splits=nfold, shuffle=True, random_state=seed).split(x):
+        dtrain = get_dmatrix(x[train_index], max_bin=max_bin)
+        dtest = get_dmatrix(x[test_index], ref=dtrain)
+        folds.append((dtrain, dtest, train_index, test_index))
+    return folds
+
+
+def get_rungs(max_rounds=30, eta=3, num_rungs=3):
+    """
+    Returns:
+        list: cumulative number of boosting rounds of every rung, e.g. [3, 10, 30]
+    """
+    return [max(1, int(round(max_rounds / eta**k))) for k in range(num_rungs-1, -1, -1)]
+
+
+def optimize_xgb_halving(x, y, space, n_configs=27, eta=3, max_rounds=30, num_rungs=3, nfold=3, fixed_params=None,
+                         random_state=0, Verbose=False, folds=None):
+    """
+    successive halving over boosting rounds of random configurations of space
+
+    Args:
+        x (np array): shape(n_samples, n_features)
+        y (np array): shape(n_samples), or shape(n_samples, n_targets) for an independent search per target
+        space (list): skopt dimensions named max_depth, learning_rate and gamma, e.g. space_XGB
+        n_configs (int): number of sampled configurations
+        eta (int): reduction factor, the best 1/eta configurations are promoted to the next rung
+        max_rounds (int): boosting rounds of the last rung
+        num_rungs (int)
+        nfold (int): number of cross validation folds
+        fixed_params (dict, optional): xgboost parameters which are not searched, defaults to FIXED_PARAMS
+        random_state (int)
+        Verbose (bool)
+        folds (list, optional): get_fold_dmatrices(x, nfold, random_state), if already computed
+
+    Returns:
+        OptimizeResult: as returned by skopt.gp_minimize, x=[value of every dimension of space] and fun=-r2;
+            x_iters and func_vals contain all configurations with the score of their last rung.
+            For y in shape(n_samples, n_targets) a list with one OptimizeResult per target
+    """
+    y = np.asarray(y)
+    if folds is None:
+        folds = get_fold_dmatrices(np.asarray(x), nfold, random_state)
+    if y.ndim == 2:
+        return [optimize_xgb_halving(x, y[:, target], space, n_configs, eta, max_rounds, num_rungs, nfold,
+                                     fixed_params, random_state, Verbose, folds) for target in range(y.shape[1])]
+    if fixed_params is None:
+        fixed_params = FIXED_PARAMS
+    rng = np.random.RandomState(random_state)
+    configs = [[dim.rvs(random_state=rng)[0] for dim in space] for _ in range(n_configs)]
+    configs = [[int(value) if isinstance(value, (np.integer, int)) else float(value) for value in config]
+               for config in configs]
+
+    boosters = {idx: [None]*nfold for idx in range(n_configs)}
+    scores = {}
+    alive = list(range(n_configs))
+    rounds_done = 0
+    for rung_idx, rounds in enumerate(get_rungs(max_rounds, eta, num_rungs)):
+        for idx in alive:
+            params_ = dict(fixed_params)
+            params_.update({dim.name: value for dim, value in zip(space, configs[idx])})
+            params_['seed'] = random_state
+            r2 = []
+            for fold_idx, (dtrain, dtest, train_index, test_index) in enumerate(folds):
+                dtrain.set_label(y[train_index])
+                label_test = y[test_index]
+                boosters[idx][fold_idx] = xgb.train(params_, dtrain, num_boost_round=rounds-rounds_done,
+                                                    xgb_model=boosters[idx][fold_idx])
+                r2.append(max(r2_score(label_test, boosters[idx][fold_idx].predict(dtest)), 0))
+            scores[idx] = np.mean(r2)
+        rounds_done = rounds
+        alive = sorted(alive, key=lambda idx: -scores[idx])
+        if Verbose:
+            print('rung '+str(rung_idx)+' rounds: '+str(rounds)+' configurations: '+str(len(alive))+
+                  ' best r2: '+str(scores[alive[0]]))
+        if rung_idx < num_rungs-1:
+            for idx in alive[max(1, len(alive)//eta):]:
+                boosters[idx] = None
+            alive = alive[:max(1, len(alive)//eta)]
+
+    best = alive[0]
+    return OptimizeResult(x=configs[best], fun=-scores[best], x_iters=configs,
+                          func_vals=np.array([-scores[idx] for idx in range(n_configs)]))
+
+
+def fit_multi(x, y, configs, space, num_boost_round=100, fixed_params=None, random_state=0):
+    """
+    train one booster per target on a shared QuantileDMatrix
+
+    Args:
+        x (np array): shape(n_samples, n_features)
+        y (np array): shape(n_samples, n_targets)
+        configs (list): value of every dimension of space for every target, e.g. the x of optimize_xgb_halving
+        space (list): skopt dimensions
+        num_boost_round (int): number of trees, n_estimators of XGBRegressor
+
+    Returns:
+        dtrain: the shared training matrix
+        list: booster of every target
+    """
+    if fixed_params is None:
+        fixed_params = FIXED_PARAMS
+    dtrain = get_dmatrix(np.asarray(x))
+    boosters = []
+    for target, config in enumerate(configs):
+        params_ = dict(fixed_params)
+        params_.update({dim.name: value for dim, value in zip(space, config)})
+        params_['seed'] = random_state
+        dtrain.set_label(y[:, target])
+        boosters.append(xgb.train(params_, dtrain, num_boost_round=num_boost_round))
+    return dtrain, boosters